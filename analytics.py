@@ -0,0 +1,171 @@
+"""
+Vectorized staking analytics over a DelegationTable.
+
+The shrimp/dolphin buckets of every validator are computed at once with
+NumPy group-by reductions over the stake column, instead of a Python loop
+over every delegation; counts and totals come straight from the table. The
+output matches the per-delegation functions in delegations.py exactly:
+bucket sums are accumulated with np.bincount, which adds each group's values
+in row order just like the loop does.
+"""
+
+from typing import Dict, Tuple
+
+import metrics
+
+# NumPy is imported on first use; None until then, or when not installed
+np = None
+_numpy_checked = False
+
+# Delegations below this many tokens are grouped as shrimp
+SHRIMP_THRESHOLD = 1000
+# Delegations above this many tokens are listed individually; the rest are
+# grouped as dolphins
+DOLPHIN_THRESHOLD = 10000
+
+SHRIMP = "\U0001f990"
+DOLPHIN = "\U0001f42c"
+
+
+def _load_numpy() -> bool:
+    """
+    Import NumPy on first use. Returns whether it is installed.
+    """
+    global np, _numpy_checked
+    if not _numpy_checked:
+        _numpy_checked = True
+        try:
+            with metrics.span("import"):
+                import numpy
+
+            np = numpy
+        except ImportError:
+            pass
+    return np is not None
+
+
+def stake_buckets(
+    table, shrimp_threshold=SHRIMP_THRESHOLD, dolphin_threshold=DOLPHIN_THRESHOLD
+):
+    """
+    Split every validator's delegations into shrimp, dolphin and individual
+    entries.
+
+    Returns:
+        tuple: (shrimp_sums, dolphin_sums, individual_rows) where the sums are
+        per-validator token amounts and individual_rows holds the row of every
+        delegation above `dolphin_threshold`, in table order
+    """
+    _load_numpy()
+    stakes = np.frombuffer(table.stakes, dtype=np.uint64)
+    offsets = np.frombuffer(table.offsets, dtype=np.uint64).astype(np.intp)
+    counts = np.diff(offsets)
+    groups = np.repeat(np.arange(len(counts)), counts)
+
+    tokens = stakes / (10**8)
+    individual = tokens > dolphin_threshold
+    shrimp = tokens < shrimp_threshold
+    dolphin = ~(individual | shrimp)
+
+    shrimp_sums = np.bincount(
+        groups[shrimp], weights=tokens[shrimp], minlength=len(counts)
+    )
+    dolphin_sums = np.bincount(
+        groups[dolphin], weights=tokens[dolphin], minlength=len(counts)
+    )
+    return shrimp_sums, dolphin_sums, np.flatnonzero(individual)
+
+
+def nivo_json(
+    table, shrimp_threshold=SHRIMP_THRESHOLD, dolphin_threshold=DOLPHIN_THRESHOLD
+) -> Dict:
+    """
+    delegations_to_nivo_json for a DelegationTable.
+    Falls back to a loop over the stake column when NumPy isn't installed.
+    """
+    if not _load_numpy():
+        return _nivo_json_python(table, shrimp_threshold, dolphin_threshold)
+
+    shrimp_sums, dolphin_sums, individual_rows = stake_buckets(
+        table, shrimp_threshold, dolphin_threshold
+    )
+    stakes = np.frombuffer(table.stakes, dtype=np.uint64)
+    individual_tokens = (stakes[individual_rows] / (10**8)).tolist()
+    # Stakes above 2**53 lose precision as floats; divide those as ints like
+    # the per-delegation loop does
+    for i in np.flatnonzero(stakes[individual_rows] > 2**53).tolist():
+        individual_tokens[i] = table.stakes[individual_rows[i]] / (10**8)
+
+    # First and last individual entry of every validator
+    offsets = np.frombuffer(table.offsets, dtype=np.uint64).astype(np.intp)
+    bounds = np.searchsorted(individual_rows, offsets).tolist()
+    individual_rows = individual_rows.tolist()
+
+    addresses = table.addresses
+    stakers = table.stakers
+    result = {"address": "Total Staked", "children": []}
+    for group, validator in enumerate(table.validators):
+        children = [
+            {
+                "address": addresses[stakers[individual_rows[i]]],
+                "amount": round(individual_tokens[i], 2),
+            }
+            for i in range(bounds[group], bounds[group + 1])
+        ]
+        _append_buckets(children, float(shrimp_sums[group]), float(dolphin_sums[group]))
+
+        if children:
+            result["children"].append({"address": validator, "children": children})
+    return result
+
+
+def _nivo_json_python(table, shrimp_threshold, dolphin_threshold) -> Dict:
+    result = {"address": "Total Staked", "children": []}
+    for validator, delegations in table:
+        children = []
+        shrimp_sum = 0
+        dolphin_sum = 0
+        # Only individual entries need the staker address
+        for i, wei in enumerate(delegations.stakes):
+            tokens = wei / (10**8)
+            if tokens > dolphin_threshold:
+                children.append(
+                    {"address": delegations.staker(i), "amount": round(tokens, 2)}
+                )
+            elif tokens < shrimp_threshold:
+                shrimp_sum += tokens
+            else:
+                dolphin_sum += tokens
+        _append_buckets(children, shrimp_sum, dolphin_sum)
+
+        if children:
+            result["children"].append({"address": validator, "children": children})
+    return result
+
+
+def _append_buckets(children, shrimp_sum, dolphin_sum) -> None:
+    if shrimp_sum > 0:
+        children.append({"address": SHRIMP, "amount": round(shrimp_sum, 2)})
+    if dolphin_sum > 0:
+        children.append({"address": DOLPHIN, "amount": round(dolphin_sum, 2)})
+
+    # Sort all children by amount (descending) to maintain proper order
+    children.sort(key=lambda x: x["amount"], reverse=True)
+
+
+def validator_stats(table) -> Tuple[Dict[str, int], Dict[str, float]]:
+    """
+    calculate_validator_stats for a DelegationTable.
+    Counts come from the group offsets and totals are the exact integer sums
+    kept by the table, so no delegation is visited.
+    """
+    offsets = table.offsets
+    delegations_count = {
+        validator: offsets[group + 1] - offsets[group]
+        for group, validator in enumerate(table.validators)
+    }
+    total_stake = {
+        validator: round(total / (10**8), 2)
+        for validator, total in zip(table.validators, table.totals)
+    }
+    return delegations_count, total_stake
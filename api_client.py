@@ -0,0 +1,140 @@
+"""
+Client for the builder codes API.
+
+All posts share one pooled requests.Session. Connection errors and 5xx
+responses are retried with exponential backoff, bodies are serialized with
+orjson when it is installed and can be gzip encoded, and only a summary of
+each payload is logged. Snapshot posts aren't idempotent, so read timeouts
+are not retried: the server may have stored the snapshot already.
+
+Settings come from the environment:
+- BUILDER_CODES_HOST, BUILDER_CODES_TOKEN: API host and token
+- BUILDER_CODES_GZIP: set to 1 to gzip request bodies
+- BUILDER_CODES_TIMEOUT: seconds to wait for a response (default 60)
+- BUILDER_CODES_RETRIES: retries per request (default 3)
+"""
+
+import gzip
+import json
+import os
+import threading
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+import metrics
+
+# requests is imported when the session is first needed, so runs that never
+# post don't load it
+if TYPE_CHECKING:
+    import requests
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+RETRY_STATUSES = (500, 502, 503, 504)
+# Bodies smaller than this aren't worth compressing
+GZIP_MIN_BYTES = 1024
+
+_session: Optional["requests.Session"] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> "requests.Session":
+    """
+    Return the shared session, creating it on first use.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            with metrics.span("import"):
+                import requests
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+
+            retries = int(os.getenv("BUILDER_CODES_RETRIES", "3"))
+            # POSTs are retried, but only when the request can't have been
+            # processed: it never connected, or the server answered with one
+            # of RETRY_STATUSES
+            retry = Retry(
+                total=retries,
+                connect=retries,
+                read=0,
+                other=0,
+                status=retries,
+                backoff_factor=1,
+                status_forcelist=RETRY_STATUSES,
+                allowed_methods=None,
+                raise_on_status=False,
+            )
+            session = requests.Session()
+            session.mount("http://", HTTPAdapter(max_retries=retry))
+            session.mount("https://", HTTPAdapter(max_retries=retry))
+            _session = session
+    return _session
+
+
+def dumps(payload: Any) -> bytes:
+    """
+    Serialize `payload` to JSON bytes, with orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(",", ":")).encode("utf-8")
+
+
+def summarize_payload(payload: Dict, size: int) -> str:
+    """
+    Describe a snapshot payload by its fields instead of printing it whole,
+    e.g. "builder_codes_snapshot: data (24 entries), taken_at=... (3.1 KB)".
+    """
+
+    def describe(key: str, value: Any) -> str:
+        if isinstance(value, (dict, list)):
+            return f"{key} ({len(value)} entries)"
+        return f"{key}={value}"
+
+    parts = []
+    for name, body in payload.items():
+        if not isinstance(body, dict):
+            # Not a snapshot, e.g. a payload posted by `cli.py post`
+            parts.append(describe(name, body))
+            continue
+        fields = [describe(key, value) for key, value in body.items()]
+        parts.append(f"{name}: {', '.join(fields)}")
+    return f"{'; '.join(parts)} ({size / 1024:.1f} KB)"
+
+
+def post_json(path: str, payload: Dict) -> "requests.Response":
+    """
+    POST `payload` to `path` on BUILDER_CODES_HOST.
+
+    Args:
+        path: API path, e.g. /api/v1/staking_snapshots
+        payload: JSON-serializable body
+
+    Returns:
+        requests.Response: the final response after any retries
+
+    Raises:
+        RuntimeError: if BUILDER_CODES_TOKEN is not set
+        requests.RequestException: if the request still fails after retries
+    """
+    token = os.getenv("BUILDER_CODES_TOKEN")
+    host = os.getenv("BUILDER_CODES_HOST")
+    if not token:
+        raise RuntimeError("BUILDER_CODES_TOKEN environment variable not set")
+
+    body = dumps(payload)
+    print("Sending payload to API:", summarize_payload(payload, len(body)))
+
+    headers = {"X-Token": token, "Content-Type": "application/json"}
+    if os.getenv("BUILDER_CODES_GZIP") == "1" and len(body) >= GZIP_MIN_BYTES:
+        body = gzip.compress(body, compresslevel=6)
+        headers["Content-Encoding"] = "gzip"
+
+    timeout = float(os.getenv("BUILDER_CODES_TIMEOUT", "60"))
+    with metrics.span(f"POST {path}", bytes=len(body)):
+        return get_session().post(
+            f"{host}{path}", data=body, headers=headers, timeout=(10, timeout)
+        )
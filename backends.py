@@ -0,0 +1,266 @@
+"""
+Parser backends for the extraction pass.
+
+Every backend walks one JSON document and hands the requested key paths to
+their consumers:
+- ijson: byte-oriented event parser on ijson's native yajl backend
+- rust: json_stream driven by json-stream-rs-tokenizer
+- python: json_stream with its pure-Python tokenizer
+
+"auto" picks the first one that is installed, in that order (fastest first).
+MessagePack (.rmp) snapshots are read by the msgpack backend in rmp.py.
+"""
+
+import importlib.util
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+Path = Tuple[str, ...]
+
+BACKENDS = ("ijson", "rust", "python")
+
+# Marker key under which a path's consumers are stored in the target trie
+_LEAF = None
+
+_START_EVENTS = ("start_map", "start_array")
+_END_EVENTS = ("end_map", "end_array")
+
+_selected: Dict[str, Any] = {}
+# Names whose choice has been printed
+_logged: set = set()
+
+
+def build_targets(requests: Iterable[Tuple[Path, Any]]) -> Dict:
+    """
+    Build a trie from (path, consumer) pairs.
+    Each leaf maps the _LEAF marker to the consumers that asked for the path.
+    """
+    targets: Dict = {}
+    for path, consumer in requests:
+        node = targets
+        for key in path:
+            node = node.setdefault(key, {})
+        node.setdefault(_LEAF, []).append(consumer)
+    return targets
+
+
+def deliver(path: Path, value: Any, consumers: List[Any], materialize) -> None:
+    """
+    Hand a value to every consumer registered for its path.
+    A stream can only be read once, so a container wanted by more than one
+    consumer is materialized first.
+    """
+    if len(consumers) > 1:
+        value = materialize(value)
+    for consumer in consumers:
+        consumer.handle(path, value)
+
+
+class JsonStreamBackend:
+    """
+    Walks the document with json_stream using the given tokenizer.
+    """
+
+    binary = False
+
+    def __init__(self, name, tokenizer):
+        self.key = name
+        self.name = name
+        self.tokenizer = tokenizer
+
+    def extract(self, f, requests, base: Path, found: set) -> None:
+        """
+        Stream the document in `f` and feed every (path, consumer) request.
+        Request paths are relative to the document, which sits at `base`.
+        """
+        import json_stream
+
+        value: Any = json_stream.load(f, tokenizer=self.tokenizer)
+        targets = build_targets(requests)
+        if _LEAF in targets:
+            self._deliver(base, value, targets[_LEAF])
+            found.add(base)
+        else:
+            self._walk(value, targets, base, found)
+
+    def _deliver(self, path, value, consumers):
+        from json_stream.base import StreamingJSONBase
+
+        def materialize(value):
+            import json_stream
+
+            if isinstance(value, StreamingJSONBase):
+                return json_stream.to_standard_types(value)
+            return value
+
+        deliver(path, value, consumers, materialize)
+
+    def _walk(self, node: Any, targets: Dict, path: Path, found: set) -> None:
+        from json_stream.base import StreamingJSONObject
+
+        if not isinstance(node, StreamingJSONObject):
+            return
+
+        # Iterating a transient object lets json_stream skip every subtree we
+        # don't descend into, regardless of the order keys appear in the file
+        for key, value in node.items():
+            subtargets = targets.get(key)
+            if subtargets is None:
+                continue
+
+            key_path = path + (key,)
+            if _LEAF in subtargets:
+                self._deliver(key_path, value, subtargets[_LEAF])
+                found.add(key_path)
+            else:
+                self._walk(value, subtargets, key_path, found)
+
+
+class IjsonBackend:
+    """
+    Walks the document as a stream of ijson parse events.
+
+    Containers are rebuilt from events with ijson's ObjectBuilder; arrays are
+    handed over one element at a time so they never sit in memory whole.
+    """
+
+    binary = True
+
+    def __init__(self, ijson_backend):
+        from ijson.common import ObjectBuilder
+
+        self.key = "ijson"
+        self.name = f"ijson ({ijson_backend.backend_name})"
+        self.ijson = ijson_backend
+        self.object_builder = ObjectBuilder
+
+    def extract(self, f, requests, base: Path, found: set) -> None:
+        """
+        Stream the document in `f` and feed every (path, consumer) request.
+        Request paths are relative to the document, which sits at `base`.
+        """
+        leaves: Dict[str, Tuple[Path, List[Any]]] = {}
+        for path, consumer in requests:
+            prefix = ".".join(path)
+            leaves.setdefault(prefix, (base + tuple(path), []))[1].append(consumer)
+
+        events = iter(self.ijson.parse(f, use_float=True))
+        for prefix, event, value in events:
+            leaf = leaves.get(prefix)
+            if leaf is None or event == "map_key" or event in _END_EVENTS:
+                continue
+
+            path, consumers = leaf
+            if event == "start_array":
+                items = self._items(events, prefix)
+                deliver(path, items, consumers, list)
+                # Drain whatever the consumers left unread
+                for _ in items:
+                    pass
+            elif event == "start_map":
+                deliver(path, self._build(events, event, value), consumers, _same)
+            else:
+                deliver(path, value, consumers, _same)
+            found.add(path)
+
+    def _build(self, events: Iterator, event: str, value: Any) -> Any:
+        builder = self.object_builder()
+        builder.event(event, value)
+        depth = 1
+        for _, event, value in events:
+            builder.event(event, value)
+            if event in _START_EVENTS:
+                depth += 1
+            elif event in _END_EVENTS:
+                depth -= 1
+                if depth == 0:
+                    break
+        return builder.value
+
+    def _items(self, events: Iterator, prefix: str) -> Iterator[Any]:
+        for item_prefix, event, value in events:
+            if event == "end_array" and item_prefix == prefix:
+                return
+            if event in _START_EVENTS:
+                yield self._build(events, event, value)
+            else:
+                yield value
+
+
+def _same(value: Any) -> Any:
+    # Built objects and scalars can be shared between consumers as they are
+    return value
+
+
+def _load(name: str):
+    if name == "rust":
+        if importlib.util.find_spec("json_stream_rs_tokenizer") is None:
+            return None
+        from json_stream_rs_tokenizer import ExtensionException, rust_tokenizer_or_raise
+
+        try:
+            return JsonStreamBackend("rust", rust_tokenizer_or_raise())
+        except ExtensionException:
+            return None
+    if name == "ijson":
+        if importlib.util.find_spec("ijson") is None:
+            return None
+        import ijson
+
+        for ijson_backend in ("yajl2_c", "yajl2_cffi", "yajl2"):
+            try:
+                return IjsonBackend(ijson.get_backend(ijson_backend))
+            except ImportError:
+                continue
+        return None
+    if name == "msgpack":
+        if importlib.util.find_spec("msgpack") is None:
+            return None
+        from rmp import MsgpackBackend
+
+        return MsgpackBackend()
+    if name == "python":
+        from json_stream.tokenizer import tokenize
+
+        return JsonStreamBackend("python", tokenize)
+    raise ValueError(
+        f"Unknown parser backend {name!r}, expected one of: auto, {', '.join(BACKENDS)}"
+    )
+
+
+def get_backend(name: str = "auto", log: bool = True):
+    """
+    Return the parser backend called `name`, or the fastest installed one for
+    "auto". Backends that aren't installed fall back to the next one in line.
+    The choice is resolved once per name and printed the first time it's
+    asked for with `log`, so quiet lookups (workers, read_snapshot_time)
+    don't hide it from later ones.
+
+    "msgpack" reads .rmp snapshots and has no fallback, since the JSON
+    backends can't parse them.
+    """
+    if name in _selected:
+        backend = _selected[name]
+    else:
+        backend = _selected[name] = _resolve(name)
+    if log and name not in _logged:
+        _logged.add(name)
+        if name not in ("auto", backend.key):
+            print(f"Parser backend {name} is not installed, falling back")
+        print(f"Using {backend.name} parser backend")
+    return backend
+
+
+def _resolve(name: str):
+    if name == "msgpack":
+        candidates = (name,)
+    else:
+        candidates = BACKENDS if name == "auto" else (name,) + BACKENDS
+    for candidate in candidates:
+        backend = _load(candidate)
+        if backend is not None:
+            break
+    else:
+        raise RuntimeError(
+            f"Parser backend {name} is not installed (pip install -r requirements.txt)"
+        )
+    return backend
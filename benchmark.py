@@ -0,0 +1,201 @@
+"""
+Reproducible benchmarks of the parsers and reports on synthetic snapshots.
+
+Each scale multiplies synthetic.DEFAULT_COUNTS. Fixtures are generated once
+per (scale, seed) into the fixture directory and reused. Every case runs in
+a fresh process, so its peak RSS is its own. Time is the best of
+`--repeat` runs. Throughput is reported as MB/s of snapshot for the parse
+cases and as entries/s (users or delegations) for all of them.
+
+Usage:
+    python benchmark.py --scales 1 3 10 --json results.json
+    python benchmark.py --cases parse_delegations --backend rust
+"""
+
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import synthetic
+
+CASES = (
+    "parse_json_file",
+    "parse_delegations",
+    "delegations_to_nivo_json",
+    "calculate_validator_stats",
+    "save_delegations_to_csv",
+)
+# Cases that read the snapshot; the others time a report on a parsed table
+PARSE_CASES = ("parse_json_file", "parse_delegations")
+
+
+def fixture(directory: str, scale: float, seed: int = 0) -> Dict[str, Any]:
+    """
+    Path and generator stats of the fixture for `scale`, generated if missing.
+    """
+    os.makedirs(directory, exist_ok=True)
+    filename = os.path.join(directory, f"snapshot-x{scale:g}-s{seed}.json")
+    meta_filename = filename + ".meta.json"
+    if os.path.exists(filename) and os.path.exists(meta_filename):
+        with open(meta_filename) as f:
+            meta = json.load(f)
+        if meta.get("format") == synthetic.FORMAT:
+            return meta
+
+    counts = {
+        name: max(1, round(count * scale))
+        for name, count in synthetic.DEFAULT_COUNTS.items()
+    }
+    counts["max_t_entries"] = synthetic.DEFAULT_COUNTS["max_t_entries"]
+    print(f"Generating {filename}...")
+    meta = synthetic.generate(filename, seed, counts)
+    meta["filename"] = filename
+    meta["bytes"] = os.path.getsize(filename)
+    with open(meta_filename, "w") as f:
+        json.dump(meta, f)
+    return meta
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def _run_case(case: str, filename: str, backend: str, repeat: int) -> Dict:
+    """
+    Time `case` in this (fresh) process. Returns seconds and peak RSS.
+    """
+    import delegations
+    import main
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        if case == "parse_json_file":
+            run = lambda: main.parse_json_file(
+                filename, backend=backend, use_cache=False
+            )
+        elif case == "parse_delegations":
+            run = lambda: delegations.parse_delegations(
+                filename, backend=backend, use_cache=False
+            )
+        else:
+            table, _ = delegations.parse_delegations(
+                filename, backend=backend, use_cache=False
+            )
+            if case == "save_delegations_to_csv":
+                output = tempfile.NamedTemporaryFile(suffix=".csv", delete=False)
+                output.close()
+                run = lambda: delegations.save_delegations_to_csv(table, output.name)
+            else:
+                report = getattr(delegations, case)
+                run = lambda: report(table)
+
+        best = None
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start_time
+            best = elapsed if best is None else min(best, elapsed)
+
+    if case == "save_delegations_to_csv":
+        os.remove(output.name)
+    return {"seconds": best, "peak_rss_mb": _peak_rss_mb()}
+
+
+def run_case(case: str, meta: Dict[str, Any], backend: str, repeat: int) -> Dict:
+    """
+    Run one case on one fixture in a fresh process and add throughput.
+    """
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1) as pool:
+        result = pool.apply(_run_case, (case, meta["filename"], backend, repeat))
+
+    entries = meta["users"] if case == "parse_json_file" else meta["delegations"]
+    result.update(
+        case=case,
+        scale=meta["scale"],
+        bytes=meta["bytes"],
+        entries=entries,
+        entries_per_second=entries / result["seconds"],
+    )
+    if case in PARSE_CASES:
+        result["mb_per_second"] = meta["bytes"] / (1024 * 1024) / result["seconds"]
+    return result
+
+
+def run_benchmarks(
+    scales: List[float],
+    cases=CASES,
+    backend: str = "auto",
+    repeat: int = 3,
+    directory: str = "bench_data",
+    seed: int = 0,
+) -> List[Dict]:
+    """
+    Run every case at every scale, printing one line per result.
+    """
+    results = []
+    print(
+        f"{'Case':<26} {'Scale':>5} {'Seconds':>8} {'MB/s':>7} "
+        f"{'Entries/s':>11} {'Peak RSS MB':>11}"
+    )
+    print("-" * 73)
+    for scale in scales:
+        meta = fixture(directory, scale, seed)
+        meta["scale"] = scale
+        for case in cases:
+            result = run_case(case, meta, backend, repeat)
+            results.append(result)
+            mb_per_second = result.get("mb_per_second")
+            print(
+                f"{case:<26} {scale:>5g} {result['seconds']:>8.4f} "
+                f"{f'{mb_per_second:.1f}' if mb_per_second else '-':>7} "
+                f"{result['entries_per_second']:>11,.0f} "
+                f"{result['peak_rss_mb']:>11.1f}"
+            )
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from backends import BACKENDS
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scales", type=float, nargs="+", default=[1, 3])
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=list(CASES))
+    parser.add_argument("--backend", choices=("auto",) + BACKENDS, default="auto")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--fixtures",
+        default="bench_data",
+        help="fixture directory (default: bench_data)",
+    )
+    parser.add_argument("--json", metavar="FILE", help="also write the results as JSON")
+    args = parser.parse_args()
+
+    results = run_benchmarks(
+        args.scales, args.cases, args.backend, args.repeat, args.fixtures, args.seed
+    )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "backend": args.backend,
+                    "seed": args.seed,
+                    "results": results,
+                },
+                f,
+                indent=1,
+            )
+        print(f"\nResults written to {args.json}")
@@ -0,0 +1,391 @@
+"""
+Command line entry point for the builder codes and staking parsers.
+
+Subcommands:
+    all                 parse both sections in one pass, publish everything
+                        (what run.sh runs)
+    parse-fees          fee tracker reports, posted to the API
+    parse-delegations   staking reports, CSV upload to R2 and API post
+    export              write the delegations CSV locally
+    upload              upload a file to R2
+    post                post a saved JSON payload to the API
+    watch               stay running and process each new periodic .rmp
+                        snapshot (see watcher.py)
+
+Only the modules a subcommand needs are imported: the parsers and reports
+load without boto3, requests or NumPy, which are imported the first time
+they are used. --no-upload and --no-post turn off the R2 upload and the API
+posts for dry runs. Import time is recorded as "import" spans in the run
+metrics, including boto3, requests and NumPy under the stage that first
+needed them.
+
+Usage:
+    python cli.py all data.json --no-upload --no-post
+    python cli.py export data.json --output delegations.csv.gz --compression gzip
+    python cli.py watch --history history.db
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import csv_export
+import metrics
+from backends import BACKENDS
+
+# Imported lazily; listed in the metrics when a run loaded them
+HEAVY_MODULES = ("boto3", "requests", "numpy")
+
+
+def _add_parse_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "filename",
+        nargs="?",
+        default="data.json",
+        help="snapshot file, named pipe, or - to read stdin (default: data.json)",
+    )
+    parser.add_argument(
+        "--index",
+        action="store_true",
+        help="seek to indexed subtrees instead of streaming the whole file",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=("auto",) + BACKENDS,
+        default="auto",
+        help="JSON parser backend (default: fastest installed)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="aggregate user_states and delegations across this many processes "
+        "(implies --index)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="always parse the snapshot instead of reusing cached aggregates",
+    )
+    _add_memory_budget_argument(parser)
+
+
+def _add_memory_budget_argument(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--memory-budget",
+        type=float,
+        metavar="MB",
+        help="spill aggregates beyond this many MB to disk, without the cache or "
+        "workers (default: MEMORY_BUDGET_MB or no budget)",
+    )
+
+
+def _add_publish_arguments(parser: argparse.ArgumentParser, upload: bool) -> None:
+    if upload:
+        parser.add_argument(
+            "--no-upload",
+            action="store_true",
+            help="save the delegations CSV locally without uploading it to R2",
+        )
+    parser.add_argument(
+        "--no-post", action="store_true", help="don't post the results to the API"
+    )
+
+
+def _add_top_argument(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--top",
+        type=int,
+        metavar="N",
+        help="entries in each Top N report (default: REPORT_TOP_N or 30)",
+    )
+
+
+def _add_compression_argument(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--csv-compression",
+        "--compression",
+        dest="compression",
+        choices=csv_export.COMPRESSIONS,
+        help="compress the delegations CSV as it is written and uploaded",
+    )
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Builder codes and staking snapshot parser"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser(
+        "all", help="parse both sections in one pass and publish everything"
+    )
+    _add_parse_arguments(command)
+    _add_compression_argument(command)
+    _add_top_argument(command)
+    command.add_argument(
+        "--incremental",
+        action="store_true",
+        help="write a delta payload against the previous incremental run",
+    )
+    command.add_argument(
+        "--history",
+        metavar="DB",
+        help="append the results to this SQLite history database",
+    )
+    command.add_argument(
+        "--history-delegators",
+        action="store_true",
+        help="also record every delegator's stakes in the history",
+    )
+    _add_publish_arguments(command, upload=True)
+
+    command = commands.add_parser(
+        "parse-fees", help="fee tracker reports, posted to the API"
+    )
+    _add_parse_arguments(command)
+    _add_top_argument(command)
+    _add_publish_arguments(command, upload=False)
+
+    command = commands.add_parser(
+        "parse-delegations", help="staking reports, CSV upload and API post"
+    )
+    _add_parse_arguments(command)
+    _add_compression_argument(command)
+    _add_publish_arguments(command, upload=True)
+
+    command = commands.add_parser("export", help="write the delegations CSV locally")
+    _add_parse_arguments(command)
+    _add_compression_argument(command)
+    command.add_argument(
+        "--output", help="CSV file to write (default: delegations.csv[.gz|.zst])"
+    )
+
+    command = commands.add_parser("upload", help="upload a file to R2")
+    command.add_argument("file")
+    command.add_argument("key", nargs="?", help="object name (default: file name)")
+
+    command = commands.add_parser("post", help="post a saved JSON payload to the API")
+    command.add_argument("path", help="API path, e.g. /api/v1/staking_snapshots")
+    command.add_argument("payload", help="JSON file with the request body")
+
+    command = commands.add_parser(
+        "watch", help="stay running and process each new periodic snapshot"
+    )
+    command.add_argument(
+        "directory",
+        nargs="?",
+        help="snapshot directory (default: WATCH_DIR or "
+        "~/hl/data/periodic_abci_states)",
+    )
+    command.add_argument(
+        "--ledger", help="ledger of handled snapshots (default: .watch_ledger.json)"
+    )
+    command.add_argument(
+        "--interval",
+        type=float,
+        help="seconds between directory scans (default: WATCH_POLL_INTERVAL or 30)",
+    )
+    command.add_argument(
+        "--once",
+        action="store_true",
+        help="process the newest unhandled snapshot, if any, and exit",
+    )
+    command.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="always parse the snapshot instead of reusing cached aggregates",
+    )
+    _add_memory_budget_argument(command)
+    _add_compression_argument(command)
+    _add_top_argument(command)
+    command.add_argument(
+        "--incremental",
+        action="store_true",
+        help="write a delta payload against the previous incremental run",
+    )
+    command.add_argument(
+        "--history",
+        metavar="DB",
+        help="append the results to this SQLite history database",
+    )
+    command.add_argument(
+        "--history-delegators",
+        action="store_true",
+        help="also record every delegator's stakes in the history",
+    )
+    _add_publish_arguments(command, upload=True)
+    return parser
+
+
+def run_all(args) -> None:
+    with metrics.span("import"):
+        from pipeline import run_pipeline
+
+    run_pipeline(
+        args.filename,
+        args.index,
+        args.backend,
+        args.workers,
+        args.compression,
+        not args.no_cache,
+        args.incremental,
+        args.history,
+        args.top,
+        not args.no_upload,
+        not args.no_post,
+        args.memory_budget,
+        args.history_delegators,
+    )
+
+
+def run_parse_fees(args) -> None:
+    with metrics.span("import"):
+        from main import parse_json_file, send_to_api
+
+    report = parse_json_file(
+        args.filename,
+        args.index,
+        args.backend,
+        args.workers,
+        not args.no_cache,
+        args.top,
+        args.memory_budget,
+    )
+    if args.no_post:
+        print("Skipping builder codes snapshot post")
+    else:
+        send_to_api(*report)
+
+
+def run_parse_delegations(args) -> None:
+    with metrics.span("import"):
+        from delegations import parse_delegations, publish_delegations
+
+    validator_delegations, snapshot_time = parse_delegations(
+        args.filename,
+        args.index,
+        args.backend,
+        args.workers,
+        not args.no_cache,
+        args.memory_budget,
+    )
+    with metrics.span("publish_delegations"):
+        publish_delegations(
+            validator_delegations,
+            snapshot_time,
+            args.compression,
+            not args.no_upload,
+            not args.no_post,
+        )
+
+
+def run_export(args) -> None:
+    with metrics.span("import"):
+        from delegations import parse_delegations, save_delegations_to_csv
+
+    validator_delegations, _ = parse_delegations(
+        args.filename,
+        args.index,
+        args.backend,
+        args.workers,
+        not args.no_cache,
+        args.memory_budget,
+    )
+    output = args.output or "delegations.csv" + csv_export.SUFFIXES[args.compression]
+    with metrics.span("export_csv", entries=validator_delegations.row_count):
+        save_delegations_to_csv(validator_delegations, output, args.compression)
+
+
+def run_upload(args) -> None:
+    with metrics.span("import"):
+        from delegations import upload_to_r2
+
+    content_type = "text/csv"
+    for compression, suffix in csv_export.SUFFIXES.items():
+        if suffix and args.file.endswith(suffix):
+            content_type = csv_export.CONTENT_TYPES[compression]
+    key = args.key or os.path.basename(args.file)
+    with metrics.span("upload", bytes=os.path.getsize(args.file)):
+        if not upload_to_r2(args.file, key, content_type):
+            raise RuntimeError(f"Upload of {args.file} failed")
+
+
+def run_post(args) -> None:
+    with metrics.span("import"):
+        import api_client
+
+    with open(args.payload) as f:
+        payload = json.load(f)
+    response = api_client.post_json(args.path, payload)
+    print(f"{response.status_code}: {response.text[:500]}")
+    if not response.ok:
+        raise RuntimeError(f"POST {args.path} returned {response.status_code}")
+
+
+def run_watch(args) -> None:
+    with metrics.span("import"):
+        from watcher import Ledger, Watcher, warm_up
+
+    warm_up(not args.no_upload, not args.no_post)
+    watcher = Watcher(
+        args.directory,
+        {
+            "csv_compression": args.compression,
+            "use_cache": not args.no_cache,
+            "incremental": args.incremental,
+            "history_db": args.history,
+            "top_n": args.top,
+            "upload": not args.no_upload,
+            "post": not args.no_post,
+            "memory_budget": args.memory_budget,
+            "history_delegators": args.history_delegators,
+        },
+        Ledger(args.ledger),
+        args.interval,
+    )
+    watcher.run(args.once)
+
+
+COMMANDS = {
+    "all": run_all,
+    "parse-fees": run_parse_fees,
+    "parse-delegations": run_parse_delegations,
+    "export": run_export,
+    "upload": run_upload,
+    "post": run_post,
+    "watch": run_watch,
+}
+
+
+def main(argv=None) -> int:
+    """
+    Run one subcommand, print its execution time and write the run metrics.
+    Returns the process exit code.
+    """
+    args = build_parser().parse_args(argv)
+
+    start_time = time.time()
+    exit_code = 0
+    try:
+        with metrics.profiled():
+            COMMANDS[args.command](args)
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        exit_code = 1
+    end_time = time.time()
+    execution_time = end_time - start_time
+    print(f"\nScript execution time: {execution_time:.2f} seconds")
+    # The watcher writes the metrics of each snapshot as it goes
+    if args.command != "watch":
+        metrics.write_metrics(
+            command=args.command,
+            loaded_modules=[name for name in HEAVY_MODULES if name in sys.modules],
+        )
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+"""
+Streaming export of the delegations CSV.
+
+Rows are formatted in large batches straight from the table's columns,
+amounts are rendered exactly from integer wei, and the output can be gzip or
+zstd compressed as it is produced. CsvStream exposes the export as a
+readable file object, so the same bytes can be uploaded to R2 while a local
+copy is written, without reading the file back from disk.
+"""
+
+import csv
+import io
+import re
+import zlib
+from itertools import islice, repeat
+from typing import Iterator, Optional
+from delegation_table import DelegationTable
+
+# Wei per token
+WEI_PER_TOKEN = 10**8
+# Rows formatted per chunk
+BATCH_ROWS = 65536
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+HEADER = ["Validator address", "Staker address", "Amount"]
+
+# Characters that make csv.writer quote a field
+_NEEDS_QUOTING = re.compile(r'[,"\r\n]')
+
+COMPRESSIONS = ("gzip", "zstd")
+SUFFIXES = {None: "", "gzip": ".gz", "zstd": ".zst"}
+CONTENT_TYPES = {
+    None: "text/csv",
+    "gzip": "application/gzip",
+    "zstd": "application/zstd",
+}
+
+
+def format_amount(wei: int) -> str:
+    """
+    Render a wei amount as tokens with 8 decimals, e.g. 150000000 -> 1.50000000.
+    Integer division keeps every digit exact, which a float can't above 2**53
+    wei.
+    """
+    tokens, remainder = divmod(wei, WEI_PER_TOKEN)
+    return f"{tokens}.{remainder:08d}"
+
+
+def _rows(validator_delegations) -> Iterator[tuple]:
+    for validator_address, delegations in validator_delegations:
+        for staker_address, wei_amount in delegations:
+            yield validator_address, staker_address, format_amount(wei_amount)
+
+
+def _plain_text(table: DelegationTable) -> Optional[str]:
+    """
+    Return the table's staker addresses decoded as one string when every row
+    can be written without csv.writer: all addresses are ASCII, so string
+    offsets equal byte offsets, and no field needs quoting.
+    """
+    text = table.addresses.data.decode("utf-8")
+    if len(text) != len(table.addresses.data) or _NEEDS_QUOTING.search(text):
+        return None
+    if any(_NEEDS_QUOTING.search(validator) for validator in table.validators):
+        return None
+    return text
+
+
+def _table_chunks(table: DelegationTable, text: str, batch_rows) -> Iterator[bytes]:
+    # Formats rows straight from the columns, in the same layout as csv.writer
+    address_offsets = table.addresses.offsets.tolist()
+    offsets = table.offsets
+    yield (",".join(HEADER) + "\r\n").encode("utf-8")
+    for group, validator in enumerate(table.validators):
+        for start in range(offsets[group], offsets[group + 1], batch_rows):
+            end = min(start + batch_rows, offsets[group + 1])
+            amounts = map(divmod, table.stakes[start:end], repeat(WEI_PER_TOKEN))
+            lines = [
+                f"{validator},{text[address_offsets[staker]:address_offsets[staker + 1]]},"
+                f"{tokens}.{remainder:08d}\r\n"
+                for staker, (tokens, remainder) in zip(
+                    table.stakers[start:end], amounts
+                )
+            ]
+            yield "".join(lines).encode("utf-8")
+
+
+def iter_csv_chunks(validator_delegations, batch_rows=BATCH_ROWS) -> Iterator[bytes]:
+    """
+    Yield the delegations CSV as UTF-8 encoded chunks of up to `batch_rows`
+    rows, header first. The bytes are identical to writing the rows one by
+    one with csv.writer.
+    """
+    if isinstance(validator_delegations, DelegationTable):
+        text = _plain_text(validator_delegations)
+        if text is not None:
+            yield from _table_chunks(validator_delegations, text, batch_rows)
+            return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(HEADER)
+
+    rows = _rows(validator_delegations)
+    while True:
+        batch = list(islice(rows, batch_rows))
+        writer.writerows(batch)
+        chunk = buffer.getvalue()
+        if chunk:
+            yield chunk.encode("utf-8")
+        if len(batch) < batch_rows:
+            return
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def _compressor(compression: Optional[str]):
+    if compression is None:
+        return None
+    if compression == "gzip":
+        # wbits=31 writes a gzip header and trailer around the deflate stream
+        return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError(
+                "zstd compression requires the zstandard package (pip install zstandard)"
+            )
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    raise ValueError(
+        f"Unknown compression {compression!r}, expected one of: {', '.join(COMPRESSIONS)}"
+    )
+
+
+def iter_export(validator_delegations, compression=None) -> Iterator[bytes]:
+    """
+    Yield the delegations CSV, compressed with `compression` ("gzip", "zstd"
+    or None) as it is formatted.
+    """
+    compressor = _compressor(compression)
+    for chunk in iter_csv_chunks(validator_delegations):
+        if compressor is not None:
+            chunk = compressor.compress(chunk)
+        if chunk:
+            yield chunk
+    if compressor is not None:
+        yield compressor.flush()
+
+
+class CsvStream(io.RawIOBase):
+    """
+    Read-only file object over the exported CSV bytes.
+
+    Every byte read is also written to `tee_filename` when given, so
+    uploading the stream leaves the same local copy that writing the file
+    would. Call `drain` to finish the local copy when the reader stops early.
+    """
+
+    def __init__(self, validator_delegations, compression=None, tee_filename=None):
+        self.name = tee_filename or "delegations CSV stream"
+        self.chunks = iter_export(validator_delegations, compression)
+        self.pending = memoryview(b"")
+        self.bytes_written = 0
+        self.tee = open(tee_filename, "wb") if tee_filename else None
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self.pending:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                self._close_tee()
+                return 0
+            if self.tee is not None:
+                self.tee.write(chunk)
+            self.bytes_written += len(chunk)
+            self.pending = memoryview(chunk)
+
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+    def read(self, size=-1) -> bytes:
+        """
+        Read `size` bytes, or fewer only at the end of the export; uploaders
+        treat a short read as the last part.
+        """
+        if size is None or size < 0:
+            return self.readall()
+        data = bytearray(size)
+        view = memoryview(data)
+        filled = 0
+        while filled < size:
+            count = self.readinto(view[filled:])
+            if not count:
+                break
+            filled += count
+        return bytes(data[:filled])
+
+    def drain(self) -> int:
+        """
+        Consume the rest of the export. Returns the total size in bytes.
+        """
+        buffer = bytearray(1 << 20)
+        while self.readinto(buffer):
+            pass
+        return self.bytes_written
+
+    def _close_tee(self) -> None:
+        if self.tee is not None:
+            self.tee.close()
+            self.tee = None
+
+    def close(self) -> None:
+        self._close_tee()
+        super().close()
+
+
+def write_csv(validator_delegations, filename, compression=None) -> int:
+    """
+    Write the delegations CSV to `filename`.
+    Returns the number of bytes written.
+    """
+    size = 0
+    with open(filename, "wb") as f:
+        for chunk in iter_export(validator_delegations, compression):
+            f.write(chunk)
+            size += len(chunk)
+    return size
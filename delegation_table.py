@@ -0,0 +1,415 @@
+"""
+Compact columnar storage for staking delegations.
+
+A snapshot holds millions of delegations. Keeping each one as an
+(address, wei) tuple in a list costs hundreds of bytes per row, so staker
+addresses are interned into a packed string table and every row is stored
+as a 4-byte address id plus an 8-byte stake in typed arrays. Rows are
+grouped by validator through an offsets array.
+
+When even the columns don't fit in memory, SpilledDelegationTable keeps the
+rows on disk as sorted runs and merges them as they are read.
+"""
+
+import heapq
+import os
+from array import array
+from itertools import islice
+from typing import Dict, Iterator, List, Tuple
+
+# Rows packed per write when spilling
+SPILL_BATCH_ROWS = 65536
+
+
+class StringTable:
+    """
+    Append-only table of strings packed into one buffer.
+    Strings are looked up by the integer id returned from `add`.
+    """
+
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = array("Q", [0])
+
+    def add(self, value: str) -> int:
+        self.data += value.encode("utf-8")
+        self.offsets.append(len(self.data))
+        return len(self.offsets) - 2
+
+    def extend(self, other: "StringTable") -> int:
+        """
+        Append every string of `other`.
+        Returns the id that `other`'s first string has in this table.
+        """
+        first_id = len(self)
+        base = len(self.data)
+        self.data += other.data
+        self.offsets.extend(base + offset for offset in other.offsets[1:])
+        return first_id
+
+    def __getitem__(self, string_id: int) -> str:
+        start = self.offsets[string_id]
+        end = self.offsets[string_id + 1]
+        return self.data[start:end].decode("utf-8")
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __iter__(self) -> Iterator[str]:
+        data = self.data
+        offsets = self.offsets
+        for string_id in range(len(self)):
+            yield data[offsets[string_id] : offsets[string_id + 1]].decode("utf-8")
+
+
+class ValidatorDelegations:
+    """
+    Read-only view of one validator's delegations in a DelegationTable.
+    Iterating it yields (staker_address, wei) tuples, largest stake first.
+    """
+
+    def __init__(self, table: "DelegationTable", group: int):
+        self.table = table
+        self.start = table.offsets[group]
+        self.end = table.offsets[group + 1]
+        self.total = table.totals[group]
+
+    @property
+    def stakes(self) -> array:
+        return self.table.stakes[self.start : self.end]
+
+    def staker(self, i: int) -> str:
+        return self.table.addresses[self.table.stakers[self.start + i]]
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def __getitem__(self, i: int) -> Tuple[str, int]:
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.staker(i), self.table.stakes[self.start + i]
+
+    def __iter__(self) -> Iterator[Tuple[str, int]]:
+        addresses = self.table.addresses
+        stakers = self.table.stakers
+        stakes = self.table.stakes
+        for row in range(self.start, self.end):
+            yield addresses[stakers[row]], stakes[row]
+
+
+class DelegationTable:
+    """
+    Delegations grouped by validator, validators sorted by total stake and
+    each validator's delegations sorted by stake, both descending.
+
+    Iterating the table yields (validator_address, ValidatorDelegations)
+    pairs, the same shape as the list of (validator, delegations) tuples it
+    replaces.
+    """
+
+    def __init__(
+        self,
+        addresses: StringTable,
+        validators: List[str],
+        stakers: array,
+        stakes: array,
+        offsets: array,
+        totals: List[int],
+        first_seen: List[str] = None,
+    ):
+        self.addresses = addresses
+        self.validators = validators
+        # Row -> staker address id
+        self.stakers = stakers
+        # Row -> stake in wei
+        self.stakes = stakes
+        # Validator i owns rows offsets[i]:offsets[i + 1]
+        self.offsets = offsets
+        # Validator i's total stake in wei
+        self.totals = totals
+        # Validators in the order they first appeared in the snapshot
+        self.first_seen = validators if first_seen is None else first_seen
+
+    def __len__(self) -> int:
+        return len(self.validators)
+
+    def __getitem__(self, group: int) -> Tuple[str, ValidatorDelegations]:
+        return self.validators[group], ValidatorDelegations(self, group)
+
+    def __iter__(self) -> Iterator[Tuple[str, ValidatorDelegations]]:
+        for group, validator in enumerate(self.validators):
+            yield validator, ValidatorDelegations(self, group)
+
+    @property
+    def row_count(self) -> int:
+        return len(self.stakes)
+
+    def to_cache(self) -> Dict:
+        """
+        Columns as bytes and lists, for MessagePack. Arrays are stored in
+        native byte order.
+        """
+        return {
+            "address_data": bytes(self.addresses.data),
+            "address_offsets": self.addresses.offsets.tobytes(),
+            "validators": self.validators,
+            "stakers": self.stakers.tobytes(),
+            "stakes": self.stakes.tobytes(),
+            "offsets": self.offsets.tobytes(),
+            "totals": self.totals,
+            "first_seen": self.first_seen,
+        }
+
+    @classmethod
+    def from_cache(cls, data: Dict) -> "DelegationTable":
+        addresses = StringTable()
+        addresses.data = bytearray(data["address_data"])
+        addresses.offsets = _array("Q", data["address_offsets"])
+        return cls(
+            addresses,
+            data["validators"],
+            _array("I", data["stakers"]),
+            _array("Q", data["stakes"]),
+            _array("Q", data["offsets"]),
+            data["totals"],
+            data["first_seen"],
+        )
+
+
+def _array(typecode: str, data: bytes) -> array:
+    column = array(typecode)
+    column.frombytes(data)
+    return column
+
+
+class DelegationTableBuilder:
+    """
+    Collects delegations in per-validator columns while the snapshot streams.
+    """
+
+    def __init__(self):
+        self.addresses = StringTable()
+        # Validator -> (staker address ids, stakes), in order of first appearance
+        self.groups: Dict[str, Tuple[array, array]] = {}
+        # Validator -> running total stake, so sorting never re-sums a group
+        self.totals: Dict[str, int] = {}
+
+    def add_staker(self, address: str) -> int:
+        return self.addresses.add(address)
+
+    def clear(self) -> None:
+        """
+        Drop every collected row, e.g. once they have been spilled to disk.
+        """
+        self.addresses = StringTable()
+        self.groups = {}
+        self.totals = {}
+
+    @property
+    def size(self) -> int:
+        """
+        Approximate bytes held by the collected rows and staker addresses.
+        """
+        return (
+            self.row_count * 12
+            + len(self.addresses.data)
+            + len(self.addresses.offsets) * 8
+        )
+
+    def add(self, validator: str, staker_id: int, wei: int) -> None:
+        group = self.groups.get(validator)
+        if group is None:
+            group = self.groups[validator] = (array("I"), array("Q"))
+            self.totals[validator] = 0
+        group[0].append(staker_id)
+        group[1].append(wei)
+        self.totals[validator] += wei
+
+    @property
+    def row_count(self) -> int:
+        return sum(len(stakes) for _, stakes in self.groups.values())
+
+    def build(self, presorted: bool = False) -> DelegationTable:
+        """
+        Lay the groups out in one set of columns.
+
+        Validators are ordered by total stake and rows within a validator by
+        stake, both descending; ties keep the order they were added in.
+        With `presorted`, rows are assumed to be added in that order already.
+        """
+        first_seen = list(self.groups)
+        validators = sorted(
+            first_seen, key=lambda validator: self.totals[validator], reverse=True
+        )
+
+        stakers = array("I")
+        stakes = array("Q")
+        offsets = array("Q", [0])
+        for validator in validators:
+            group_stakers, group_stakes = self.groups.pop(validator)
+            if not presorted:
+                order = sorted(
+                    range(len(group_stakes)),
+                    key=group_stakes.__getitem__,
+                    reverse=True,
+                )
+                group_stakers = array("I", [group_stakers[i] for i in order])
+                group_stakes = array("Q", [group_stakes[i] for i in order])
+            stakers.extend(group_stakers)
+            stakes.extend(group_stakes)
+            offsets.append(len(stakes))
+
+        return DelegationTable(
+            self.addresses,
+            validators,
+            stakers,
+            stakes,
+            offsets,
+            [self.totals[validator] for validator in validators],
+            first_seen,
+        )
+
+
+def merge_tables(tables: List[DelegationTable]) -> DelegationTable:
+    """
+    Merge tables built from consecutive runs of the snapshot.
+
+    Each validator's sorted rows are combined with a k-way merge; tables must
+    be given in file order so that ties keep the order of a serial pass.
+    """
+    builder = DelegationTableBuilder()
+    validator_rows: Dict[str, List[Iterator[Tuple[int, int]]]] = {}
+    for table in tables:
+        first_id = builder.addresses.extend(table.addresses)
+        groups = {validator: group for group, validator in enumerate(table.validators)}
+        for validator in table.first_seen:
+            group = groups[validator]
+            start = table.offsets[group]
+            end = table.offsets[group + 1]
+            stakers = [first_id + staker_id for staker_id in table.stakers[start:end]]
+            rows = zip(stakers, table.stakes[start:end])
+            validator_rows.setdefault(validator, []).append(rows)
+
+    for validator, runs in validator_rows.items():
+        for staker_id, wei in heapq.merge(*runs, key=lambda row: row[1], reverse=True):
+            builder.add(validator, staker_id, wei)
+
+    return builder.build(presorted=True)
+
+
+class SpilledDelegations:
+    """
+    One validator's delegations in a SpilledDelegationTable. Iterating it
+    merges the validator's segment of every run, yielding (staker_address,
+    wei) tuples, largest stake first.
+    """
+
+    def __init__(self, table: "SpilledDelegationTable", validator: str, count: int):
+        self.table = table
+        self.validator = validator
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self) -> Iterator[Tuple[str, int]]:
+        segments = [
+            _read_segment(filename, *segments[self.validator])
+            for filename, segments in self.table.runs
+            if self.validator in segments
+        ]
+        # Runs are merged in the order they were written, so ties keep the
+        # order of an in-memory pass
+        return heapq.merge(*segments, key=lambda row: row[1], reverse=True)
+
+
+def _read_segment(filename: str, offset: int, rows: int) -> Iterator[Tuple[str, int]]:
+    import msgpack
+
+    with open(filename, "rb") as f:
+        f.seek(offset)
+        unpacker = msgpack.Unpacker(f, use_list=False, read_size=256 * 1024)
+        for _ in range(rows):
+            yield next(unpacker)
+
+
+class SpilledDelegationTable:
+    """
+    DelegationTable stand-in for delegations kept on disk.
+
+    Each `spill` writes the rows collected so far as a run, grouped by
+    validator and sorted by stake, and records where each validator's
+    segment starts. Only per-validator counts and totals stay in memory.
+    Iterating the table yields (validator_address, SpilledDelegations) pairs
+    in the same order as DelegationTable, reading one validator at a time,
+    so it can be iterated by several readers at once.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        # (file name, validator -> (offset, rows)) per run, in write order
+        self.runs: List[Tuple[str, Dict[str, Tuple[int, int]]]] = []
+        self.first_seen: List[str] = []
+        self.counts: Dict[str, int] = {}
+        self.running_totals: Dict[str, int] = {}
+        self.validators: List[str] = []
+        self.totals: List[int] = []
+        self.offsets = array("Q", [0])
+
+    def spill(self, builder: DelegationTableBuilder) -> None:
+        """
+        Write the rows of `builder` as one sorted run, then clear it.
+        """
+        import msgpack
+
+        table = builder.build()
+        # Validators new to this run, in the order they appeared
+        for validator in table.first_seen:
+            if validator not in self.counts:
+                self.first_seen.append(validator)
+                self.counts[validator] = 0
+                self.running_totals[validator] = 0
+
+        filename = os.path.join(self.directory, f"delegations-{len(self.runs)}.msgpack")
+        segments = {}
+        packer = msgpack.Packer()
+        with open(filename, "wb") as f:
+            for group, (validator, delegations) in enumerate(table):
+                segments[validator] = (f.tell(), len(delegations))
+                rows = iter(delegations)
+                while True:
+                    batch = list(islice(rows, SPILL_BATCH_ROWS))
+                    if not batch:
+                        break
+                    f.write(b"".join(map(packer.pack, batch)))
+                self.counts[validator] += len(delegations)
+                self.running_totals[validator] += table.totals[group]
+        self.runs.append((filename, segments))
+        builder.clear()
+
+    def finish(self) -> "SpilledDelegationTable":
+        """
+        Order the validators by total stake, descending, once every run is
+        written. Ties keep the order the validators first appeared in.
+        """
+        self.validators = sorted(
+            self.first_seen,
+            key=lambda validator: self.running_totals[validator],
+            reverse=True,
+        )
+        self.totals = [self.running_totals[validator] for validator in self.validators]
+        self.offsets = array("Q", [0])
+        for validator in self.validators:
+            self.offsets.append(self.offsets[-1] + self.counts[validator])
+        return self
+
+    def __len__(self) -> int:
+        return len(self.validators)
+
+    def __iter__(self) -> Iterator[Tuple[str, SpilledDelegations]]:
+        for validator in self.validators:
+            yield validator, SpilledDelegations(self, validator, self.counts[validator])
+
+    @property
+    def row_count(self) -> int:
+        return self.offsets[-1]
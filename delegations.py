@@ -1,73 +1,190 @@
-import json_stream
-from typing import Any
-import time
-from collections import defaultdict
-import csv
 import os
-import requests
 from dotenv import load_dotenv
 from datetime import datetime, timezone
-import boto3
-from botocore.exceptions import NoCredentialsError, ClientError
+import analytics
+import api_client
+import csv_export
+import metrics
+import r2
+from analytics import DOLPHIN, DOLPHIN_THRESHOLD, SHRIMP, SHRIMP_THRESHOLD
+from delegation_table import (
+    DelegationTable,
+    DelegationTableBuilder,
+    SpilledDelegationTable,
+    merge_tables,
+)
+from scheduler import Scheduler
+from snapshot_cache import SnapshotCache
+from extract import (
+    Consumer,
+    SNAPSHOT_TIME,
+    USER_TO_DELEGATIONS,
+    extract_file,
+    extract_run,
+    map_array_parallel,
+    parallel_workers,
+)
 
 load_dotenv()
 
 
-def parse_delegations() -> tuple:
+class DelegationsConsumer(Consumer):
+    """
+    Collects the staking delegations of the snapshot during the shared pass.
+    """
+
+    paths = (SNAPSHOT_TIME, USER_TO_DELEGATIONS)
+    CACHE_SECTION = "delegations"
+
+    def __init__(self, paths=None):
+        if paths is not None:
+            self.paths = paths
+        self.snapshot_time = None
+        # Validator -> delegations, stored as columns
+        self.builder = DelegationTableBuilder()
+        # Set instead of the builder when delegations are grouped elsewhere
+        self.table = None
+
+    def handle(self, path, value):
+        if path == SNAPSHOT_TIME:
+            self.snapshot_time = value
+        elif path == USER_TO_DELEGATIONS:
+            self.aggregate_delegations(value)
+
+    def aggregate_delegations(self, user_to_delegations):
+        builder = self.builder
+
+        # Parse the user_to_delegations structure
+        for user_entry in user_to_delegations:
+            staker_id = builder.add_staker(user_entry[0])
+            delegations_list = user_entry[1]
+
+            # Process each delegation for this user
+            for delegation in delegations_list:
+                validator_address = delegation[0]
+                delegation_info = delegation[1]
+
+                wei_amount = delegation_info["wei"]
+
+                # Add to validator's delegation columns
+                builder.add(validator_address, staker_id, wei_amount)
+
+    def build_table(self):
+        """
+        Return the collected delegations as a sorted DelegationTable.
+        """
+        if self.table is None:
+            self.table = self.builder.build()
+            self.builder = None
+        return self.table
+
+    def to_cache(self):
+        """
+        The sorted delegation columns, for the snapshot cache.
+        """
+        return {
+            "snapshot_time": self.snapshot_time,
+            "table": self.build_table().to_cache(),
+        }
+
+    @classmethod
+    def from_cache(cls, data):
+        consumer = cls(paths=())
+        consumer.snapshot_time = data["snapshot_time"]
+        consumer.table = DelegationTable.from_cache(data["table"])
+        consumer.builder = None
+        return consumer
+
+
+def _aggregate_delegations_run(filename, span, backend):
+    """
+    Group one run of user_to_delegations elements by validator in a worker
+    process. Returns the run's sorted DelegationTable.
+    """
+    consumer = DelegationsConsumer(paths=(USER_TO_DELEGATIONS,))
+    extract_run(filename, span, USER_TO_DELEGATIONS, consumer, backend)
+    return consumer.build_table()
+
+
+def aggregate_delegations_parallel(filename, consumer, workers, backend="auto"):
+    """
+    Group c_staking user_to_delegations by validator across a pool of worker
+    processes.
+
+    Every worker returns a table of pre-sorted per-validator runs; runs are
+    combined with a k-way merge in file order, so ties keep the order of a
+    serial pass.
+    """
+    tables = map_array_parallel(
+        filename, USER_TO_DELEGATIONS, _aggregate_delegations_run, workers, backend
+    )
+    consumer.table = merge_tables(list(tables))
+    consumer.builder = None
+
+
+def summarize_delegations(consumer) -> tuple:
+    """
+    Sort the delegations collected by a DelegationsConsumer.
+    Returns the same (validator_delegations, snapshot_time) tuple as parse_delegations.
+    """
+    snapshot_time = consumer.snapshot_time
+    print(f"\nSnapshot Time: {snapshot_time}")
+
+    # Validators sorted by total stake, delegations by wei amount (descending)
+    return consumer.build_table(), snapshot_time
+
+
+def parse_delegations(
+    filename="data.json",
+    use_index=False,
+    backend="auto",
+    workers=0,
+    use_cache=True,
+    memory_budget=None,
+) -> tuple:
     """
     Parse delegations data from data.json file.
     Returns a tuple of (validator_delegations, snapshot_time) where:
-    - validator_delegations: list of (validator_address, delegations_list) tuples, sorted by total stake (sum of wei) descending
+    - validator_delegations: DelegationTable of (validator_address, delegations) pairs, sorted by total stake (sum of wei) descending
     - snapshot_time: the timestamp from the data
-    Each delegations_list is a list of (user_address, token_amount).
+    Each delegations view yields (user_address, wei_amount), largest first.
+    The grouped delegations are cached per snapshot unless `use_cache` is False.
+    With a `memory_budget` in MB (default: MEMORY_BUDGET_MB), delegations
+    beyond it are spilled to disk and a SpilledDelegationTable is returned;
+    neither the cache nor `workers` are used then.
     """
+    from spill import SpillingDelegationsConsumer, budget_bytes
+
+    budget = budget_bytes(memory_budget)
+    if budget:
+        print(f"Aggregating within a {budget / 1024 / 1024:.4g} MB memory budget")
+        use_cache = False
+        workers = 0
+    cache = SnapshotCache() if use_cache else None
     try:
-        with open("data.json", "r") as f:
-            data: Any = json_stream.load(f)
-
-            # Navigate to the delegation data
-            exchange = data["exchange"]
-            snapshot_time = exchange["context"]["time"]
-            print(f"\nSnapshot Time: {snapshot_time}")
-
-            c_staking = exchange["c_staking"]
-            delegations = c_staking["delegations"]
-            user_to_delegations = delegations["user_to_delegations"]
-
-            # Dictionary to store validator -> list of delegations
-            validator_delegations = defaultdict(list)
-
-            # Parse the user_to_delegations structure
-            for user_entry in user_to_delegations:
-                user_address = user_entry[0]
-                delegations_list = user_entry[1]
-
-                # Process each delegation for this user
-                for delegation in delegations_list:
-                    validator_address = delegation[0]
-                    delegation_info = delegation[1]
-
-                    wei_amount = delegation_info["wei"]
-
-                    # Add to validator's delegation list
-                    validator_delegations[validator_address].append(
-                        (user_address, wei_amount)
-                    )
-
-            # Sort delegations within each validator by wei amount (descending)
-            for validator_address in validator_delegations:
-                validator_delegations[validator_address].sort(
-                    key=lambda delegation: delegation[1],  # Sort by wei amount
-                    reverse=True,
-                )
-
-            # Sort validators by total stake (descending)
-            sorted_validators = sorted(
-                validator_delegations.items(),
-                key=lambda item: sum(wei for _, wei in item[1]),
-                reverse=True,
-            )
-            return sorted_validators, snapshot_time
+        # Fingerprinting the file for the cache is the first read of it
+        consumer = cache.load_consumer(filename, DelegationsConsumer) if cache else None
+        if consumer is not None:
+            return summarize_delegations(consumer)
+
+        workers = parallel_workers(filename, workers)
+        with metrics.span("extract") as stage:
+            if budget:
+                consumer = SpillingDelegationsConsumer(budget)
+                extract_file(filename, [consumer], use_index, backend)
+            elif workers:
+                # user_to_delegations is grouped by the worker pool instead
+                consumer = DelegationsConsumer(paths=(SNAPSHOT_TIME,))
+                extract_file(filename, [consumer], True, backend)
+                aggregate_delegations_parallel(filename, consumer, workers, backend)
+            else:
+                consumer = DelegationsConsumer()
+                extract_file(filename, [consumer], use_index, backend)
+        with metrics.span("build_table"):
+            stage.entries = consumer.build_table().row_count
+        if cache:
+            cache.store_consumer(filename, consumer)
+        return summarize_delegations(consumer)
 
     except FileNotFoundError:
         print(f"Error: data.json file not found.")
@@ -77,14 +194,25 @@ def parse_delegations() -> tuple:
         raise
 
 
-def delegations_to_nivo_json(validator_delegations):
+def delegations_to_nivo_json(
+    validator_delegations,
+    shrimp_threshold=SHRIMP_THRESHOLD,
+    dolphin_threshold=DOLPHIN_THRESHOLD,
+):
     """
     Group delegations as follows:
     - > 10,000 tokens: individual entries
     - < 1,000 tokens: grouped as '🦐'
     - >= 1,000 but < 10,000 tokens: grouped as '🐬'
     Output amounts in tokens (float, rounded to 2 decimals).
+    Thresholds are configurable; a DelegationTable is bucketed column-wise,
+    with NumPy when it is installed.
     """
+    if isinstance(validator_delegations, DelegationTable):
+        return analytics.nivo_json(
+            validator_delegations, shrimp_threshold, dolphin_threshold
+        )
+
     result = {"address": "Total Staked", "children": []}
     for validator, delegations in validator_delegations:
         children = []
@@ -92,16 +220,16 @@ def delegations_to_nivo_json(validator_delegations):
         dolphin_sum = 0  # 1000 <= x < 10,000
         for user, wei in delegations:
             tokens = wei / (10**8)
-            if tokens > 10000:
+            if tokens > dolphin_threshold:
                 children.append({"address": user, "amount": round(tokens, 2)})
-            elif tokens < 1000:
+            elif tokens < shrimp_threshold:
                 shrimp_sum += tokens
             else:  # 1000 <= tokens <= 10,000
                 dolphin_sum += tokens
         if shrimp_sum > 0:
-            children.append({"address": "\U0001f990", "amount": round(shrimp_sum, 2)})
+            children.append({"address": SHRIMP, "amount": round(shrimp_sum, 2)})
         if dolphin_sum > 0:
-            children.append({"address": "\U0001f42c", "amount": round(dolphin_sum, 2)})
+            children.append({"address": DOLPHIN, "amount": round(dolphin_sum, 2)})
 
         # Sort all children by amount (descending) to maintain proper order
         children.sort(key=lambda x: x["amount"], reverse=True)
@@ -119,6 +247,9 @@ def calculate_validator_stats(validator_delegations):
 
     Returns a tuple of (delegations_count_dict, total_stake_dict)
     """
+    if isinstance(validator_delegations, (DelegationTable, SpilledDelegationTable)):
+        return analytics.validator_stats(validator_delegations)
+
     delegations_count = {}
     total_stake = {}
 
@@ -144,74 +275,53 @@ def generate_timestamped_filename():
     return f"delegations-{timestamp}.csv"
 
 
-def save_delegations_to_csv(validator_delegations, filename="delegations.csv"):
+def save_delegations_to_csv(
+    validator_delegations, filename="delegations.csv", compression=None
+):
     """
     Save all delegations to a CSV file in the format:
     Validator address, Staker address, Amount
 
     Args:
-        validator_delegations: List of (validator_address, delegations_list) tuples
+        validator_delegations: DelegationTable of (validator_address, delegations) pairs
         filename: Name of the CSV file to create
+        compression: "gzip", "zstd" or None to write plain CSV
     """
-    with open(filename, "w", newline="", encoding="utf-8") as csvfile:
-        writer = csv.writer(csvfile)
-
-        # Write header
-        writer.writerow(["Validator address", "Staker address", "Amount"])
-
-        # Write data
-        for validator_address, delegations in validator_delegations:
-            for staker_address, wei_amount in delegations:
-                # Convert wei to tokens (divide by 10^8)
-                token_amount = wei_amount / (10**8)
-                writer.writerow(
-                    [validator_address, staker_address, f"{token_amount:.8f}"]
-                )
-
+    csv_export.write_csv(validator_delegations, filename, compression)
     print(f"Delegations saved to {filename}")
 
 
-def upload_to_r2(local_filename, r2_filename):
+def upload_to_r2(source, r2_filename, content_type="text/csv"):
     """
-    Upload a file to Cloudflare R2 bucket.
+    Upload a file to Cloudflare R2 bucket (see r2.py for transfer settings).
 
     Args:
-        local_filename: Path to the local file to upload
+        source: Path to the local file to upload, or a readable file object
+            (e.g. a csv_export.CsvStream) that is uploaded as it is read
         r2_filename: Name to use for the file in R2
+        content_type: Content type stored with the object
 
     Returns:
         bool: True if upload successful, False otherwise
     """
+    from botocore.exceptions import NoCredentialsError, ClientError
+
     try:
         # Get R2 credentials from environment variables
-        account_id = os.getenv("CLOUDFLARE_ACCOUNT_ID")
         access_key = os.getenv("R2_ACCESS_KEY_ID")
         secret_key = os.getenv("R2_SECRET_ACCESS_KEY")
-        bucket_name = "hypeburn"
 
-        if not all([account_id, access_key, secret_key]):
+        if not all([r2.endpoint_url(), access_key, secret_key]):
             print(
                 "Error: Missing R2 environment variables (CLOUDFLARE_ACCOUNT_ID, R2_ACCESS_KEY_ID, R2_SECRET_ACCESS_KEY)"
             )
             return False
 
-        # Create S3 client for R2
-        s3 = boto3.client(
-            service_name="s3",
-            endpoint_url=f"https://{account_id}.r2.cloudflarestorage.com",
-            aws_access_key_id=access_key,
-            aws_secret_access_key=secret_key,
-            region_name="auto",
-        )
-
-        # Upload file with proper content type
-        s3.upload_file(
-            local_filename,
-            bucket_name,
-            r2_filename,
-            ExtraArgs={"ContentType": "text/csv"},
-        )
-        print(f"Successfully uploaded {local_filename} to R2 as {r2_filename}")
+        # Upload with proper content type; large files go up as a parallel
+        # multipart upload
+        stats = r2.upload(source, r2_filename, content_type)
+        name = getattr(source, "name", source)
+        print(f"Successfully uploaded {name} to R2 as {r2_filename}: {stats}")
         return True
 
     except NoCredentialsError:
@@ -232,13 +342,6 @@ def send_validators_to_api(
     Send nivo_data to the /validators endpoint as { "staking_snapshot": { "data": data, "taken_at": snapshot_time } }
     Also send delegations_count, total_stake, and filename if provided.
     """
-    token = os.getenv("BUILDER_CODES_TOKEN")
-    host = os.getenv("BUILDER_CODES_HOST")
-    api_url = f"{host}/api/v1/staking_snapshots"
-    if not token:
-        print("Error: BUILDER_CODES_TOKEN environment variable not set")
-        return False
-
     payload = {"staking_snapshot": {"data": nivo_data, "taken_at": snapshot_time}}
 
     # Add validator stats if provided
@@ -249,10 +352,8 @@ def send_validators_to_api(
     if filename is not None:
         payload["staking_snapshot"]["filename"] = filename
 
-    print("Sending the following payload to API:", payload)
-    headers = {"X-Token": token, "Content-Type": "application/json"}
     try:
-        response = requests.post(api_url, json=payload, headers=headers)
+        response = api_client.post_json("/api/v1/staking_snapshots", payload)
         if response.status_code == 201:
             print("\nSuccessfully sent validators data to API")
             return True
@@ -265,64 +366,161 @@ def send_validators_to_api(
         return False
 
 
-if __name__ == "__main__":
-    start_time = time.time()
-    try:
-        validator_delegations, snapshot_time = parse_delegations()
-
-        # Calculate and print validator statistics
-        delegations_count, total_stake = calculate_validator_stats(
-            validator_delegations
-        )
+def print_validator_stats(validator_delegations):
+    """
+    Calculate and print the number of delegations and the total stake of
+    every validator.
 
-        # Sort dictionaries for consistent ordering
-        sorted_delegations_count = dict(
-            sorted(delegations_count.items(), key=lambda x: x[1], reverse=True)
-        )
+    Returns:
+        tuple: (delegations_count, total_stake), both sorted descending
+    """
+    delegations_count, total_stake = calculate_validator_stats(validator_delegations)
+
+    # Sort dictionaries for consistent ordering. A DelegationTable already
+    # orders validators by their running totals, so only counts are sorted
+    sorted_delegations_count = dict(
+        sorted(delegations_count.items(), key=lambda x: x[1], reverse=True)
+    )
+    if isinstance(validator_delegations, (DelegationTable, SpilledDelegationTable)):
+        sorted_total_stake = total_stake
+    else:
         sorted_total_stake = dict(
             sorted(total_stake.items(), key=lambda x: x[1], reverse=True)
         )
 
-        print("\n" + "=" * 50)
-        print("NUMBER OF DELEGATIONS PER VALIDATOR:")
-        print("=" * 50)
-        for validator, count in sorted_delegations_count.items():
-            print(f"{validator}: {count} delegations")
+    print("\n" + "=" * 50)
+    print("NUMBER OF DELEGATIONS PER VALIDATOR:")
+    print("=" * 50)
+    for validator, count in sorted_delegations_count.items():
+        print(f"{validator}: {count} delegations")
 
-        print("\n" + "=" * 50)
-        print("TOTAL DELEGATED STAKE PER VALIDATOR (tokens):")
-        print("=" * 50)
-        for validator, stake in sorted_total_stake.items():
-            print(f"{validator}: {stake:,.2f} tokens")
+    print("\n" + "=" * 50)
+    print("TOTAL DELEGATED STAKE PER VALIDATOR (tokens):")
+    print("=" * 50)
+    for validator, stake in sorted_total_stake.items():
+        print(f"{validator}: {stake:,.2f} tokens")
+    return sorted_delegations_count, sorted_total_stake
 
-        nivo_data = delegations_to_nivo_json(validator_delegations)
 
-        # Save delegations to local CSV file (always overwrite delegations.csv)
-        local_filename = "delegations.csv"
-        save_delegations_to_csv(validator_delegations, local_filename)
+def export_delegations_csv(validator_delegations, compression=None, upload=True):
+    """
+    Save delegations.csv (or .csv.gz/.csv.zst with `compression`) and upload
+    the same bytes to R2 under a timestamped name as they are written.
 
-        # Generate timestamped filename for R2 upload
-        timestamped_filename = generate_timestamped_filename()
+    Returns:
+        str: the R2 object name to include in the API payload, or None when
+        the upload failed or `upload` is False
+    """
+    # Export the CSV once: the R2 upload reads the stream while the same
+    # bytes are saved locally (always overwrite delegations.csv)
+    suffix = csv_export.SUFFIXES[compression]
+    local_filename = "delegations.csv" + suffix
+    stream = csv_export.CsvStream(validator_delegations, compression, local_filename)
 
-        # Upload CSV to R2 bucket with timestamped filename
-        filename_for_api = None
-        if upload_to_r2(local_filename, timestamped_filename):
-            filename_for_api = timestamped_filename
-            print(f"Will include filename {timestamped_filename} in API payload")
-        else:
-            print("R2 upload failed - filename will not be included in API payload")
-
-        send_validators_to_api(
-            nivo_data,
-            snapshot_time,
-            sorted_delegations_count,
-            sorted_total_stake,
-            filename_for_api,
-        )
+    # Generate timestamped filename for R2 upload
+    timestamped_filename = generate_timestamped_filename() + suffix
 
-    except Exception as e:
-        print(f"Error: {str(e)}")
+    # Upload CSV to R2 bucket with timestamped filename
+    uploaded = False
+    try:
+        if upload:
+            uploaded = upload_to_r2(
+                stream, timestamped_filename, csv_export.CONTENT_TYPES[compression]
+            )
+    finally:
+        # Finish the local copy if the upload stopped early or never started
+        stream.drain()
+        stream.close()
+    stage = metrics.current()
+    if stage is not None:
+        stage.bytes = os.path.getsize(local_filename)
+    print(f"Delegations saved to {local_filename}")
+    if uploaded:
+        print(f"Will include filename {timestamped_filename} in API payload")
+        return timestamped_filename
+    if upload:
+        print("R2 upload failed - filename will not be included in API payload")
+    else:
+        print("Skipping R2 upload")
+    return None
+
+
+def schedule_publish(
+    scheduler, source, compression=None, upload=True, post=True, after=()
+):
+    """
+    Add the stages of publish_delegations to `scheduler`. The validator
+    stats, the nivo payload and the CSV export and upload run side by side,
+    and the staking snapshot is posted once all three are done; without the
+    CSV file name if the export failed.
+
+    Args:
+        scheduler: scheduler.Scheduler to add the stages to
+        source: Stage whose result is (validator_delegations, snapshot_time)
+        compression: "gzip", "zstd" or None for the CSV
+        upload: Upload the CSV to R2
+        post: Post the staking snapshot to the API
+        after: Stages the validator stats wait for, so their output isn't
+            interleaved with it
+
+    Returns:
+        str: name of the stage that posts the snapshot, or None without `post`
+    """
+
+    def entries(validator_delegations):
+        if isinstance(validator_delegations, (DelegationTable, SpilledDelegationTable)):
+            metrics.current().entries = validator_delegations.row_count
+
+    def nivo_json(summary):
+        entries(summary[0])
+        return delegations_to_nivo_json(summary[0])
+
+    def export_csv(summary):
+        entries(summary[0])
+        return export_delegations_csv(summary[0], compression, upload)
+
+    stats = scheduler.add(
+        "validator_stats",
+        lambda summary: print_validator_stats(summary[0]),
+        inputs=[source],
+        not_before=after,
+    )
+    nivo = scheduler.add("nivo_json", nivo_json, inputs=[source])
+    csv = scheduler.add("export_csv", export_csv, inputs=[source])
+    if not post:
+        print("Skipping staking snapshot post")
+        return None
+    return scheduler.add(
+        "post_staking",
+        lambda summary, stats, nivo_data: send_validators_to_api(
+            nivo_data, summary[1], *stats, scheduler.result(csv, None)
+        ),
+        inputs=[source, stats, nivo],
+        not_before=[csv],
+    )
+
+
+def publish_delegations(
+    validator_delegations, snapshot_time, compression=None, upload=True, post=True
+):
+    """
+    Print validator statistics, export the delegations CSV to R2 and send the
+    staking snapshot to the API. The CSV is gzip or zstd compressed when
+    `compression` is given.
+    With `upload` or `post` False, the CSV is only saved locally or the API
+    isn't called, for dry runs.
+    The stages overlap as described in `schedule_publish`.
+    """
+    scheduler = Scheduler()
+    source = scheduler.provide("delegations", (validator_delegations, snapshot_time))
+    posted = schedule_publish(scheduler, source, compression, upload, post)
+    scheduler.run()
+    return scheduler.result(posted, None) if posted else None
+
+
+if __name__ == "__main__":
+    import sys
+
+    from cli import main
 
-    end_time = time.time()
-    execution_time = end_time - start_time
-    print(f"\nScript execution time: {execution_time:.2f} seconds")
+    sys.exit(main(["parse-delegations"] + sys.argv[1:]))
@@ -0,0 +1,347 @@
+"""
+Single-pass extraction over the ABCI state dump.
+
+The dump is walked once and every subtree a consumer asked for is handed to
+it while the stream is positioned on it, so the fee tracker and staking
+parsers can share one tokenization of data.json instead of each streaming
+the whole file.
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import repeat
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from backends import get_backend
+from metrics import Progress, current, watch_progress
+from path_index import (
+    DEFAULT_INDEX_PATHS,
+    Span,
+    get_index,
+    load_index,
+    map_file,
+    open_span,
+    split_array,
+)
+from rmp import is_msgpack, is_msgpack_header
+from sources import describe, is_stream, open_stream
+
+Path = Tuple[str, ...]
+
+SNAPSHOT_TIME: Path = ("exchange", "context", "time")
+USER_STATES: Path = ("exchange", "fee_tracker", "user_states")
+CODE_TO_REFERRER: Path = ("exchange", "fee_tracker", "code_to_referrer")
+COLLECTED_BUILDER_FEES: Path = ("exchange", "fee_tracker", "collected_builder_fees")
+USER_TO_DELEGATIONS: Path = (
+    "exchange",
+    "c_staking",
+    "delegations",
+    "user_to_delegations",
+)
+
+
+class Consumer:
+    """
+    Base class for consumers of the shared extraction pass.
+
+    Subclasses list the key paths they need in `paths` and receive each value
+    through `handle`. Containers are handed over as transient streams, so a
+    consumer must read everything it needs before `handle` returns.
+    Requested paths the pass didn't find are left in `missing`.
+    """
+
+    paths: Tuple[Path, ...] = ()
+    missing: Tuple[Path, ...] = ()
+
+    def handle(self, path: Path, value: Any) -> None:
+        raise NotImplementedError
+
+    def check_found(self) -> None:
+        """
+        Raise KeyError for the first path the pass didn't find.
+        """
+        if self.missing:
+            raise KeyError(".".join(self.missing[0]))
+
+
+def _requests(consumers: Iterable[Consumer]) -> List[Tuple[Path, Consumer]]:
+    return [(path, consumer) for consumer in consumers for path in consumer.paths]
+
+
+def _record_bytes(count: Optional[int]) -> None:
+    """
+    Add `count` bytes read to the current metrics stage, if known.
+    """
+    stage = current()
+    if stage is not None and count is not None:
+        stage.bytes = (stage.bytes or 0) + count
+
+
+def _position(f: Any) -> Optional[int]:
+    """
+    Bytes read so far from the descriptor behind `f`, or None for pipes and
+    file objects without one.
+    """
+    try:
+        return os.lseek(f.fileno(), 0, os.SEEK_CUR)
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def _check_found(consumers: List[Consumer], found: set) -> None:
+    # A consumer missing a section fails on its own, so that a pass shared
+    # with others isn't lost to it; the pass fails when none got everything
+    for consumer in consumers:
+        consumer.missing = tuple(path for path in consumer.paths if path not in found)
+    if consumers and all(consumer.missing for consumer in consumers):
+        consumers[0].check_found()
+
+
+def extract(f: Any, consumers: List[Consumer], backend: str = "auto") -> None:
+    """
+    Stream a JSON document once and dispatch the requested paths to consumers.
+
+    Args:
+        f: Open file containing the document, in binary mode for backends
+            that read bytes
+        consumers: Consumers to feed
+        backend: Name of the parser backend to use
+
+    Raises:
+        KeyError: if every consumer misses a requested path. With several
+            consumers, the paths missing for the others are left in their
+            `missing`
+    """
+    found: set = set()
+    start = _position(f)
+    with watch_progress(f, "Parsing"):
+        get_backend(backend).extract(f, _requests(consumers), (), found)
+    end = _position(f)
+    _record_bytes(None if start is None or end is None else end - start)
+    _check_found(consumers, found)
+
+
+def extract_spans(
+    f: Any, consumers: List[Consumer], spans: Dict[Path, Span], backend: str = "auto"
+) -> bool:
+    """
+    Feed consumers by seeking to indexed spans instead of streaming the document.
+
+    Every requested path is read from the longest indexed path that contains
+    it, and only that span is parsed.
+
+    Args:
+        f: File opened in binary mode, or a memory-mapped file whose spans
+            are read without a syscall
+        consumers: Consumers to feed
+        spans: Byte spans from the path index
+        backend: Name of the parser backend to use
+
+    Returns:
+        bool: False, without reading anything, when some requested path is
+        not covered by the index
+    """
+    groups: Dict[Path, List[Tuple[Path, Consumer]]] = {}
+    for path, consumer in _requests(consumers):
+        prefixes = [path[:i] for i in range(len(path), 0, -1) if path[:i] in spans]
+        if not prefixes:
+            return False
+        groups.setdefault(prefixes[0], []).append((path, consumer))
+
+    parser = get_backend(backend)
+    found: set = set()
+    # Visit spans in file order so reads stay sequential
+    with watch_progress(f, "Parsing indexed spans"):
+        for prefix in sorted(groups, key=lambda prefix: spans[prefix][0]):
+            requests = [
+                (path[len(prefix) :], consumer) for path, consumer in groups[prefix]
+            ]
+            with open_span(f, spans[prefix], text=not parser.binary) as span_file:
+                parser.extract(span_file, requests, prefix, found)
+            start, end = spans[prefix]
+            _record_bytes(end - start)
+
+    _check_found(consumers, found)
+    return True
+
+
+def extract_stream(source: Any, consumers: List[Consumer], backend: str = "auto"):
+    """
+    Run a single extraction pass over a stream that can only be read once:
+    stdin ("-"), a named pipe or a file object. Its format is detected from
+    the first byte without consuming it.
+    """
+    with open_stream(source) as f:
+        if is_msgpack_header(f.peek(1)[:1]):
+            backend = "msgpack"
+        # Every backend reads binary streams; json_stream decodes them itself
+        extract(f, consumers, backend)
+
+
+@contextmanager
+def _open_mapped(filename: str):
+    """
+    Memory-map `filename` for span reads, or open it in binary mode when it
+    can't be mapped.
+    """
+    with map_file(filename) as mapped:
+        if mapped is not None:
+            yield mapped
+            return
+        with open(filename, "rb") as f:
+            yield f
+
+
+def extract_file(
+    filename: Any,
+    consumers: List[Consumer],
+    use_index: bool = False,
+    backend: str = "auto",
+) -> None:
+    """
+    Run a single extraction pass over the file at `filename`.
+
+    With `use_index`, the byte-offset index of the file is built (or reused)
+    and only the indexed subtrees are parsed. MessagePack (.rmp) snapshots
+    are detected and always streamed with the msgpack backend. Stdin ("-"),
+    named pipes and file objects are read once, without the index.
+    """
+    if is_stream(filename):
+        if use_index:
+            print(
+                f"The path index needs a regular file, streaming {describe(filename)}"
+            )
+        extract_stream(filename, consumers, backend)
+        return
+
+    if is_msgpack(filename):
+        if use_index:
+            print("The path index only covers JSON snapshots, streaming the .rmp file")
+        with open(filename, "rb") as f:
+            extract(f, consumers, "msgpack")
+        return
+
+    if use_index:
+        spans = get_index(filename)
+        with _open_mapped(filename) as f:
+            if extract_spans(f, consumers, spans, backend):
+                return
+        print("Path index doesn't cover every requested path, streaming the whole file")
+
+    if get_backend(backend).binary:
+        with open(filename, "rb") as f:
+            extract(f, consumers, backend)
+    else:
+        with open(filename, "r") as f:
+            extract(f, consumers, backend)
+
+
+class _SnapshotTimeFound(Exception):
+    pass
+
+
+class _SnapshotTimeReader(Consumer):
+    paths = (SNAPSHOT_TIME,)
+
+    def handle(self, path: Path, value: Any) -> None:
+        # Stop the pass as soon as the time is read
+        raise _SnapshotTimeFound(value)
+
+
+def read_snapshot_time(filename: str, backend: str = "auto") -> Any:
+    """
+    Read exchange.context.time from the snapshot at `filename` without going
+    through the rest of it: from the indexed span of exchange.context when
+    the file has a path index, otherwise by streaming the file only up to
+    the time.
+
+    Returns:
+        The snapshot time, or None when the snapshot has none
+    """
+    if is_msgpack(filename):
+        parser = get_backend("msgpack", log=False)
+        span = None
+    else:
+        parser = get_backend(backend, log=False)
+        span = (load_index(filename) or {}).get(SNAPSHOT_TIME[:2])
+    reader = _SnapshotTimeReader()
+    try:
+        if span is None:
+            with open(filename, "rb" if parser.binary else "r") as f:
+                parser.extract(f, [(SNAPSHOT_TIME, reader)], (), set())
+        else:
+            with open(filename, "rb") as f:
+                with open_span(f, span, text=not parser.binary) as span_file:
+                    parser.extract(
+                        span_file,
+                        [(SNAPSHOT_TIME[2:], reader)],
+                        SNAPSHOT_TIME[:2],
+                        set(),
+                    )
+    except _SnapshotTimeFound as found:
+        return found.args[0]
+    return None
+
+
+def extract_run(
+    filename: str, span: Span, path: Path, consumer: Consumer, backend: str = "auto"
+) -> None:
+    """
+    Feed `consumer` one run of elements of the array at `path`, as returned by
+    split_array. The consumer receives the run as if it were the whole array.
+    """
+    parser = get_backend(backend, log=False)
+    with _open_mapped(filename) as f:
+        with open_span(f, span, not parser.binary, b"[", b"]") as elements:
+            parser.extract(elements, [((), consumer)], path, set())
+
+
+def parallel_workers(filename: str, workers: int) -> int:
+    """
+    Return `workers`, or 0 when the snapshot can't be split for a process
+    pool. Runs are cut at JSON element boundaries of a seekable file, so
+    streams and .rmp snapshots are aggregated in the single pass.
+    """
+    if workers and is_stream(filename):
+        print(
+            f"Parallel aggregation needs a regular file, streaming {describe(filename)}"
+        )
+        return 0
+    if workers and is_msgpack(filename):
+        print("Parallel aggregation needs a JSON snapshot, reading the .rmp file once")
+        return 0
+    return workers
+
+
+def map_array_parallel(
+    filename: str, path: Path, func, workers: int, backend: str = "auto"
+) -> Iterator[Any]:
+    """
+    Split the array at `path` into runs of whole elements and map `func` over
+    them in a pool of worker processes.
+
+    The array is located through the path index. `func` must be a module
+    level function taking (filename, span, backend); its results are yielded
+    in file order.
+
+    The workers are spawned rather than forked: the pipeline starts the pool
+    while other stages' threads may hold locks a forked child would inherit.
+    """
+    spans = get_index(filename, DEFAULT_INDEX_PATHS + (path,))
+    if path not in spans:
+        raise KeyError(".".join(path))
+
+    # A few runs per worker keeps the pool busy when runs parse unevenly
+    with _open_mapped(filename) as f:
+        runs = split_array(f, spans[path], workers * 4)
+
+    backend = get_backend(backend).key
+    start, end = spans[path]
+    _record_bytes(end - start)
+    progress = Progress(f"Aggregating {path[-1]}", len(runs))
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        for result in pool.map(func, repeat(filename), runs, repeat(backend)):
+            progress.step()
+            yield result
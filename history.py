@@ -0,0 +1,295 @@
+"""
+Local SQLite history of snapshot results.
+
+Each recorded snapshot adds its builder fees, per-referrer rewards, referral
+code counts and per-validator totals, keyed by the snapshot's taken_at time.
+Every (staker, validator) stake is only recorded on request, since it adds
+a row per delegation to each snapshot. Addresses are interned in one table
+so those rows cost a few integers each, and the per-address tables are
+clustered by (address, snapshot) so the history of one builder, referrer or
+delegator is a single index range scan.
+
+Query from the command line:
+    python history.py builder DEXTRABOT --days 90
+    python history.py delegator 0x... --days 30
+"""
+
+import sqlite3
+from contextlib import closing
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from main import (
+    FeeTrackerConsumer,
+    builder_fee_entries,
+    count_referral_codes,
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    taken_at TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS addresses (
+    id INTEGER PRIMARY KEY,
+    address TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS builder_fees (
+    builder TEXT NOT NULL,
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots(id) ON DELETE CASCADE,
+    fees REAL NOT NULL,
+    PRIMARY KEY (builder, snapshot_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS referrer_rewards (
+    referrer_id INTEGER NOT NULL,
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots(id) ON DELETE CASCADE,
+    code TEXT,
+    rewards INTEGER,
+    referrals INTEGER NOT NULL,
+    PRIMARY KEY (referrer_id, snapshot_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS referral_codes (
+    code TEXT NOT NULL,
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots(id) ON DELETE CASCADE,
+    referrals INTEGER NOT NULL,
+    PRIMARY KEY (code, snapshot_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS validator_stakes (
+    validator_id INTEGER NOT NULL,
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots(id) ON DELETE CASCADE,
+    delegations INTEGER NOT NULL,
+    total_wei INTEGER NOT NULL,
+    PRIMARY KEY (validator_id, snapshot_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS delegator_stakes (
+    staker_id INTEGER NOT NULL,
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots(id) ON DELETE CASCADE,
+    validator_id INTEGER NOT NULL,
+    wei INTEGER NOT NULL,
+    PRIMARY KEY (staker_id, snapshot_id, validator_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS builder_fees_snapshot ON builder_fees(snapshot_id);
+CREATE INDEX IF NOT EXISTS referrer_rewards_snapshot ON referrer_rewards(snapshot_id);
+CREATE INDEX IF NOT EXISTS referral_codes_snapshot ON referral_codes(snapshot_id);
+CREATE INDEX IF NOT EXISTS validator_stakes_snapshot ON validator_stakes(snapshot_id);
+CREATE INDEX IF NOT EXISTS delegator_stakes_snapshot ON delegator_stakes(snapshot_id);
+"""
+
+
+def connect(filename: str = "history.db") -> sqlite3.Connection:
+    """
+    Open the history database, creating its tables if needed.
+    """
+    conn = sqlite3.connect(filename)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _address_ids(conn: sqlite3.Connection, addresses: Iterable[str]) -> Dict[str, int]:
+    """
+    Intern `addresses` and return their ids. Only these addresses are looked
+    up, through a temporary table, since the addresses table keeps every
+    address ever recorded.
+    """
+    conn.execute(
+        "CREATE TEMP TABLE IF NOT EXISTS snapshot_addresses "
+        "(address TEXT PRIMARY KEY) WITHOUT ROWID"
+    )
+    conn.execute("DELETE FROM snapshot_addresses")
+    conn.executemany(
+        "INSERT OR IGNORE INTO snapshot_addresses VALUES (?)",
+        ((address,) for address in addresses),
+    )
+    conn.execute(
+        "INSERT OR IGNORE INTO addresses (address) "
+        "SELECT address FROM snapshot_addresses"
+    )
+    ids = dict(
+        conn.execute(
+            "SELECT a.address, a.id FROM snapshot_addresses s "
+            "JOIN addresses a ON a.address = s.address"
+        )
+    )
+    conn.execute("DELETE FROM snapshot_addresses")
+    return ids
+
+
+def record_snapshot(
+    conn: sqlite3.Connection,
+    fee_consumer: FeeTrackerConsumer,
+    validator_delegations,
+    snapshot_time: str,
+    delegators: bool = False,
+) -> None:
+    """
+    Store one snapshot's results, replacing any earlier recording of the
+    same taken_at time.
+
+    Args:
+        conn: Connection from `connect`
+        fee_consumer: Filled FeeTrackerConsumer
+        validator_delegations: DelegationTable of the same snapshot
+        snapshot_time: The snapshot's exchange.context.time
+        delegators: Also store every (staker, validator) stake, for
+            delegator_stake_history
+    """
+    codes_map = {referrer: code for code, referrer in fee_consumer.code_to_referrer}
+    with conn:
+        conn.execute("DELETE FROM snapshots WHERE taken_at = ?", (snapshot_time,))
+        snapshot_id = conn.execute(
+            "INSERT INTO snapshots (taken_at) VALUES (?)", (snapshot_time,)
+        ).lastrowid
+
+        conn.executemany(
+            "INSERT INTO builder_fees VALUES (?, ?, ?)",
+            (
+                (builder, snapshot_id, fees)
+                for builder, fees in builder_fee_entries(
+                    fee_consumer, codes_map
+                ).items()
+            ),
+        )
+        conn.executemany(
+            "INSERT INTO referral_codes VALUES (?, ?, ?)",
+            (
+                (code, snapshot_id, count)
+                for code, count in count_referral_codes(fee_consumer, codes_map).items()
+            ),
+        )
+
+        referrers = list(fee_consumer.referrer_totals())
+        addresses = [referrer_address for referrer_address, *_ in referrers]
+        addresses += validator_delegations.validators
+        if delegators:
+            addresses += validator_delegations.addresses
+        ids = _address_ids(conn, addresses)
+        conn.executemany(
+            "INSERT INTO referrer_rewards VALUES (?, ?, ?, ?, ?)",
+            (
+                (
+                    ids[referrer_address],
+                    snapshot_id,
+                    codes_map.get(referrer_address),
+                    reward,
+                    count,
+                )
+                for referrer_address, reward, count, _, _ in referrers
+            ),
+        )
+
+        rows: Dict[Tuple[int, int], int] = {}
+        for validator, delegations in validator_delegations:
+            validator_id = ids[validator]
+            conn.execute(
+                "INSERT INTO validator_stakes VALUES (?, ?, ?, ?)",
+                (validator_id, snapshot_id, len(delegations), delegations.total),
+            )
+            if not delegators:
+                continue
+            for staker, wei_amount in delegations:
+                # A staker may split one validator's stake over entries
+                key = (ids[staker], validator_id)
+                rows[key] = rows.get(key, 0) + wei_amount
+        conn.executemany(
+            "INSERT INTO delegator_stakes VALUES (?, ?, ?, ?)",
+            (
+                (staker_id, snapshot_id, validator_id, wei_amount)
+                for (staker_id, validator_id), wei_amount in rows.items()
+            ),
+        )
+
+
+def _since(days: Optional[int]) -> str:
+    if days is None:
+        return ""
+    start = datetime.now(timezone.utc) - timedelta(days=days)
+    return start.strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def builder_fee_history(
+    conn: sqlite3.Connection, builder: str, days: Optional[int] = None
+) -> List[Tuple[str, float]]:
+    """
+    (taken_at, fees) of a builder, oldest first, over the last `days` days.
+    """
+    return conn.execute(
+        """
+        SELECT s.taken_at, b.fees FROM builder_fees b
+        JOIN snapshots s ON s.id = b.snapshot_id
+        WHERE b.builder = ? AND s.taken_at >= ?
+        ORDER BY s.taken_at
+        """,
+        (builder, _since(days)),
+    ).fetchall()
+
+
+def referrer_reward_history(
+    conn: sqlite3.Connection, referrer_address: str, days: Optional[int] = None
+) -> List[Tuple[str, Optional[float], int]]:
+    """
+    (taken_at, rewards in USD, referrals) of a referrer, oldest first.
+    Rewards are None in snapshots where none of its users' rewards could be
+    read.
+    """
+    return [
+        (taken_at, None if rewards is None else rewards / (10**8), referrals)
+        for taken_at, rewards, referrals in conn.execute(
+            """
+            SELECT s.taken_at, r.rewards, r.referrals FROM referrer_rewards r
+            JOIN addresses a ON a.id = r.referrer_id
+            JOIN snapshots s ON s.id = r.snapshot_id
+            WHERE a.address = ? AND s.taken_at >= ?
+            ORDER BY s.taken_at
+            """,
+            (referrer_address, _since(days)),
+        )
+    ]
+
+
+def delegator_stake_history(
+    conn: sqlite3.Connection, staker_address: str, days: Optional[int] = None
+) -> List[Tuple[str, str, float]]:
+    """
+    (taken_at, validator, tokens) of every delegation of a staker, oldest
+    first, from the snapshots recorded with `delegators`.
+    """
+    return [
+        (taken_at, validator, wei_amount / (10**8))
+        for taken_at, validator, wei_amount in conn.execute(
+            """
+            SELECT s.taken_at, v.address, d.wei FROM delegator_stakes d
+            JOIN addresses a ON a.id = d.staker_id
+            JOIN addresses v ON v.id = d.validator_id
+            JOIN snapshots s ON s.id = d.snapshot_id
+            WHERE a.address = ? AND s.taken_at >= ?
+            ORDER BY s.taken_at, v.address
+            """,
+            (staker_address, _since(days)),
+        )
+    ]
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    queries = {
+        "builder": builder_fee_history,
+        "referrer": referrer_reward_history,
+        "delegator": delegator_stake_history,
+    }
+    parser = argparse.ArgumentParser(description="Query the snapshot history")
+    parser.add_argument("kind", choices=queries)
+    parser.add_argument("key", help="builder name, or referrer/delegator address")
+    parser.add_argument("--days", type=int, help="only the last N days")
+    parser.add_argument("--db", default="history.db")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    with closing(connect(args.db)) as conn:
+        for row in queries[args.kind](conn, args.key, args.days):
+            print(*row, sep="\t")
+    print(f"\nQuery time: {(time.time() - start_time) * 1000:.1f} ms")
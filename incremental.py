@@ -0,0 +1,177 @@
+"""
+Delta reports between consecutive snapshots.
+
+The referrer totals and the delegations table of each run are kept in a
+state file, so the next run can report what changed since: the referrers
+whose totals changed or who are gone, and the new, removed and changed
+delegations. The delta payload is written next to the full reports.
+
+Only the report is incremental: the snapshot is parsed and aggregated as in
+a full run, cache and workers included. The state holds one total and count
+per referrer and the delegations in the table's columnar form, not per-user
+contributions.
+
+Files come from the environment:
+- INCREMENTAL_STATE_FILE: state kept between runs
+  (default .incremental_state.msgpack)
+- INCREMENTAL_DELTA_FILE: delta payload of the run (default snapshot_delta.json)
+"""
+
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+from delegation_table import DelegationTable
+from main import FeeTrackerConsumer
+
+
+def state_file() -> str:
+    return os.getenv("INCREMENTAL_STATE_FILE", ".incremental_state.msgpack")
+
+
+def delta_file() -> str:
+    return os.getenv("INCREMENTAL_DELTA_FILE", "snapshot_delta.json")
+
+
+def fee_tracker_delta(
+    previous: Optional[Dict[str, Any]], consumer: FeeTrackerConsumer
+) -> Dict[str, Any]:
+    """
+    Referrers whose raw total changed, with their new totals (None once none
+    of their users has a T), and the referrers left without any referred
+    user, since the `previous` state.
+    """
+    previous = previous or {}
+    previous_fees = previous.get("referral_fees", {})
+    referral_fees = consumer.referral_fees
+    counts = consumer.referrer_address_counts
+
+    changed = {
+        referrer_address: reward
+        for referrer_address, reward in referral_fees.items()
+        if previous_fees.get(referrer_address) != reward
+    }
+    removed = []
+    for referrer_address in previous_fees:
+        if referrer_address in referral_fees:
+            continue
+        if referrer_address in counts:
+            changed[referrer_address] = None
+        else:
+            removed.append(referrer_address)
+    return {"referral_fees": changed, "removed_referrers": removed}
+
+
+def delegations_delta(
+    previous: Optional[DelegationTable], table: DelegationTable
+) -> Dict[str, List[List]]:
+    """
+    The delegations added, removed and changed since the `previous` table,
+    compared one validator at a time: [staker, validator, wei] for new and
+    removed delegations, [staker, validator, old wei, new wei] for changed
+    ones.
+    """
+    new: List[List] = []
+    removed: List[List] = []
+    changed: List[List] = []
+
+    previous_groups = {}
+    if previous is not None:
+        previous_groups = {
+            validator: group for group, validator in enumerate(previous.validators)
+        }
+    groups = {validator: group for group, validator in enumerate(table.validators)}
+
+    validators = list(table.first_seen)
+    if previous is not None:
+        validators += [v for v in previous.first_seen if v not in groups]
+    for validator in validators:
+        old = {}
+        if validator in previous_groups:
+            old = dict(previous[previous_groups[validator]][1])
+        rows = table[groups[validator]][1] if validator in groups else ()
+        for staker, wei_amount in rows:
+            old_amount = old.pop(staker, None)
+            if old_amount is None:
+                new.append([staker, validator, wei_amount])
+            elif old_amount != wei_amount:
+                changed.append([staker, validator, old_amount, wei_amount])
+        for staker, old_amount in old.items():
+            removed.append([staker, validator, old_amount])
+    return {"new": new, "removed": removed, "changed": changed}
+
+
+def load_state(filename: str = None) -> Dict[str, Any]:
+    """
+    Read the state saved by the previous incremental run, or {} for the
+    first one.
+    """
+    import msgpack
+
+    filename = filename or state_file()
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, "rb") as f:
+        return msgpack.unpack(f, raw=False, strict_map_key=False)
+
+
+def save_state(
+    fee_consumer: FeeTrackerConsumer,
+    table: DelegationTable,
+    filename: str = None,
+) -> None:
+    """
+    Save this run's referrer totals and delegations for the next incremental
+    run.
+    """
+    import msgpack
+
+    filename = filename or state_file()
+    state = {
+        "snapshot_time": fee_consumer.snapshot_time,
+        "fee_tracker": {
+            "referral_fees": fee_consumer.referral_fees,
+            "referrer_address_counts": dict(fee_consumer.referrer_address_counts),
+        },
+        "delegations": table.to_cache(),
+    }
+    with open(filename + ".tmp", "wb") as f:
+        msgpack.pack(state, f, use_bin_type=True)
+    os.replace(filename + ".tmp", filename)
+
+
+def write_delta(
+    previous: Dict[str, Any],
+    fee_consumer: FeeTrackerConsumer,
+    table: DelegationTable,
+    filename: str = None,
+) -> Dict[str, Any]:
+    """
+    Write the changes since the previous run as JSON and print their counts.
+    Returns the delta payload.
+    """
+    filename = filename or delta_file()
+    previous_table = None
+    if previous.get("delegations"):
+        previous_table = DelegationTable.from_cache(previous["delegations"])
+    fee_delta = fee_tracker_delta(previous.get("fee_tracker"), fee_consumer)
+    delegations = delegations_delta(previous_table, table)
+    delta = {
+        "from": previous.get("snapshot_time"),
+        "taken_at": fee_consumer.snapshot_time,
+        "fee_tracker": fee_delta,
+        "delegations": delegations,
+    }
+    with open(filename, "w") as f:
+        json.dump(delta, f)
+
+    print(
+        f"\nDelta since {delta['from'] or 'an empty state'}: "
+        f"{len(fee_delta['referral_fees'])} changed and "
+        f"{len(fee_delta['removed_referrers'])} removed referrers, "
+        f"{len(delegations['new'])} new, "
+        f"{len(delegations['removed'])} removed and "
+        f"{len(delegations['changed'])} changed delegations, "
+        f"written to {filename}"
+    )
+    return delta
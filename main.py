@@ -1,10 +1,22 @@
-import json_stream
-from typing import Any, Dict, Tuple, List
-import time
+from typing import Any, Dict, Iterator, Optional, Tuple, List
+import heapq
 import os
-import requests
+import api_client
+import metrics
 from collections import defaultdict
 from dotenv import load_dotenv
+from snapshot_cache import SnapshotCache
+from extract import (
+    Consumer,
+    SNAPSHOT_TIME,
+    USER_STATES,
+    CODE_TO_REFERRER,
+    COLLECTED_BUILDER_FEES,
+    extract_file,
+    extract_run,
+    map_array_parallel,
+    parallel_workers,
+)
 
 load_dotenv()
 
@@ -30,6 +42,13 @@ CODE_REMAPPINGS = {
 }
 
 
+def report_size() -> int:
+    """
+    Number of entries in each "Top N" report (REPORT_TOP_N, default 30).
+    """
+    return int(os.getenv("REPORT_TOP_N", "30"))
+
+
 def format_address(address: str, codes_map: Dict[str, str]) -> str:
     if address in ADDRESS_MAPPINGS:
         return ADDRESS_MAPPINGS[address]
@@ -39,143 +58,424 @@ def format_address(address: str, codes_map: Dict[str, str]) -> str:
     return address
 
 
-def parse_json_file() -> (
-    Tuple[Dict[str, float], str, float, List[List[Any]], List[List[Any]]]
-):
-    try:
-        with open("data.json", "r") as f:
-            data: Any = json_stream.load(f)
-
-            # Access the fees_tracker data
-            exchange = data["exchange"]
-            snapshot_time = exchange["context"]["time"]
-            print(f"\nSnapshot Time: {snapshot_time}")
-
-            fee_tracker = exchange["fee_tracker"]
-            user_states = fee_tracker["user_states"]
-
-            # Format: { "0x...": 1000 }
-            referral_fees = {}
-            # Format: { "0x...": 1 }
-            referrer_address_counts = defaultdict(int)
-
-            for user_entry in user_states:
-                user_data = user_entry[1]
-
-                referrer_address = user_data.get("r")
-
-                if referrer_address:
-                    # Increment count for this referrer address
-                    referrer_address_counts[referrer_address] += 1
-
-                    try:
-                        t_array = user_data.get("T")
-                    except Exception:
-                        continue
-
-                    # Initialize referrer in dictionary if not present
-                    if referrer_address not in referral_fees:
-                        referral_fees[referrer_address] = 0
-
-                    # Parse T array for referral rewards
-                    for t_entry in t_array:
-                        reward = t_entry[1].get("r", 0)
-                        # Convert to actual amount (assuming same format as fees)
-                        actual_reward = reward / (10**8)
-                        referral_fees[referrer_address] += actual_reward
-
-            # Calculate and print total referrer rewards paid out
-            total_referral_fees = sum(referral_fees.values())
-            print(f"\nTotal Referrer Rewards Paid Out: ${total_referral_fees:,.0f}")
+# Paths read by the shared pass when user_states is aggregated in parallel
+FEE_TRACKER_SERIAL_PATHS = (SNAPSHOT_TIME, CODE_TO_REFERRER, COLLECTED_BUILDER_FEES)
+
+
+def user_referral(user_data) -> Tuple[Optional[str], Optional[int]]:
+    """
+    Return (referrer address, summed T rewards) of one user_states entry.
+
+    "r" and "T" are read in whichever order they come: a json_stream object
+    can't go back to a key it has passed, so when "T" comes first its
+    rewards are summed before "r" is known. Built dicts (ijson, msgpack)
+    are read directly. The rewards are None for a user without a "T".
+    """
+    if isinstance(user_data, dict):
+        referrer_address = user_data.get("r")
+        if not referrer_address:
+            return None, None
+        return referrer_address, _t_rewards(user_data.get("T"))
+
+    referrer_address = None
+    reward = None
+    seen_t = False
+    for key, value in user_data.items():
+        if key == "r":
+            referrer_address = value
+            if seen_t:
+                break
+        elif key == "T":
+            reward = _t_rewards(value)
+            seen_t = True
+            if referrer_address is not None:
+                break
+    if not referrer_address:
+        return None, None
+    return referrer_address, reward
+
+
+def _t_rewards(t_array) -> Optional[int]:
+    if t_array is None:
+        return None
+    reward = 0
+    for t_entry in t_array:
+        reward += t_entry[1].get("r", 0)
+    return reward
+
+
+class FeeTrackerConsumer(Consumer):
+    """
+    Collects the fee tracker sections of the snapshot during the shared pass.
+    """
+
+    paths = (SNAPSHOT_TIME, USER_STATES, CODE_TO_REFERRER, COLLECTED_BUILDER_FEES)
+    CACHE_SECTION = "fee_tracker"
+
+    def __init__(self, paths=None):
+        if paths is not None:
+            self.paths = paths
+        self.snapshot_time = None
+        # Raw reward units, summed as integers so that partial sums merge
+        # exactly. Format: { "0x...": 100000000000 }
+        self.referral_fees = {}
+        # Format: { "0x...": 1 }
+        self.referrer_address_counts = defaultdict(int)
+        # Format: [["A", "0x..."], ["B", "0x..."], ...]
+        self.code_to_referrer = []
+        # Format: [["0x...", 1000], ...]
+        self.builder_fees = []
+        # user_states entries aggregated, for the metrics
+        self.user_count = 0
+
+    def handle(self, path, value):
+        if path == SNAPSHOT_TIME:
+            self.snapshot_time = value
+        elif path == USER_STATES:
+            self.aggregate_user_states(value)
+        elif path == CODE_TO_REFERRER:
+            self.code_to_referrer = [[code, referrer] for code, referrer in value]
+        elif path == COLLECTED_BUILDER_FEES:
+            self.builder_fees = [
+                [builder_entry[0], builder_entry[1][0][1]] for builder_entry in value
+            ]
 
-            sorted_referral_fees = sorted(
-                referral_fees.items(), key=lambda x: x[1], reverse=True
+    def aggregate_user_states(self, user_states):
+        referral_fees = self.referral_fees
+        referrer_address_counts = self.referrer_address_counts
+
+        user_count = 0
+        for user_entry in user_states:
+            user_count += 1
+            referrer_address, reward = user_referral(user_entry[1])
+
+            if referrer_address:
+                # Increment count for this referrer address
+                referrer_address_counts[referrer_address] += 1
+
+                # A user without T counts as a referral but adds no rewards
+                if reward is None:
+                    continue
+                referral_fees[referrer_address] = (
+                    referral_fees.get(referrer_address, 0) + reward
+                )
+        self.user_count += user_count
+
+    def merge(self, referral_fees, referrer_address_counts, user_count=0):
+        """
+        Add partial aggregates, e.g. from a worker process, to this consumer.
+        Merging partials in file order keeps the serial insertion order.
+        """
+        self.user_count += user_count
+        for referrer_address, reward in referral_fees.items():
+            self.referral_fees[referrer_address] = (
+                self.referral_fees.get(referrer_address, 0) + reward
             )
-
-            print("\nTop 30 Referrers by Total Rewards:")
-            print(f"{'Rank':<4} {'Referrer':<45} {'Rewards':<12}")
-            print("-" * 63)
-            for i, (referrer_address, total_reward) in enumerate(
-                sorted_referral_fees[:30], 1
-            ):
-                print(f"{i:<4} {referrer_address:<45} ${total_reward:,.0f}")
-
-            # Get code mapping first
-            # Format: [["A", "0x..."], ["B", "0x..."], ...]
-            code_to_referrer = fee_tracker["code_to_referrer"]
-            codes_map = {referrer: code for code, referrer in code_to_referrer}
-
-            # Convert referrer address counts to referral code counts
-            referral_code_counts = {}
-            for referrer_address, count in referrer_address_counts.items():
-                referral_code = codes_map.get(referrer_address)
-                if referral_code:
-                    # Apply any code remappings for consolidation
-                    referral_code = CODE_REMAPPINGS.get(referral_code, referral_code)
-
-                    # Add to existing count if code already exists, otherwise initialize
-                    if referral_code in referral_code_counts:
-                        referral_code_counts[referral_code] += count
-                    else:
-                        referral_code_counts[referral_code] = count
-
-            sorted_referral_codes = sorted(
-                referral_code_counts.items(), key=lambda x: x[1], reverse=True
+        for referrer_address, count in referrer_address_counts.items():
+            self.referrer_address_counts[referrer_address] += count
+
+    def referrer_totals(
+        self,
+    ) -> Iterator[Tuple[str, Optional[int], int, int, Optional[int]]]:
+        """
+        Yield (referrer_address, raw rewards, referrals, rank, reward rank)
+        for every referrer counted. rank orders referrers by their first
+        referral and reward rank by their first rewards; raw rewards and
+        reward rank are None for a referrer none of whose users has a T.
+        """
+        referral_fees = self.referral_fees
+        reward_ranks = {
+            referrer_address: rank
+            for rank, referrer_address in enumerate(referral_fees)
+        }
+        for rank, (referrer_address, count) in enumerate(
+            self.referrer_address_counts.items()
+        ):
+            yield (
+                referrer_address,
+                referral_fees.get(referrer_address),
+                count,
+                rank,
+                reward_ranks.get(referrer_address),
             )
 
-            print("\nTop 30 Referral Codes by Number of Referrals:")
-            print(f"{'Rank':<4} {'Code':<15} {'Count':<8}")
-            print("-" * 30)
-            for i, (code, count) in enumerate(sorted_referral_codes[:30], 1):
-                print(f"{i:<4} {code:<15} {count:<8}")
-
-            # Prepare top 30 referral codes data for API
-            top_referral_codes = [
-                [code, count] for code, count in sorted_referral_codes[:30]
-            ]
+    def to_cache(self) -> Dict[str, Any]:
+        """
+        The collected state, for the snapshot cache. ADDRESS_MAPPINGS and
+        CODE_REMAPPINGS are only applied when summarizing, so changing them
+        doesn't invalidate it.
+        """
+        return {
+            "snapshot_time": self.snapshot_time,
+            "referral_fees": self.referral_fees,
+            "referrer_address_counts": dict(self.referrer_address_counts),
+            "code_to_referrer": self.code_to_referrer,
+            "builder_fees": self.builder_fees,
+        }
 
-            # Prepare top 30 referral fees by code for API
-            top_referral_fees = []
-            for referrer_address, total_fees in sorted_referral_fees[:30]:
-                referral_code = codes_map.get(referrer_address)
-                if referral_code:
-                    # Apply any code remappings for consolidation
-                    referral_code = CODE_REMAPPINGS.get(referral_code, referral_code)
-                    top_referral_fees.append([referral_code, total_fees])
+    @classmethod
+    def from_cache(cls, data: Dict[str, Any]) -> "FeeTrackerConsumer":
+        consumer = cls(paths=())
+        consumer.snapshot_time = data["snapshot_time"]
+        consumer.referral_fees = data["referral_fees"]
+        consumer.referrer_address_counts = defaultdict(
+            int, data["referrer_address_counts"]
+        )
+        consumer.code_to_referrer = data["code_to_referrer"]
+        consumer.builder_fees = data["builder_fees"]
+        return consumer
+
+
+def _aggregate_user_states_run(filename, span, backend):
+    """
+    Aggregate one run of user_states elements in a worker process.
+    Returns the partial (referral_fees, referrer_address_counts) maps and the
+    number of users in the run.
+    """
+    consumer = FeeTrackerConsumer(paths=(USER_STATES,))
+    extract_run(filename, span, USER_STATES, consumer, backend)
+    return (
+        consumer.referral_fees,
+        dict(consumer.referrer_address_counts),
+        consumer.user_count,
+    )
+
+
+def aggregate_user_states_parallel(
+    filename: str, consumer: FeeTrackerConsumer, workers: int, backend: str = "auto"
+) -> None:
+    """
+    Aggregate fee_tracker.user_states across a pool of worker processes.
+
+    Each worker parses and aggregates one run of elements, and the partial
+    maps are merged into `consumer` in file order, so the result matches a
+    serial pass exactly.
+    """
+    partials = map_array_parallel(
+        filename, USER_STATES, _aggregate_user_states_run, workers, backend
+    )
+    for referral_fees, referrer_address_counts, user_count in partials:
+        consumer.merge(referral_fees, referrer_address_counts, user_count)
+
+
+def count_referral_codes(
+    consumer: FeeTrackerConsumer, codes_map: Dict[str, str]
+) -> Dict[str, int]:
+    """
+    Convert referrer address counts to referral code counts.
+    `codes_map` maps referrer addresses to their codes.
+    """
+    referral_code_counts = {}
+    for referrer_address, count in consumer.referrer_address_counts.items():
+        referral_code = codes_map.get(referrer_address)
+        if referral_code:
+            # Apply any code remappings for consolidation
+            referral_code = CODE_REMAPPINGS.get(referral_code, referral_code)
+
+            # Add to existing count if code already exists, otherwise initialize
+            if referral_code in referral_code_counts:
+                referral_code_counts[referral_code] += count
+            else:
+                referral_code_counts[referral_code] = count
+    return referral_code_counts
+
+
+def rank_referrers(
+    consumer: FeeTrackerConsumer, codes_map: Dict[str, str], top_n: int
+) -> Tuple[int, List[Tuple[str, int]], List[Tuple[str, int]]]:
+    """
+    Total the raw referrer rewards and pick the `top_n` referrers by rewards
+    and referral codes by referrals, in one pass over
+    `consumer.referrer_totals()`. Referrers without readable rewards only
+    count towards their codes. Ties keep the order in which referrers first
+    appeared, as with sorted(..., reverse=True)[:top_n].
+
+    Returns:
+        tuple: (total raw rewards, top (referrer_address, raw rewards),
+        top (referral_code, referrals))
+    """
+    total_rewards = 0
+    # Code -> [referrals, rank of its first referrer]
+    code_counts: Dict[str, List[int]] = {}
+
+    def rewards():
+        nonlocal total_rewards
+        for (
+            referrer_address,
+            reward,
+            count,
+            rank,
+            reward_rank,
+        ) in consumer.referrer_totals():
+            referral_code = codes_map.get(referrer_address)
+            if referral_code:
+                # Apply any code remappings for consolidation
+                referral_code = CODE_REMAPPINGS.get(referral_code, referral_code)
+                entry = code_counts.get(referral_code)
+                if entry is None:
+                    code_counts[referral_code] = [count, rank]
                 else:
-                    # If no code mapping, use the address
-                    top_referral_fees.append([referrer_address, total_fees])
-
-            # Parse builder fees
-            builder_fees = fee_tracker["collected_builder_fees"]
-
-            fee_entries = {}
-            for builder_entry in builder_fees:
-                builder_address = builder_entry[0]
-                fees = builder_entry[1][0][1]
-                # Convert amount to USD
-                actual_amount = fees / (10**8)
-                formatted_address = format_address(builder_address, codes_map)
-                fee_entries[formatted_address] = actual_amount
-
-            # Sort entries by amount in descending order for display
-            sorted_entries = sorted(
-                fee_entries.items(), key=lambda x: x[1], reverse=True
-            )
-
-            print("\nAll Builders by Total Fees Collected:")
-            print(f"{'Rank':<4} {'Builder':<20} {'Fees':<12}")
-            print("-" * 38)
-            for i, (formatted_address, actual_amount) in enumerate(sorted_entries, 1):
-                print(f"{i:<4} {formatted_address:<20} ${actual_amount:,.0f}")
-
-            return (
-                fee_entries,
-                snapshot_time,
-                total_referral_fees,
-                top_referral_codes,
-                top_referral_fees,
-            )
+                    entry[0] += count
+                    entry[1] = min(entry[1], rank)
+            if reward is not None:
+                total_rewards += reward
+                yield referrer_address, reward, reward_rank
+
+    top_referrers = heapq.nlargest(
+        top_n, rewards(), key=lambda entry: (entry[1], -entry[2])
+    )
+    top_codes = heapq.nlargest(
+        top_n, code_counts.items(), key=lambda item: (item[1][0], -item[1][1])
+    )
+    return (
+        total_rewards,
+        [(referrer_address, reward) for referrer_address, reward, _ in top_referrers],
+        [(code, count) for code, (count, _) in top_codes],
+    )
+
+
+def builder_fee_entries(
+    consumer: FeeTrackerConsumer, codes_map: Dict[str, str]
+) -> Dict[str, float]:
+    """
+    Builder fees in USD keyed by formatted builder name.
+    """
+    fee_entries = {}
+    for builder_address, fees in consumer.builder_fees:
+        # Convert amount to USD
+        actual_amount = fees / (10**8)
+        formatted_address = format_address(builder_address, codes_map)
+        fee_entries[formatted_address] = actual_amount
+    return fee_entries
+
+
+def summarize_fee_tracker(
+    consumer: FeeTrackerConsumer,
+    top_n: int = None,
+) -> Tuple[Dict[str, float], str, float, List[List[Any]], List[List[Any]]]:
+    """
+    Print the fee tracker reports and build the API data from a filled consumer.
+    The referrer and referral code rankings list `top_n` entries
+    (default: report_size()).
+    """
+    if top_n is None:
+        top_n = report_size()
+    snapshot_time = consumer.snapshot_time
+    print(f"\nSnapshot Time: {snapshot_time}")
+
+    # Get code mapping first
+    codes_map = {referrer: code for code, referrer in consumer.code_to_referrer}
+    total_rewards, top_referrers, top_referral_code_counts = rank_referrers(
+        consumer, codes_map, top_n
+    )
+
+    # Calculate and print total referrer rewards paid out
+    total_referral_fees = total_rewards / (10**8)
+    print(f"\nTotal Referrer Rewards Paid Out: ${total_referral_fees:,.0f}")
+
+    # Rank the raw totals, then convert only the top entries to USD
+    top_referral_fees_by_address = [
+        (referrer_address, reward / (10**8))
+        for referrer_address, reward in top_referrers
+    ]
+
+    print(f"\nTop {top_n} Referrers by Total Rewards:")
+    print(f"{'Rank':<4} {'Referrer':<45} {'Rewards':<12}")
+    print("-" * 63)
+    for i, (referrer_address, total_reward) in enumerate(
+        top_referral_fees_by_address, 1
+    ):
+        print(f"{i:<4} {referrer_address:<45} ${total_reward:,.0f}")
+
+    print(f"\nTop {top_n} Referral Codes by Number of Referrals:")
+    print(f"{'Rank':<4} {'Code':<15} {'Count':<8}")
+    print("-" * 30)
+    for i, (code, count) in enumerate(top_referral_code_counts, 1):
+        print(f"{i:<4} {code:<15} {count:<8}")
+
+    # Prepare top referral codes data for API
+    top_referral_codes = [[code, count] for code, count in top_referral_code_counts]
+
+    # Prepare top referral fees by code for API
+    top_referral_fees = []
+    for referrer_address, total_fees in top_referral_fees_by_address:
+        referral_code = codes_map.get(referrer_address)
+        if referral_code:
+            # Apply any code remappings for consolidation
+            referral_code = CODE_REMAPPINGS.get(referral_code, referral_code)
+            top_referral_fees.append([referral_code, total_fees])
+        else:
+            # If no code mapping, use the address
+            top_referral_fees.append([referrer_address, total_fees])
+
+    fee_entries = builder_fee_entries(consumer, codes_map)
+
+    # Sort entries by amount in descending order for display
+    sorted_entries = sorted(fee_entries.items(), key=lambda x: x[1], reverse=True)
+
+    print("\nAll Builders by Total Fees Collected:")
+    print(f"{'Rank':<4} {'Builder':<20} {'Fees':<12}")
+    print("-" * 38)
+    for i, (formatted_address, actual_amount) in enumerate(sorted_entries, 1):
+        print(f"{i:<4} {formatted_address:<20} ${actual_amount:,.0f}")
+
+    return (
+        fee_entries,
+        snapshot_time,
+        total_referral_fees,
+        top_referral_codes,
+        top_referral_fees,
+    )
+
+
+def parse_json_file(
+    filename: str = "data.json",
+    use_index: bool = False,
+    backend: str = "auto",
+    workers: int = 0,
+    use_cache: bool = True,
+    top_n: int = None,
+    memory_budget: float = None,
+) -> Tuple[Dict[str, float], str, float, List[List[Any]], List[List[Any]]]:
+    """
+    Parse the fee tracker sections of the snapshot at `filename` and print
+    the reports. With a `memory_budget` in MB (default: MEMORY_BUDGET_MB),
+    referrer totals beyond it are spilled to disk; neither the cache nor
+    `workers` are used then.
+    """
+    from spill import SpillingFeeTrackerConsumer, budget_bytes
+
+    budget = budget_bytes(memory_budget)
+    if budget:
+        print(f"Aggregating within a {budget / 1024 / 1024:.4g} MB memory budget")
+        use_cache = False
+        workers = 0
+    cache = SnapshotCache() if use_cache else None
+    try:
+        # Fingerprinting the file for the cache is the first read of it
+        consumer = cache.load_consumer(filename, FeeTrackerConsumer) if cache else None
+        if consumer is not None:
+            with metrics.span("summarize_fee_tracker"):
+                return summarize_fee_tracker(consumer, top_n)
+
+        workers = parallel_workers(filename, workers)
+        with metrics.span("extract") as stage:
+            if budget:
+                consumer = SpillingFeeTrackerConsumer(budget)
+                extract_file(filename, [consumer], use_index, backend)
+            elif workers:
+                # user_states is aggregated by the worker pool instead
+                consumer = FeeTrackerConsumer(paths=FEE_TRACKER_SERIAL_PATHS)
+                extract_file(filename, [consumer], True, backend)
+                aggregate_user_states_parallel(filename, consumer, workers, backend)
+            else:
+                consumer = FeeTrackerConsumer()
+                extract_file(filename, [consumer], use_index, backend)
+            stage.entries = consumer.user_count
+        if cache:
+            cache.store_consumer(filename, consumer)
+        with metrics.span("summarize_fee_tracker"):
+            return summarize_fee_tracker(consumer, top_n)
 
     except FileNotFoundError:
         print(f"Error: File not found.")
@@ -192,15 +492,6 @@ def send_to_api(
     top_referral_codes: List[List[Any]],
     top_referral_fees: List[List[Any]],
 ) -> bool:
-    token = os.getenv("BUILDER_CODES_TOKEN")
-    host = os.getenv("BUILDER_CODES_HOST")
-
-    api_url = f"{host}/api/v1/builder_codes_snapshots"
-
-    if not token:
-        print("Error: BUILDER_CODES_TOKEN environment variable not set")
-        return False
-
     payload = {
         "builder_codes_snapshot": {
             "data": fee_entries,
@@ -211,12 +502,8 @@ def send_to_api(
         }
     }
 
-    print("Sending the following payload to API:", payload)
-
-    headers = {"X-Token": token, "Content-Type": "application/json"}
-
     try:
-        response = requests.post(api_url, json=payload, headers=headers)
+        response = api_client.post_json("/api/v1/builder_codes_snapshots", payload)
 
         if response.status_code == 201:
             print("\nSuccessfully sent data to API")
@@ -231,24 +518,8 @@ def send_to_api(
 
 
 if __name__ == "__main__":
-    start_time = time.time()
-    try:
-        (
-            fee_entries,
-            snapshot_time,
-            total_referral_fees,
-            top_referral_codes,
-            top_referral_fees,
-        ) = parse_json_file()
-        send_to_api(
-            fee_entries,
-            snapshot_time,
-            total_referral_fees,
-            top_referral_codes,
-            top_referral_fees,
-        )
-    except Exception as e:
-        print(f"Error: {str(e)}")
-    end_time = time.time()
-    execution_time = end_time - start_time
-    print(f"\nScript execution time: {execution_time:.2f} seconds")
+    import sys
+
+    from cli import main
+
+    sys.exit(main(["parse-fees"] + sys.argv[1:]))
@@ -0,0 +1,421 @@
+"""
+Per-stage timing, throughput and memory instrumentation.
+
+Stages are wrapped in `span` blocks (or decorated with `timed`). Each span
+records its elapsed time, the bytes and entries it processed, and the peak
+RSS while it ran. Spans nest, and their names are joined with "/".
+
+The RSS (and tracemalloc) peak is process-wide. It is only reset when a
+span opens while no other span is running besides its own ancestors, so
+spans running at the same time, such as the stages of a Scheduler, never
+wipe each other's peaks. A span that overlapped unrelated spans is marked
+with "peak_rss_shared": its peak includes their memory too. Long
+reads are reported by `watch_progress`, which polls the file offset from a
+background thread, so the parse loops themselves are not slowed down.
+
+Settings come from the environment:
+- METRICS_FILE: JSON metrics written at the end of each run
+  (default metrics.json, empty to disable)
+- METRICS_TRACEMALLOC=1: also record each span's peak Python allocations
+  (slow)
+- PROGRESS_INTERVAL: seconds between progress reports (default 10, 0 to
+  disable)
+- PROFILE=cprofile or pyinstrument: profile the whole run, and save it to
+  PROFILE_FILE (default profile.prof or profile.html)
+"""
+
+import functools
+import io
+import json
+import os
+import resource
+import stat
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+MB = 1024 * 1024
+
+_spans: List["Span"] = []
+# Top-level fields added to the metrics file with `record`
+_fields: Dict[str, Any] = {}
+_local = threading.local()
+_run_started = time.time()
+# Spans open in any thread
+_open: List["Span"] = []
+_open_lock = threading.Lock()
+
+
+def _rss_peak() -> float:
+    """
+    Peak RSS in MB since the last reset (Linux), or since the process
+    started elsewhere.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (MB if sys.platform == "darwin" else 1024)
+
+
+def _reset_rss_peak() -> None:
+    try:
+        # Resets VmHWM to the current RSS
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+class Span:
+    """
+    One measured stage. Set `entries` and `bytes` inside the block when they
+    are only known once the work is done.
+    """
+
+    def __init__(self, name: str, entries: Optional[int], bytes: Optional[int]):
+        self.name = name
+        self.entries = entries
+        self.bytes = bytes
+        self.seconds = 0.0
+        self.peak_rss_mb = 0.0
+        self.peak_traced_mb: Optional[float] = None
+        self.error: Optional[str] = None
+        self.parent: Optional[Span] = None
+        # Peaks of nested spans, which reset the counters while they run
+        self.child_rss_mb = 0.0
+        self.child_traced_mb = 0.0
+        # Whether unrelated spans ran at the same time
+        self.shared = False
+
+    def to_dict(self) -> Dict[str, Any]:
+        result = {
+            "name": self.name,
+            "seconds": round(self.seconds, 6),
+            "entries": self.entries,
+            "bytes": self.bytes,
+            "peak_rss_mb": round(self.peak_rss_mb, 1),
+        }
+        if self.seconds and self.entries:
+            result["entries_per_second"] = round(self.entries / self.seconds)
+        if self.seconds and self.bytes:
+            result["mb_per_second"] = round(self.bytes / MB / self.seconds, 2)
+        if self.shared:
+            result["peak_rss_shared"] = True
+        if self.peak_traced_mb is not None:
+            result["peak_traced_mb"] = round(self.peak_traced_mb, 1)
+        if self.error:
+            result["error"] = self.error
+        return result
+
+
+def _ancestors(span: Span) -> List[Span]:
+    ancestors = []
+    while span is not None:
+        ancestors.append(span)
+        span = span.parent
+    return ancestors
+
+
+def _open_span(current: Span, tracing: bool) -> None:
+    """
+    Register `current` as open, resetting the peak counters if no unrelated
+    span is running.
+    """
+    import tracemalloc
+
+    with _open_lock:
+        ancestors = _ancestors(current.parent)
+        others = [
+            other
+            for other in _open
+            if not any(other is ancestor for ancestor in ancestors)
+        ]
+        if others:
+            current.shared = True
+            for other in others:
+                other.shared = True
+        else:
+            # The ancestors keep the peaks reached before the reset
+            if current.parent is not None:
+                parent = current.parent
+                parent.child_rss_mb = max(parent.child_rss_mb, _rss_peak())
+                if tracing:
+                    parent.child_traced_mb = max(
+                        parent.child_traced_mb,
+                        tracemalloc.get_traced_memory()[1] / MB,
+                    )
+            if tracing:
+                tracemalloc.reset_peak()
+            _reset_rss_peak()
+        _open.append(current)
+
+
+def _close_span(current: Span) -> None:
+    with _open_lock:
+        _open.remove(current)
+
+
+def _stack() -> List[Span]:
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+def current() -> Optional[Span]:
+    """
+    The innermost open span of the calling thread, if any.
+    """
+    stack = _stack()
+    return stack[-1] if stack else None
+
+
+@contextmanager
+def span(
+    name: str,
+    entries: Optional[int] = None,
+    bytes: Optional[int] = None,
+    parent: Optional[Span] = None,
+) -> Iterator[Span]:
+    """
+    Measure the enclosed block as stage `name`.
+
+    Args:
+        name: Stage name, prefixed with the names of enclosing spans
+        entries: Number of entries processed, if known up front
+        bytes: Number of bytes processed, if known up front
+        parent: Enclosing span, for a block run by another thread than the
+            one that opened it (default: the calling thread's current span)
+    """
+    import tracemalloc
+
+    stack = _stack()
+    if parent is None:
+        parent = stack[-1] if stack else None
+    current = Span(f"{parent.name}/{name}" if parent else name, entries, bytes)
+    current.parent = parent
+    tracing = os.getenv("METRICS_TRACEMALLOC") == "1"
+    if tracing and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _open_span(current, tracing)
+
+    stack.append(current)
+    start_time = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.seconds = time.perf_counter() - start_time
+        stack.pop()
+        _close_span(current)
+        current.peak_rss_mb = max(_rss_peak(), current.child_rss_mb)
+        if tracing:
+            current.peak_traced_mb = max(
+                tracemalloc.get_traced_memory()[1] / MB, current.child_traced_mb
+            )
+        if parent:
+            parent.child_rss_mb = max(parent.child_rss_mb, current.peak_rss_mb)
+            parent.child_traced_mb = max(
+                parent.child_traced_mb, current.peak_traced_mb or 0.0
+            )
+        _spans.append(current)
+
+
+def timed(name: str = None):
+    """
+    Decorator measuring every call of a function as a span.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name or func.__name__):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def spans() -> List[Dict[str, Any]]:
+    """
+    The finished spans of this run, in the order they finished.
+    """
+    return [finished.to_dict() for finished in _spans]
+
+
+def reset() -> None:
+    """
+    Drop the finished spans and restart the run clock, so a long-running
+    process can write separate metrics for each unit of work.
+    """
+    global _run_started
+    _spans.clear()
+    _fields.clear()
+    _run_started = time.time()
+
+
+def record(name: str, value: Any) -> None:
+    """
+    Add the top-level field `name` to this run's metrics file.
+    """
+    _fields[name] = value
+
+
+def write_metrics(filename: str = None, **extra) -> Optional[str]:
+    """
+    Write this run's spans as JSON, with any `extra` fields.
+    Returns the file name, or None when METRICS_FILE is empty.
+    """
+    if filename is None:
+        filename = os.getenv("METRICS_FILE", "metrics.json")
+    if not filename:
+        return None
+    metrics = {
+        "started_at": datetime.fromtimestamp(_run_started, timezone.utc).isoformat(),
+        "seconds": round(time.time() - _run_started, 6),
+        "argv": sys.argv,
+        "peak_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            / (MB if sys.platform == "darwin" else 1024),
+            1,
+        ),
+        **_fields,
+        **extra,
+        "spans": spans(),
+    }
+    with open(filename + ".tmp", "w") as f:
+        json.dump(metrics, f, indent=1)
+    os.replace(filename + ".tmp", filename)
+    print(f"Metrics written to {filename}")
+    return filename
+
+
+def _progress_interval() -> float:
+    return float(os.getenv("PROGRESS_INTERVAL", "10"))
+
+
+@contextmanager
+def watch_progress(f: Any, label: str):
+    """
+    Print how far the read of open file `f` has got every PROGRESS_INTERVAL
+    seconds until the block exits. Files without a seekable descriptor
+    (pipes, stdin, file objects) only report elapsed time.
+    """
+    interval = _progress_interval()
+    if interval <= 0:
+        yield
+        return
+
+    total = None
+    try:
+        fd = f.fileno()
+        os.lseek(fd, 0, os.SEEK_CUR)
+        if stat.S_ISREG(os.fstat(fd).st_mode):
+            total = os.fstat(fd).st_size
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        fd = None
+    done = threading.Event()
+    start_time = time.perf_counter()
+
+    def report():
+        while not done.wait(interval):
+            elapsed = time.perf_counter() - start_time
+            if fd is None:
+                print(f"{label}: {elapsed:.0f}s elapsed", flush=True)
+                continue
+            try:
+                position = os.lseek(fd, 0, os.SEEK_CUR)
+            except OSError:
+                return
+            message = f"{label}: {position / MB:,.0f} MB"
+            if total:
+                message += f" of {total / MB:,.0f} MB ({position / total:.0%})"
+            print(f"{message}, {position / MB / elapsed:,.1f} MB/s", flush=True)
+
+    reporter = threading.Thread(target=report, daemon=True)
+    reporter.start()
+    try:
+        yield
+    finally:
+        done.set()
+        reporter.join()
+
+
+class Progress:
+    """
+    Progress of work done in countable steps, e.g. runs returned by a worker
+    pool. Call `step` after each one; it prints at most once per
+    PROGRESS_INTERVAL seconds.
+    """
+
+    def __init__(self, label: str, total: Optional[int] = None):
+        self.label = label
+        self.total = total
+        self.done = 0
+        self.interval = _progress_interval()
+        self.started = self.last_report = time.perf_counter()
+
+    def step(self, count: int = 1) -> None:
+        self.done += count
+        now = time.perf_counter()
+        if self.interval <= 0 or now - self.last_report < self.interval:
+            return
+        self.last_report = now
+        of_total = f"/{self.total}" if self.total else ""
+        print(
+            f"{self.label}: {self.done}{of_total} after {now - self.started:.0f}s",
+            flush=True,
+        )
+
+
+@contextmanager
+def profiled():
+    """
+    Profile the enclosed block with cProfile or pyinstrument when PROFILE is
+    set, saving the result to PROFILE_FILE.
+    """
+    profiler_name = os.getenv("PROFILE", "").lower()
+    if not profiler_name:
+        yield
+        return
+
+    if profiler_name == "pyinstrument":
+        from pyinstrument import Profiler
+
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            filename = os.getenv("PROFILE_FILE", "profile.html")
+            with open(filename, "w") as f:
+                f.write(profiler.output_html())
+            print(f"Profile written to {filename}")
+    elif profiler_name == "cprofile":
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            filename = os.getenv("PROFILE_FILE", "profile.prof")
+            profiler.dump_stats(filename)
+            print(f"Profile written to {filename} (view with python -m pstats)")
+    else:
+        raise ValueError(
+            f"Unknown PROFILE {profiler_name!r}: use cprofile or pyinstrument"
+        )
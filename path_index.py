@@ -0,0 +1,547 @@
+"""
+Byte-offset index of key paths in the ABCI state dump.
+
+Building the index scans data.json once at raw-byte speed, matching only
+brackets and strings, and records where each chosen key path starts and
+ends. Later passes over the same snapshot seek straight to those spans and
+parse only the subtrees they need instead of tokenizing every sibling.
+
+Snapshots are memory-mapped when possible (see `map_file`): the index scan
+searches the mapping in place without copying it, and span readers copy each
+chunk the parser asks for straight out of the mapping, without a read
+syscall. Every pass, worker process and rerun shares the same page cache.
+Set SNAPSHOT_MMAP=0 to read through regular file objects instead.
+"""
+
+import io
+import json
+import mmap
+import os
+import re
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+Path = Tuple[str, ...]
+Span = Tuple[int, int]
+
+DEFAULT_INDEX_PATHS: Tuple[Path, ...] = (
+    ("exchange", "context"),
+    ("exchange", "fee_tracker"),
+    ("exchange", "c_staking"),
+)
+
+CHUNK_SIZE = 16 * 1024 * 1024
+# Smaller chunks keep the token-by-token scan around each cut point short
+SPLIT_CHUNK_SIZE = 256 * 1024
+# Granularity at which subtrees below the indexed depth are skipped
+SKIP_BLOCK_SIZE = 256 * 1024
+
+# Complete strings (escapes included) and brackets; a lone quote means the
+# string runs past the end of the buffer
+_TOKEN_RE = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|[\[\]{}]|"')
+_STRING_RE = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"')
+_PAIR_RE = re.compile(rb"\[\]|\{\}")
+_NON_BRACKETS = bytes(c for c in range(256) if c not in b"[]{}")
+_WHITESPACE_RE = re.compile(rb"[ \t\r\n]*")
+_SCALAR_END_RE = re.compile(rb"[^,}\] \t\r\n]*")
+
+
+def _skip_block(buf: bytes, start: int, end: int, slack: int):
+    """
+    Try to skip buf[start:end] by bracket counting alone.
+
+    Strings are stripped, then matched bracket pairs are removed until only
+    the unmatched closing brackets followed by the unmatched opening ones
+    remain. The block is only skipped when it closes no more than `slack`
+    of the containers that are open when it starts.
+
+    Returns:
+        tuple: (end of the skipped block, change in depth), or None when the
+        block has to be scanned token by token
+    """
+    block = buf[start:end]
+    stripped = _STRING_RE.sub(b"", block)
+    quote = stripped.find(b'"')
+    if quote != -1:
+        # Stop before a string that runs past the end of the block; nothing
+        # after it can match the string pattern, so its offset is exact
+        end -= len(stripped) - quote
+        if end == start:
+            return None
+        stripped = stripped[:quote]
+
+    brackets = stripped.translate(None, _NON_BRACKETS)
+    unmatched = brackets
+    while True:
+        reduced = _PAIR_RE.sub(b"", unmatched)
+        if len(reduced) == len(unmatched):
+            break
+        unmatched = reduced
+
+    closes = len(unmatched) - len(unmatched.lstrip(b"]}"))
+    if closes > slack:
+        return None
+    return end, len(unmatched) - 2 * closes
+
+
+def index_filename(filename: str) -> str:
+    return f"{filename}.index.json"
+
+
+@contextmanager
+def map_file(filename: str) -> Iterator[Optional[mmap.mmap]]:
+    """
+    Memory-map `filename` read-only. Yields None when it can't be mapped
+    (an empty file, a filesystem without mmap support) or SNAPSHOT_MMAP=0,
+    so callers fall back to reading the file.
+    """
+    if os.getenv("SNAPSHOT_MMAP", "1") == "0":
+        yield None
+        return
+    with open(filename, "rb") as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            yield None
+            return
+    with mapped:
+        yield mapped
+
+
+def _chunks(f, chunk_size: int) -> Iterator[Tuple[bytes, bool]]:
+    """
+    (chunk, eof) pairs of a binary stream; a mapped file is one final chunk.
+    """
+    if isinstance(f, mmap.mmap):
+        yield f, True
+        return
+    while True:
+        chunk = f.read(chunk_size)
+        yield chunk, not chunk
+        if not chunk:
+            return
+
+
+def scan_spans(
+    f, paths: Iterable[Path], chunk_size: int = CHUNK_SIZE
+) -> Dict[Path, Span]:
+    """
+    Scan a binary JSON stream and return the byte span of every requested path.
+
+    Args:
+        f: File opened in binary mode, positioned at the start of the
+            document, or a memory-mapped file, which is searched in place
+        paths: Key paths to locate
+        chunk_size: Number of bytes read per chunk
+
+    Returns:
+        dict: { path: (start, end) } with `end` exclusive; paths that don't
+        appear in the document are left out
+    """
+    wanted = set(tuple(path) for path in paths)
+    # Containers whose keys have to be read to reach a requested path
+    prefixes = set(path[:i] for path in wanted for i in range(len(path)))
+
+    spans: Dict[Path, Span] = {}
+    # Key path of every open container, whether it is an object, and the
+    # depth the scan must not drop below before switching back to tokens
+    stack = []
+    open_spans = {}
+    last_key = None
+
+    base = 0
+    buf = b""
+    for chunk, eof in _chunks(f, chunk_size):
+        buf = buf + chunk if buf else chunk
+
+        pos = 0
+        carry = None
+        while pos < len(buf) and carry is None:
+            block_end = min(pos + SKIP_BLOCK_SIZE, len(buf))
+
+            # Outside the containers whose keys or end we need only bracket
+            # depth matters, so whole blocks are skipped as long as they
+            # don't close one of those containers
+            if stack and len(stack) >= stack[-1][2]:
+                floor = stack[-1][2]
+                skipped = _skip_block(buf, pos, block_end, len(stack) - floor)
+                if skipped is not None:
+                    pos, depth_change = skipped
+                    if depth_change > 0:
+                        stack.extend([((), False, floor)] * depth_change)
+                    elif depth_change < 0:
+                        del stack[depth_change:]
+                    continue
+
+            for match in _TOKEN_RE.finditer(buf, pos):
+                start = match.start()
+                if start >= block_end:
+                    pos = start
+                    break
+                pos = match.end()
+
+                token = match.group()
+                char = token[:1]
+                if char == b'"':
+                    if len(token) == 1:
+                        if eof:
+                            raise ValueError(
+                                f"Unterminated string at byte {base + start}"
+                            )
+                        carry = start
+                        break
+                    if not stack or not stack[-1][1] or stack[-1][0] not in prefixes:
+                        continue
+
+                    # Strings inside a shallow object may be keys: a key is
+                    # followed by a colon
+                    colon = _WHITESPACE_RE.match(buf, match.end()).end()
+                    if colon >= len(buf) and not eof:
+                        carry = start
+                        break
+                    if buf[colon : colon + 1] != b":":
+                        continue
+
+                    last_key = json.loads(token)
+                    key_path = stack[-1][0] + (last_key,)
+                    if key_path in wanted:
+                        value = _WHITESPACE_RE.match(buf, colon + 1).end()
+                        if value >= len(buf) and not eof:
+                            carry = start
+                            break
+                        first = buf[value : value + 1]
+                        if first == b'"':
+                            string = _TOKEN_RE.match(buf, value)
+                            if string is None or len(string.group()) == 1:
+                                if not eof:
+                                    carry = start
+                                    break
+                                raise ValueError(
+                                    f"Unterminated string at byte {base + value}"
+                                )
+                            spans[key_path] = (base + value, base + string.end())
+                        elif first not in (b"{", b"["):
+                            end = _SCALAR_END_RE.match(buf, value).end()
+                            if end >= len(buf) and not eof:
+                                carry = start
+                                break
+                            spans[key_path] = (base + value, base + end)
+                elif char in (b"{", b"["):
+                    if stack:
+                        parent_path, parent_is_object, floor = stack[-1]
+                        if parent_is_object and parent_path in prefixes:
+                            key_path = parent_path + (last_key,)
+                        else:
+                            key_path = parent_path + (None,)
+                    else:
+                        key_path = ()
+                        floor = 1
+                    if key_path in prefixes:
+                        # Keys are read at this depth
+                        floor = len(stack) + 2
+                    elif key_path in wanted:
+                        # Only the end matters
+                        floor = len(stack) + 1
+                    stack.append((key_path, char == b"{", floor))
+                    if key_path in wanted:
+                        open_spans[len(stack)] = (key_path, base + start)
+                else:
+                    depth = len(stack)
+                    if depth in open_spans:
+                        key_path, span_start = open_spans.pop(depth)
+                        spans[key_path] = (span_start, base + start + 1)
+                    stack.pop()
+            else:
+                pos = len(buf)
+
+        if eof:
+            break
+        if carry is not None:
+            pos = carry
+        base += pos
+        buf = buf[pos:]
+
+    return spans
+
+
+def build_index(filename: str, paths: Iterable[Path] = DEFAULT_INDEX_PATHS) -> Dict:
+    """
+    Scan `filename` and persist the spans of `paths` next to it.
+
+    Returns:
+        dict: the index, as written to the sidecar file
+    """
+    paths = [tuple(path) for path in paths]
+    stat = os.stat(filename)
+    with map_file(filename) as mapped:
+        if mapped is not None:
+            spans = scan_spans(mapped, paths)
+        else:
+            with open(filename, "rb") as f:
+                spans = scan_spans(f, paths)
+
+    index = {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "paths": sorted(".".join(path) for path in paths),
+        "spans": {".".join(path): list(span) for path, span in spans.items()},
+    }
+    with open(index_filename(filename), "w") as f:
+        json.dump(index, f)
+    print(f"Indexed {len(spans)} paths in {filename}")
+    return index
+
+
+def _read_index(filename: str) -> Optional[Dict]:
+    try:
+        with open(index_filename(filename), "r") as f:
+            index = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    stat = os.stat(filename)
+    if index.get("size") != stat.st_size or index.get("mtime_ns") != stat.st_mtime_ns:
+        return None
+    return index
+
+
+def _spans(index: Dict) -> Dict[Path, Span]:
+    return {
+        tuple(path.split(".")): tuple(span) for path, span in index["spans"].items()
+    }
+
+
+def load_index(filename: str) -> Optional[Dict[Path, Span]]:
+    """
+    Load the index of `filename` if one exists and still matches the file.
+
+    Returns:
+        dict: { path: (start, end) }, or None when the index is missing or stale
+    """
+    index = _read_index(filename)
+    if index is None:
+        return None
+    return _spans(index)
+
+
+def get_index(
+    filename: str, paths: Iterable[Path] = DEFAULT_INDEX_PATHS
+) -> Dict[Path, Span]:
+    """
+    Return the index of `filename`, building it first if needed.
+    A cached index that wasn't built for all of `paths` is rebuilt.
+    """
+    paths = set(tuple(path) for path in paths)
+    index = _read_index(filename)
+    if index is not None:
+        indexed_paths = set(tuple(path.split(".")) for path in index["paths"])
+        if paths <= indexed_paths:
+            return _spans(index)
+        paths |= indexed_paths
+    return _spans(build_index(filename, paths))
+
+
+def split_array(
+    f, span: Span, parts: int, chunk_size: int = SPLIT_CHUNK_SIZE
+) -> List[Span]:
+    """
+    Split the array at `span` into about `parts` runs of whole elements.
+
+    Only brackets and strings are matched, so the elements must be arrays or
+    objects. Between cut points the bracket depth is tracked by counting
+    brackets in each chunk with its strings stripped; chunks are only
+    scanned token by token where a cut has to be placed. Each returned span
+    starts at the first byte of its first element and ends after its last
+    one, so wrapping it in brackets gives a valid array.
+
+    Args:
+        f: File opened in binary mode, or a memory-mapped file
+        span: Byte span of the array, brackets included
+        parts: Number of runs to aim for
+        chunk_size: Number of bytes read per chunk
+
+    Returns:
+        list: (start, end) spans of the runs, in file order
+    """
+    start, end = span
+    step = max(1, (end - start) // max(1, parts))
+
+    runs: List[Span] = []
+    run_start = None
+    next_cut = start + step
+    depth = 0
+
+    f.seek(start)
+    base = start
+    buf = b""
+    remaining = end - start
+    while remaining > 0 or buf:
+        chunk = f.read(min(chunk_size, remaining))
+        remaining -= len(chunk)
+        eof = remaining <= 0
+        buf += chunk
+
+        # Stop before a string that runs past the end of the chunk; nothing
+        # after it can match the string pattern, so its offset is exact
+        stripped = _STRING_RE.sub(b"", buf)
+        quote = stripped.find(b'"')
+        if quote == -1:
+            safe = len(buf)
+        elif eof:
+            raise ValueError("Unterminated string in array")
+        else:
+            safe = len(buf) - (len(stripped) - quote)
+            stripped = stripped[:quote]
+
+        if run_start is None or next_cut < base + safe:
+            stripped = None
+            for match in _TOKEN_RE.finditer(buf, 0, safe):
+                char = match.group()[:1]
+                if char == b'"':
+                    continue
+                if char in (b"{", b"["):
+                    depth += 1
+                    if depth == 2 and run_start is None:
+                        run_start = base + match.start()
+                else:
+                    depth -= 1
+                    position = base + match.end()
+                    if depth == 1 and position >= next_cut and run_start is not None:
+                        runs.append((run_start, position))
+                        run_start = None
+                        next_cut = position + step
+
+                if run_start is not None and next_cut >= base + safe:
+                    # Count the rest of the chunk
+                    stripped = _STRING_RE.sub(b"", buf[match.end() : safe])
+                    break
+
+        if stripped is not None:
+            depth += (
+                stripped.count(b"[")
+                + stripped.count(b"{")
+                - stripped.count(b"]")
+                - stripped.count(b"}")
+            )
+
+        base += safe
+        buf = buf[safe:]
+        if eof and not buf:
+            break
+
+    if run_start is not None:
+        # The last run ends at the last element, before the array's own
+        # closing bracket
+        tail_start = max(run_start, end - 4096)
+        f.seek(tail_start)
+        tail = f.read(end - tail_start)
+        runs.append((run_start, tail_start + len(tail[:-1].rstrip(b" \t\r\n"))))
+
+    return runs
+
+
+class SpanReader(io.RawIOBase):
+    """
+    Read-only view of the bytes between `start` and `end` of a binary file,
+    optionally framed by `prefix` and `suffix`.
+    """
+
+    def __init__(self, f, start: int, end: int, prefix: bytes = b"", suffix=b""):
+        self.f = f
+        self.remaining = end - start
+        self.prefix = prefix
+        self.suffix = suffix
+        f.seek(start)
+
+    def readinto(self, buffer):
+        if self.prefix:
+            data, self.prefix = self.prefix[: len(buffer)], self.prefix[len(buffer) :]
+        elif self.remaining > 0:
+            data = self.f.read(min(len(buffer), self.remaining))
+            self.remaining -= len(data)
+        else:
+            data, self.suffix = self.suffix[: len(buffer)], self.suffix[len(buffer) :]
+        buffer[: len(data)] = data
+        return len(data)
+
+    def readable(self):
+        return True
+
+
+class MappedSpanReader(io.RawIOBase):
+    """
+    Read-only view of the bytes between `start` and `end` of a memory-mapped
+    file, optionally framed by `prefix` and `suffix`. Reads need no syscall:
+    `readinto` copies straight from the mapping into the caller's buffer and
+    `read` returns one copy of a slice of it, possibly shorter than `size`.
+    """
+
+    def __init__(self, mapped, start: int, end: int, prefix: bytes = b"", suffix=b""):
+        self.view = memoryview(mapped)
+        self.pos = start
+        self.end = end
+        self.prefix = memoryview(prefix)
+        self.suffix = memoryview(suffix)
+
+    def _next(self, size: int) -> memoryview:
+        # The next slice of the prefix, the span or the suffix
+        if self.prefix:
+            data, self.prefix = self.prefix[:size], self.prefix[size:]
+        elif self.pos < self.end:
+            stop = min(self.end, self.pos + size)
+            data = self.view[self.pos : stop]
+            self.pos = stop
+        else:
+            data, self.suffix = self.suffix[:size], self.suffix[size:]
+        return data
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = len(self.prefix) + self.end - self.pos + len(self.suffix)
+        # ijson and msgpack want bytes, not views of the mapping
+        return bytes(self._next(size))
+
+    def readinto(self, buffer) -> int:
+        buffer = memoryview(buffer).cast("B")
+        filled = 0
+        while filled < len(buffer):
+            data = self._next(len(buffer) - filled)
+            if not data:
+                break
+            buffer[filled : filled + len(data)] = data
+            filled += len(data)
+        return filled
+
+    def readable(self):
+        return True
+
+    def close(self):
+        # Drop the export before the mapping itself is closed
+        self.view.release()
+        super().close()
+
+
+def open_span(f, span: Span, text: bool = True, prefix: bytes = b"", suffix=b""):
+    """
+    Open a stream over one indexed span of a binary file or memory-mapped
+    file. The stream decodes to text unless `text` is False.
+    """
+    start, end = span
+    if isinstance(f, mmap.mmap):
+        reader = MappedSpanReader(f, start, end, prefix, suffix)
+        if not text:
+            return reader
+        reader = io.BufferedReader(reader, CHUNK_SIZE)
+    else:
+        reader = io.BufferedReader(
+            SpanReader(f, start, end, prefix, suffix), CHUNK_SIZE
+        )
+        if not text:
+            return reader
+    return io.TextIOWrapper(reader, encoding="utf-8")
+
+
+if __name__ == "__main__":
+    import sys
+
+    build_index(sys.argv[1] if len(sys.argv) > 1 else "data.json")
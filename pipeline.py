@@ -0,0 +1,248 @@
+"""
+Run the builder codes and staking parsers over data.json in a single pass.
+"""
+
+import metrics
+from contextlib import closing
+from extract import SNAPSHOT_TIME, extract_file, parallel_workers
+from history import connect, record_snapshot
+from incremental import load_state, save_state, write_delta
+from scheduler import Scheduler
+from snapshot_cache import SnapshotCache
+from spill import SpillingDelegationsConsumer, SpillingFeeTrackerConsumer, budget_bytes
+from main import (
+    FEE_TRACKER_SERIAL_PATHS,
+    FeeTrackerConsumer,
+    aggregate_user_states_parallel,
+    summarize_fee_tracker,
+    send_to_api,
+)
+from delegations import (
+    DelegationsConsumer,
+    aggregate_delegations_parallel,
+    schedule_publish,
+    summarize_delegations,
+)
+
+
+def run_pipeline(
+    filename="data.json",
+    use_index=False,
+    backend="auto",
+    workers=0,
+    csv_compression=None,
+    use_cache=True,
+    incremental=False,
+    history_db=None,
+    top_n=None,
+    upload=True,
+    post=True,
+    memory_budget=None,
+    history_delegators=False,
+):
+    """
+    Stream the snapshot once, feeding both the fee tracker and the staking
+    consumers, then report and publish each result.
+    With `workers`, fee_tracker.user_states and c_staking user_to_delegations
+    are aggregated by a process pool.
+    The delegations CSV is compressed with `csv_compression` if given.
+    Extracted aggregates are cached per snapshot unless `use_cache` is False;
+    the pass is skipped for whatever the cache already holds.
+    With `incremental`, a delta payload of the changes since the previous
+    incremental run is written as well.
+    Results are appended to the SQLite history at `history_db` if given,
+    with every delegator's stakes too when `history_delegators` is set.
+    "Top N" reports list `top_n` entries (default: REPORT_TOP_N or 30).
+    With `upload` or `post` False, nothing is uploaded to R2 or posted to
+    the API.
+    The stages run on a Scheduler, which prints their timings and the
+    critical path at the end.
+    With a `memory_budget` in MB (default: MEMORY_BUDGET_MB), the referrer
+    totals and delegations beyond it are spilled to disk; neither the cache,
+    `workers` nor the history are used then.
+    """
+    budget = budget_bytes(memory_budget)
+    if budget and incremental:
+        # The delta is taken from the complete in-memory aggregates
+        print("Ignoring the memory budget for an incremental run")
+        budget = None
+    if budget:
+        print(f"Aggregating within a {budget / 1024 / 1024:.4g} MB memory budget")
+        fee_consumer = SpillingFeeTrackerConsumer(budget)
+        delegations_consumer = SpillingDelegationsConsumer(budget)
+        fresh = [fee_consumer, delegations_consumer]
+        cache = None
+        workers = 0
+    else:
+        cache = SnapshotCache() if use_cache else None
+        try:
+            fee_consumer = (
+                cache.load_consumer(filename, FeeTrackerConsumer) if cache else None
+            )
+            delegations_consumer = (
+                cache.load_consumer(filename, DelegationsConsumer) if cache else None
+            )
+        except FileNotFoundError:
+            # Fingerprinting the file for the cache is the first read of it
+            print(f"Error: File not found.")
+            raise
+
+        # Only consumers missing from the cache take part in the pass
+        workers = parallel_workers(filename, workers)
+        fresh = []
+        if fee_consumer is None:
+            fee_consumer = FeeTrackerConsumer(
+                paths=FEE_TRACKER_SERIAL_PATHS if workers else None
+            )
+            fresh.append(fee_consumer)
+        if delegations_consumer is None:
+            delegations_consumer = DelegationsConsumer(
+                paths=(SNAPSHOT_TIME,) if workers else None
+            )
+            fresh.append(delegations_consumer)
+        if workers:
+            use_index = True
+
+    # Every stage starts once its inputs are ready: with workers, the fee
+    # report is posted while the delegations are still being aggregated.
+    # map_array_parallel spawns its workers, so the pool never forks while
+    # the post or the progress poller holds a lock
+    scheduler = Scheduler()
+    fee_stages = []
+    delegation_stages = []
+    if fresh:
+
+        def extract():
+            # extract_file records the bytes it reads on the stage
+            stage = metrics.current()
+            extract_file(filename, fresh, use_index, backend)
+            stage.entries = fee_consumer.user_count or None
+
+        extracted = scheduler.add("extract", extract)
+        fee_stages = delegation_stages = [extracted]
+        # A section missing from the snapshot only fails its own consumer's
+        # stages: the other reports still go out
+        if fee_consumer in fresh:
+            fee_stages = [
+                scheduler.add(
+                    "check_fee_tracker", fee_consumer.check_found, after=[extracted]
+                )
+            ]
+        if delegations_consumer in fresh:
+            delegation_stages = [
+                scheduler.add(
+                    "check_staking",
+                    delegations_consumer.check_found,
+                    after=[extracted],
+                )
+            ]
+    if workers and fee_consumer in fresh:
+
+        def aggregate_user_states():
+            aggregate_user_states_parallel(filename, fee_consumer, workers, backend)
+            metrics.current().entries = fee_consumer.user_count
+
+        fee_stages = [
+            scheduler.add(
+                "aggregate_user_states", aggregate_user_states, after=fee_stages
+            )
+        ]
+    if workers and delegations_consumer in fresh:
+        # After the user_states pool, so the two pools don't share the cores
+        delegation_stages = [
+            scheduler.add(
+                "aggregate_delegations",
+                lambda: aggregate_delegations_parallel(
+                    filename, delegations_consumer, workers, backend
+                ),
+                after=delegation_stages,
+                not_before=fee_stages,
+            )
+        ]
+
+    def build_table():
+        table = delegations_consumer.build_table()
+        metrics.current().entries = table.row_count
+        return table
+
+    table = scheduler.add("build_table", build_table, after=delegation_stages)
+    parsed = fee_stages + [table]
+
+    if cache and fresh:
+
+        def cache_store():
+            for consumer in fresh:
+                cache.store_consumer(filename, consumer)
+
+        scheduler.add("cache_store", cache_store, after=parsed)
+    if incremental:
+
+        def update_incremental(table):
+            previous = load_state()
+            write_delta(previous, fee_consumer, table)
+            save_state(fee_consumer, table)
+
+        scheduler.add(
+            "incremental", update_incremental, inputs=[table], after=fee_stages
+        )
+
+    if history_db and budget:
+        # The history is written from the complete in-memory aggregates
+        print("Skipping the history in a memory-budgeted run")
+    elif history_db:
+
+        def record_history():
+            with closing(connect(history_db)) as conn:
+                record_snapshot(
+                    conn,
+                    fee_consumer,
+                    delegations_consumer.build_table(),
+                    fee_consumer.snapshot_time,
+                    history_delegators,
+                )
+            print(f"Recorded snapshot {fee_consumer.snapshot_time} in {history_db}")
+
+        scheduler.add("history", record_history, after=fee_stages + [table])
+
+    fee_report = scheduler.add(
+        "summarize_fee_tracker",
+        lambda: summarize_fee_tracker(fee_consumer, top_n),
+        after=fee_stages,
+    )
+    if post:
+        scheduler.add(
+            "post_fees", lambda report: send_to_api(*report), inputs=[fee_report]
+        )
+    else:
+        print("Skipping builder codes snapshot post")
+
+    # Printed after the fee report so the two don't interleave
+    summary = scheduler.add(
+        "summarize_delegations",
+        lambda: summarize_delegations(delegations_consumer),
+        after=[table],
+        not_before=[fee_report],
+    )
+    schedule_publish(scheduler, summary, csv_compression, upload, post)
+
+    scheduler.run()
+    # A failed parse fails the run; report and publishing errors are only
+    # logged, as the other results still went out
+    scheduler.raise_first(
+        [
+            "extract",
+            "check_fee_tracker",
+            "check_staking",
+            "aggregate_user_states",
+            "aggregate_delegations",
+            "build_table",
+        ]
+    )
+
+
+if __name__ == "__main__":
+    import sys
+
+    from cli import main
+
+    sys.exit(main(["all"] + sys.argv[1:]))
@@ -0,0 +1,400 @@
+"""
+Cloudflare R2 uploads.
+
+Objects above the multipart threshold are sent as concurrent multipart
+uploads, reading one part at a time from a path or any readable file object
+(such as csv_export.CsvStream). Every request carries a Content-MD5 header so
+R2 rejects corrupted parts, a failed part is retried on its own instead of
+restarting the upload, and uploads of local files record their progress in a
+state file so an interrupted run resumes where it stopped. File objects can't
+be read again, so their interrupted uploads are aborted instead: this
+includes the delegations CSV that the pipeline streams to a timestamped
+name.
+
+Settings come from the environment:
+- CLOUDFLARE_ACCOUNT_ID, R2_ACCESS_KEY_ID, R2_SECRET_ACCESS_KEY: credentials
+- R2_ENDPOINT_URL: endpoint override, e.g. a local MinIO or moto server
+- R2_BUCKET: bucket name (default hypeburn)
+- R2_PART_SIZE_MB, R2_MAX_CONCURRENCY, R2_MULTIPART_THRESHOLD_MB: transfer
+  settings (default 16, 8 and 16)
+"""
+
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, NamedTuple, Optional
+
+import metrics
+
+MB = 1024 * 1024
+
+DEFAULT_BUCKET = "hypeburn"
+# Attempts per part on top of botocore's own request retries
+PART_ATTEMPTS = 4
+STATE_SUFFIX = ".r2upload.json"
+
+_clients: Dict[tuple, object] = {}
+_clients_lock = threading.Lock()
+
+
+class TransferSettings(NamedTuple):
+    """
+    Sizes in bytes of an `upload`, and the number of parts sent at once.
+    """
+
+    multipart_threshold: int
+    part_size: int
+    max_concurrency: int
+
+
+def transfer_settings() -> TransferSettings:
+    """
+    Read the transfer settings used by `upload` from the environment.
+    """
+    return TransferSettings(
+        multipart_threshold=int(os.getenv("R2_MULTIPART_THRESHOLD_MB", "16")) * MB,
+        part_size=int(os.getenv("R2_PART_SIZE_MB", "16")) * MB,
+        max_concurrency=int(os.getenv("R2_MAX_CONCURRENCY", "8")),
+    )
+
+
+def endpoint_url() -> Optional[str]:
+    """
+    Return the R2 endpoint, or None when no account or override is set.
+    """
+    override = os.getenv("R2_ENDPOINT_URL")
+    if override:
+        return override
+    account_id = os.getenv("CLOUDFLARE_ACCOUNT_ID")
+    if account_id:
+        return f"https://{account_id}.r2.cloudflarestorage.com"
+    return None
+
+
+def get_client(max_concurrency: int = 8):
+    """
+    Return an S3 client for R2, created once per endpoint and credentials
+    and shared by later uploads. Its connection pool fits `max_concurrency`
+    part uploads at once.
+    """
+    key = (
+        endpoint_url(),
+        os.getenv("R2_ACCESS_KEY_ID"),
+        os.getenv("R2_SECRET_ACCESS_KEY"),
+        max_concurrency,
+    )
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            with metrics.span("import"):
+                import boto3.session
+                from botocore.config import Config
+
+            session = boto3.session.Session()
+            client = _clients[key] = session.client(
+                service_name="s3",
+                endpoint_url=key[0],
+                aws_access_key_id=key[1],
+                aws_secret_access_key=key[2],
+                region_name="auto",
+                config=Config(
+                    max_pool_connections=max(10, max_concurrency),
+                    retries={"max_attempts": 5, "mode": "standard"},
+                ),
+            )
+    return client
+
+
+def _content_md5(data: bytes) -> str:
+    return base64.b64encode(hashlib.md5(data).digest()).decode("ascii")
+
+
+class UploadStats:
+    """
+    Size, duration and part counts of one upload. `bytes` counts what this
+    run sent; parts an earlier run left in R2 are counted in `resumed_bytes`.
+    """
+
+    def __init__(self):
+        self.bytes = 0
+        self.parts = 0
+        self.resumed_parts = 0
+        self.resumed_bytes = 0
+        self.retries = 0
+        self.started = time.time()
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add_retry(self) -> None:
+        """Count a retried part; called from the upload threads."""
+        with self._lock:
+            self.retries += 1
+
+    @property
+    def throughput(self) -> float:
+        """Uploaded megabytes per second."""
+        return self.bytes / MB / self.seconds if self.seconds else 0.0
+
+    def __str__(self) -> str:
+        text = (
+            f"{self.bytes / MB:.1f} MB in {self.seconds:.2f}s "
+            f"({self.throughput:.1f} MB/s, {self.parts} parts"
+        )
+        if self.resumed_parts:
+            text += (
+                f", {self.resumed_parts} resumed with "
+                f"{self.resumed_bytes / MB:.1f} MB already uploaded"
+            )
+        if self.retries:
+            text += f", {self.retries} retried"
+        return text + ")"
+
+
+class _UploadState:
+    """
+    Progress of a multipart upload of a local file, kept next to the file so
+    a later run can resume it. Files that change invalidate the state.
+    """
+
+    def __init__(self, path, bucket, key, part_size):
+        self.filename = path + STATE_SUFFIX
+        stat = os.stat(path)
+        self.identity = {
+            "bucket": bucket,
+            "key": key,
+            "part_size": part_size,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+        }
+
+    def load(self) -> Optional[str]:
+        try:
+            with open(self.filename) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.get("identity") != self.identity:
+            return None
+        return state.get("upload_id")
+
+    def save(self, upload_id: str) -> None:
+        with open(self.filename, "w") as f:
+            json.dump({"identity": self.identity, "upload_id": upload_id}, f)
+
+    def remove(self) -> None:
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+
+def _uploaded_parts(client, bucket, key, upload_id) -> Optional[Dict[int, str]]:
+    """
+    Part number -> ETag of the parts R2 already holds, or None when the
+    upload no longer exists.
+    """
+    from botocore.exceptions import ClientError
+
+    parts = {}
+    try:
+        paginator = client.get_paginator("list_parts")
+        pages = paginator.paginate(Bucket=bucket, Key=key, UploadId=upload_id)
+        for page in pages:
+            for part in page.get("Parts", []):
+                parts[part["PartNumber"]] = part["ETag"]
+    except ClientError:
+        return None
+    return parts
+
+
+def _upload_part(client, bucket, key, upload_id, number, data, stats) -> dict:
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    for attempt in range(PART_ATTEMPTS):
+        try:
+            response = client.upload_part(
+                Bucket=bucket,
+                Key=key,
+                UploadId=upload_id,
+                PartNumber=number,
+                Body=data,
+                ContentMD5=_content_md5(data),
+            )
+            return {"PartNumber": number, "ETag": response["ETag"]}
+        except (BotoCoreError, ClientError) as e:
+            if attempt == PART_ATTEMPTS - 1:
+                raise
+            stats.add_retry()
+            print(f"Retrying part {number} after error: {e}")
+            time.sleep(2**attempt)
+
+
+def _multipart_upload(client, f, bucket, key, settings, extra_args, state, stats):
+    part_size = settings.part_size
+    done: Dict[int, str] = {}
+    upload_id = state.load() if state else None
+    if upload_id is not None:
+        done = _uploaded_parts(client, bucket, key, upload_id)
+        if done is None:
+            upload_id = None
+            done = {}
+    if upload_id is None:
+        upload_id = client.create_multipart_upload(
+            Bucket=bucket, Key=key, **extra_args
+        )["UploadId"]
+        if state:
+            state.save(upload_id)
+
+    parts = []
+    try:
+        with ThreadPoolExecutor(settings.max_concurrency) as pool:
+            pending = set()
+            number = 0
+            while True:
+                data = f.read(part_size)
+                if not data:
+                    break
+                number += 1
+                stats.parts += 1
+
+                # A part already held by R2 is kept if its content still matches
+                etag = done.get(number)
+                if (
+                    etag is not None
+                    and etag.strip('"') == hashlib.md5(data).hexdigest()
+                ):
+                    stats.resumed_parts += 1
+                    stats.resumed_bytes += len(data)
+                    parts.append({"PartNumber": number, "ETag": etag})
+                    continue
+
+                stats.bytes += len(data)
+
+                # Bound memory to max_concurrency parts in flight
+                if len(pending) >= settings.max_concurrency:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    parts.extend(future.result() for future in finished)
+                pending.add(
+                    pool.submit(
+                        _upload_part,
+                        client,
+                        bucket,
+                        key,
+                        upload_id,
+                        number,
+                        data,
+                        stats,
+                    )
+                )
+            parts.extend(future.result() for future in pending)
+
+        parts.sort(key=lambda part: part["PartNumber"])
+        client.complete_multipart_upload(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+    except BaseException:
+        # Parts of a local file are kept for the next run; a stream can't be
+        # replayed, so its upload is dropped
+        if not state:
+            client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
+    if state:
+        state.remove()
+
+
+def upload(
+    source,
+    key: str,
+    content_type: str = "text/csv",
+    bucket: Optional[str] = None,
+    settings: Optional[TransferSettings] = None,
+) -> UploadStats:
+    """
+    Upload a local file or a readable file object to R2.
+
+    Args:
+        source: Path of the file to upload, or a file object read once from
+            its current position
+        key: Object name in the bucket
+        content_type: Content type stored with the object
+        bucket: Bucket name (default: R2_BUCKET or hypeburn)
+        settings: Part size, concurrency and multipart threshold
+            (default: transfer_settings())
+
+    Returns:
+        UploadStats: bytes, parts and throughput of the upload
+    """
+    settings = settings or transfer_settings()
+    bucket = bucket or os.getenv("R2_BUCKET", DEFAULT_BUCKET)
+    client = get_client(settings.max_concurrency)
+    extra_args = {"ContentType": content_type}
+    stats = UploadStats()
+
+    is_path = isinstance(source, (str, os.PathLike))
+    f = open(source, "rb") if is_path else source
+    try:
+        # Anything below the threshold goes up in a single request. A file's
+        # size is known up front; a file object is read up to the threshold
+        # to find out, and that head is sent first if it's larger
+        if is_path:
+            size = os.fstat(f.fileno()).st_size
+            head = f.read() if size < settings.multipart_threshold else None
+        else:
+            head = f.read(settings.multipart_threshold)
+        if head is not None and len(head) < settings.multipart_threshold:
+            client.put_object(
+                Bucket=bucket,
+                Key=key,
+                Body=head,
+                ContentMD5=_content_md5(head),
+                **extra_args,
+            )
+            stats.bytes = len(head)
+            stats.parts = 1
+        else:
+            if is_path:
+                state = _UploadState(
+                    os.fspath(source), bucket, key, settings.part_size
+                )
+            else:
+                f = _Prepend(head, f)
+                state = None
+            _multipart_upload(client, f, bucket, key, settings, extra_args, state, stats)
+    finally:
+        if is_path:
+            f.close()
+
+    stats.seconds = time.time() - stats.started
+    return stats
+
+
+class _Prepend:
+    """
+    Reads `head` before the rest of `f`.
+    """
+
+    def __init__(self, head: bytes, f):
+        self.head = memoryview(head)
+        self.f = f
+
+    def read(self, size: int) -> bytes:
+        if not self.head:
+            return self.f.read(size)
+        data = bytes(self.head[:size])
+        self.head = self.head[size:]
+        if len(data) < size:
+            data += self.f.read(size - len(data))
+        return data
+
+
+if __name__ == "__main__":
+    import sys
+
+    from cli import main
+
+    sys.exit(main(["upload"] + sys.argv[1:]))
@@ -0,0 +1,146 @@
+"""
+Direct reader for .rmp ABCI snapshots.
+
+hl-node stores periodic ABCI states as MessagePack, and translate-abci-state
+only re-encodes the same maps and arrays as JSON. MsgpackBackend walks the
+.rmp file with msgpack's streaming Unpacker instead, skipping unwanted
+subtrees without decoding them and handing over arrays one element at a
+time, so consumers get the same values parse_json_file and parse_delegations
+read from data.json without the translation step.
+
+This relies on the .rmp keeping the layout the JSON shows: structs written
+as maps keyed by the same field names ("exchange", "user_states", "r",
+"T", "wei", ...), sequences and tuples as arrays, and addresses as the same
+"0x..." strings. Header and integer widths, and bin, ext or float values in
+subtrees that aren't requested, make no difference. A snapshot written with
+positional structs (arrays instead of maps) has none of the requested keys
+and fails with the KeyError of a missing section. Addresses written as raw
+bytes would reach the consumers as bytes, so a change of hl-node's
+encoding needs a new fixture in tests/test_rmp.py.
+
+Run as a script to convert a JSON snapshot into an .rmp fixture:
+    python rmp.py data.json data.rmp
+"""
+
+from typing import Any, Dict, Iterator
+
+from backends import _LEAF, _same, build_targets, deliver
+
+RMP_SUFFIX = ".rmp"
+# Bytes read from the file per refill of the unpacker's buffer
+READ_SIZE = 1024 * 1024
+# Largest single value (e.g. one user state) the unpacker may buffer
+MAX_BUFFER_SIZE = 256 * 1024 * 1024
+
+# First bytes of a MessagePack map: fixmap, map 16 and map 32
+_MAP_MARKERS = set(range(0x80, 0x90)) | {0xDE, 0xDF}
+
+
+def is_msgpack_header(head: bytes) -> bool:
+    """
+    Whether a document starting with `head` is a MessagePack map.
+    """
+    return bool(head) and head[0] in _MAP_MARKERS
+
+
+def is_msgpack(filename: str) -> bool:
+    """
+    Whether the snapshot at `filename` is MessagePack rather than JSON,
+    judged by its extension or else by its first byte.
+    """
+    if filename.endswith(RMP_SUFFIX):
+        return True
+    try:
+        with open(filename, "rb") as f:
+            return is_msgpack_header(f.read(1))
+    except OSError:
+        return False
+
+
+class MsgpackBackend:
+    """
+    Walks a MessagePack document with the same request interface as the
+    JSON parser backends.
+    """
+
+    binary = True
+    key = "msgpack"
+    name = "msgpack"
+
+    def extract(self, f, requests, base, found: set) -> None:
+        """
+        Stream the document in `f` and feed every (path, consumer) request.
+        Request paths are relative to the document, which sits at `base`.
+        """
+        import msgpack
+
+        unpacker = msgpack.Unpacker(
+            f,
+            raw=False,
+            strict_map_key=False,
+            read_size=READ_SIZE,
+            max_buffer_size=MAX_BUFFER_SIZE,
+        )
+        self._walk(unpacker, build_targets(requests), base, found)
+
+    def _walk(self, unpacker, targets: Dict, path, found: set) -> None:
+        if _LEAF in targets:
+            self._deliver(unpacker, path, targets[_LEAF])
+            found.add(path)
+            return
+
+        try:
+            size = unpacker.read_map_header()
+        except ValueError:
+            # Not a map, so none of the requested keys are below it
+            unpacker.skip()
+            return
+
+        for _ in range(size):
+            key = unpacker.unpack()
+            subtargets = targets.get(key) if isinstance(key, str) else None
+            if subtargets is None:
+                unpacker.skip()
+            else:
+                self._walk(unpacker, subtargets, path + (key,), found)
+
+    def _deliver(self, unpacker, path, consumers) -> None:
+        try:
+            size = unpacker.read_array_header()
+        except ValueError:
+            deliver(path, unpacker.unpack(), consumers, _same)
+            return
+
+        items = self._items(unpacker, size)
+        deliver(path, items, consumers, list)
+        # Drain whatever the consumers left unread
+        for _ in items:
+            pass
+
+    def _items(self, unpacker, size: int) -> Iterator[Any]:
+        for _ in range(size):
+            yield unpacker.unpack()
+
+
+def convert(json_filename: str, rmp_filename: str) -> None:
+    """
+    Write the JSON document at `json_filename` as MessagePack. The document
+    is loaded whole, so this is meant for test fixtures.
+    """
+    import json
+    import msgpack
+
+    with open(json_filename) as f:
+        document = json.load(f)
+    with open(rmp_filename, "wb") as f:
+        msgpack.pack(document, f, use_bin_type=True)
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 3:
+        print(f"Usage: python {sys.argv[0]} <data.json> <data.rmp>")
+        sys.exit(1)
+    convert(sys.argv[1], sys.argv[2])
+    print(f"Wrote {sys.argv[2]}")
@@ -6,5 +6,5 @@ cd "$(dirname "$0")"
 # Activate virtual environment
 source venv/bin/activate
 
-python main.py
-python delegations.py
+# Parse fee tracker and staking data in a single pass over data.json
+python cli.py all
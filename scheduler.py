@@ -0,0 +1,297 @@
+"""
+Thread-based scheduler for the stages of a run.
+
+A run is a graph of stages: parsing, aggregation, reports, the CSV export
+and upload, and the API posts. Each stage starts as soon as the stages it
+depends on are done, on a bounded pool of threads, so the I/O-bound stages
+(uploads, posts) overlap with the CPU-bound ones. The builder codes snapshot
+is posted while the delegations are still aggregated, and the CSV is
+uploaded while the nivo payload is built.
+
+A failed stage only skips the stages that take its result; independent
+stages still run. Every stage is recorded as a metrics span, and the
+summary printed at the end lists each stage's timing and the critical path:
+the chain of stages that determined how long the run took. Peak RSS is
+process-wide: stages that overlap report a shared peak, marked
+"peak_rss_shared" in the metrics, and never reset each other's.
+
+Stages hand each other whole results rather than streaming items through
+queues. The stage pair that would gain from streaming, the CSV export and
+its upload, already runs as one stage that streams through CsvStream, with
+memory bounded by the upload's parts in flight.
+
+A stage that raises SystemExit or KeyboardInterrupt is marked failed and
+the exception is re-raised by `run` once the running stages are done.
+
+Settings come from the environment:
+- SCHEDULER_THREADS: stages run at once (default 4)
+"""
+
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import metrics
+
+_MISSING = object()
+
+
+class StageSkipped(Exception):
+    """
+    Raised by `Scheduler.result` for a stage that never ran because a stage
+    it depends on failed.
+    """
+
+
+def _error(stage: "Stage") -> BaseException:
+    return stage.error or RuntimeError(f"{stage.name} failed")
+
+
+class Stage:
+    """
+    One unit of work in a Scheduler. `status` is "pending", "ok", "failed"
+    or "skipped".
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable,
+        inputs: List[str],
+        after: List[str],
+        not_before: List[str],
+    ):
+        self.name = name
+        self.func = func
+        self.inputs = inputs
+        self.after = after
+        self.not_before = not_before
+        self.status = "pending"
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+
+    @property
+    def seconds(self) -> float:
+        if self.started is None or self.finished is None:
+            return 0.0
+        return self.finished - self.started
+
+    @property
+    def requires(self) -> List[str]:
+        """
+        Stages that must succeed for this one to run.
+        """
+        return self.inputs + self.after
+
+    @property
+    def dependencies(self) -> List[str]:
+        return self.inputs + self.after + self.not_before
+
+
+class Scheduler:
+    """
+    Runs a graph of stages on a thread pool.
+
+    Stages are added in dependency order with `add`, then executed by `run`.
+
+    Args:
+        max_workers: Stages run at once (default: SCHEDULER_THREADS or 4)
+    """
+
+    def __init__(self, max_workers: int = None):
+        if max_workers is None:
+            max_workers = int(os.getenv("SCHEDULER_THREADS", "4"))
+        self.max_workers = max(1, max_workers)
+        self.stages: Dict[str, Stage] = {}
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+
+    def add(
+        self,
+        name: str,
+        func: Callable,
+        inputs: Iterable[str] = (),
+        after: Iterable[str] = (),
+        not_before: Iterable[str] = (),
+    ) -> str:
+        """
+        Add a stage. It is skipped if any stage in `inputs` or `after` fails.
+
+        Args:
+            name: Stage name, also used for its metrics span
+            func: Called with the results of `inputs`, in order
+            inputs: Stages whose results `func` takes
+            after: Other stages that must succeed first
+            not_before: Stages that must finish first, successfully or not
+
+        Returns:
+            str: `name`, for use in later stages' dependencies
+        """
+        if name in self.stages:
+            raise ValueError(f"Duplicate stage {name}")
+        stage = Stage(name, func, list(inputs), list(after), list(not_before))
+        for dependency in stage.dependencies:
+            if dependency not in self.stages:
+                raise ValueError(f"Stage {name} depends on unknown stage {dependency}")
+        self.stages[name] = stage
+        return name
+
+    def provide(self, name: str, value: Any) -> str:
+        """
+        Add a stage that is already done, with `value` as its result.
+        """
+        self.add(name, lambda: value)
+        stage = self.stages[name]
+        stage.status = "ok"
+        stage.value = value
+        stage.started = stage.finished = time.perf_counter()
+        return name
+
+    def result(self, name: str, default: Any = _MISSING) -> Any:
+        """
+        The result of stage `name`. Re-raises its error if it failed, unless
+        a `default` is given.
+        """
+        stage = self.stages[name]
+        if stage.status == "ok":
+            return stage.value
+        if default is not _MISSING:
+            return default
+        if stage.status == "failed":
+            raise _error(stage)
+        raise StageSkipped(f"{name} was skipped")
+
+    def raise_first(self, names: Iterable[str]) -> None:
+        """
+        Re-raise the error of the first stage in `names` that failed.
+        """
+        for name in names:
+            stage = self.stages.get(name)
+            if stage is not None and stage.status == "failed":
+                raise _error(stage)
+
+    def _execute(self, stage: Stage, parent: Optional[metrics.Span]) -> None:
+        args = [self.stages[name].value for name in stage.inputs]
+        stage.started = time.perf_counter()
+        status = "failed"
+        try:
+            with metrics.span(stage.name, parent=parent):
+                stage.value = stage.func(*args)
+            status = "ok"
+        except Exception as e:
+            stage.error = e
+            print(f"Error in {stage.name}: {str(e)}")
+        except BaseException as e:
+            # SystemExit or KeyboardInterrupt: `run` re-raises it
+            stage.error = e
+            raise
+        finally:
+            # Dependents are released by the status, so it is set last
+            stage.finished = time.perf_counter()
+            stage.status = status
+
+    def _ready(self, stage: Stage) -> bool:
+        return all(
+            self.stages[name].status not in ("pending", "running")
+            for name in stage.dependencies
+        )
+
+    def run(self) -> None:
+        """
+        Run every pending stage as soon as its dependencies are done, then
+        print the summary and record it in the run metrics.
+        """
+        parent = metrics.current()
+        self.started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            running = {}
+            while True:
+                for stage in self.stages.values():
+                    if stage.status != "pending" or not self._ready(stage):
+                        continue
+                    failed = [
+                        name
+                        for name in stage.requires
+                        if self.stages[name].status != "ok"
+                    ]
+                    if failed:
+                        stage.status = "skipped"
+                        stage.started = stage.finished = time.perf_counter()
+                        print(
+                            f"Skipping {stage.name}: {', '.join(failed)} didn't finish"
+                        )
+                        continue
+                    stage.status = "running"
+                    running[pool.submit(self._execute, stage, parent)] = stage
+                # Stages are added after their dependencies, so one pass
+                # settles every stage whose dependencies are done
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    del running[future]
+                    # Exceptions stay on their stage; SystemExit and
+                    # KeyboardInterrupt are re-raised here
+                    future.result()
+        self.finished = time.perf_counter()
+
+        print(self.summary())
+        metrics.record(
+            "critical_path",
+            {
+                "stages": [stage.name for stage in self.critical_path()],
+                "seconds": round(self.finished - self.started, 6),
+            },
+        )
+
+    def critical_path(self) -> List[Stage]:
+        """
+        The chain of stages that determined the run's length: the stage that
+        finished last, the dependency that finished last before it, and so
+        on back to a stage with no dependencies.
+        """
+        finished = [stage for stage in self.stages.values() if stage.finished]
+        if not finished:
+            return []
+        path = [max(finished, key=lambda stage: stage.finished)]
+        while path[-1].dependencies:
+            previous = max(
+                (self.stages[name] for name in path[-1].dependencies),
+                key=lambda stage: stage.finished or 0.0,
+            )
+            path.append(previous)
+        path.reverse()
+        # Results handed in with `provide` took no time in this run
+        return [stage for stage in path if stage.seconds or stage.status != "ok"]
+
+    def summary(self) -> str:
+        """
+        Per-stage start, end and status relative to the start of the run,
+        followed by the critical path.
+        """
+        lines = [
+            "\n" + "=" * 62,
+            "PIPELINE STAGES:",
+            "=" * 62,
+            f"{'Stage':<28} {'Start':>8} {'End':>8} {'Seconds':>8}  Status",
+        ]
+        for stage in self.stages.values():
+            if stage.started is None or stage.started < self.started:
+                continue
+            start = stage.started - self.started
+            end = stage.finished - self.started
+            lines.append(
+                f"{stage.name:<28} {start:>8.2f} {end:>8.2f} "
+                f"{stage.seconds:>8.2f}  {stage.status}"
+            )
+        path = self.critical_path()
+        chain = " -> ".join(f"{stage.name} ({stage.seconds:.2f}s)" for stage in path)
+        total = self.finished - self.started
+        lines.append(
+            f"Critical path: {chain} = {sum(stage.seconds for stage in path):.2f}s"
+            f" of {total:.2f}s"
+        )
+        return "\n".join(lines)
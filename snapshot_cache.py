@@ -0,0 +1,165 @@
+"""
+On-disk cache of the aggregates extracted from a snapshot.
+
+Re-running the reports for a snapshot (a backfill, or a change to
+ADDRESS_MAPPINGS or CODE_REMAPPINGS) doesn't need another pass over the
+file: consumers that define CACHE_SECTION, to_cache and from_cache store
+what they collected as MessagePack, keyed by the snapshot's size, mtime and
+a hash of its first bytes. An entry is only used when its snapshot time
+also matches exchange.context.time, which is read from the snapshot on
+load (from the path index's span when there is one). Entries are evicted
+least recently used first once the cache grows past its disk budget.
+
+Settings come from the environment:
+- SNAPSHOT_CACHE_DIR: cache directory (default .snapshot_cache)
+- SNAPSHOT_CACHE_MB: disk budget in megabytes, fractions allowed (default 2048)
+"""
+
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, Optional
+
+from extract import read_snapshot_time
+from sources import is_stream
+
+# Bytes hashed from the start of the snapshot
+HASH_PREFIX_BYTES = 4 * 1024 * 1024
+MANIFEST = "manifest.json"
+
+
+def fingerprint(filename: Any) -> Optional[str]:
+    """
+    Return the cache key of the snapshot at `filename`, or None for sources
+    that can only be read once.
+    """
+    if is_stream(filename):
+        return None
+    stat = os.stat(filename)
+    digest = hashlib.sha256(f"{stat.st_size}:{stat.st_mtime_ns}:".encode())
+    with open(filename, "rb") as f:
+        digest.update(f.read(HASH_PREFIX_BYTES))
+    return digest.hexdigest()[:32]
+
+
+class SnapshotCache:
+    """
+    Cached consumer state per snapshot, one MessagePack file per section.
+
+    The manifest records each entry's snapshot time, size and last use; the
+    snapshot time must match the snapshot's exchange.context.time on load.
+    """
+
+    def __init__(self, directory: str = None, budget_mb: float = None):
+        self.directory = directory or os.getenv("SNAPSHOT_CACHE_DIR", ".snapshot_cache")
+        if budget_mb is None:
+            budget_mb = float(os.getenv("SNAPSHOT_CACHE_MB", "2048"))
+        self.budget = int(budget_mb * 1024 * 1024)
+        # Cache key -> snapshot time read from the file, so the sections of
+        # one snapshot share a single read
+        self._snapshot_times: Dict[str, Any] = {}
+
+    def _read_manifest(self) -> Dict[str, Dict]:
+        try:
+            with open(os.path.join(self.directory, MANIFEST)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_manifest(self, manifest: Dict[str, Dict]) -> None:
+        path = os.path.join(self.directory, MANIFEST)
+        with open(path + ".tmp", "w") as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(path + ".tmp", path)
+
+    def load(self, filename: Any, section: str) -> Optional[Dict]:
+        """
+        Return the cached `section` of the snapshot at `filename`, or None.
+        """
+        import msgpack
+
+        key = fingerprint(filename)
+        if key is None:
+            return None
+        name = f"{key}.{section}.msgpack"
+        manifest = self._read_manifest()
+        entry = manifest.get(name)
+        if entry is None:
+            return None
+        if key not in self._snapshot_times:
+            self._snapshot_times[key] = read_snapshot_time(filename)
+        if entry["snapshot_time"] != self._snapshot_times[key]:
+            return None
+        try:
+            with open(os.path.join(self.directory, name), "rb") as f:
+                data = msgpack.unpack(f, raw=False, strict_map_key=False)
+        except (OSError, ValueError):
+            return None
+
+        entry["last_used"] = time.time()
+        self._write_manifest(manifest)
+        return data
+
+    def store(self, filename: Any, section: str, data: Dict) -> None:
+        """
+        Cache `data` (with its "snapshot_time") as `section` of the snapshot
+        at `filename`, then evict old entries over the disk budget.
+        """
+        import msgpack
+
+        key = fingerprint(filename)
+        if key is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{key}.{section}.msgpack"
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path + ".tmp", "wb") as f:
+                msgpack.pack(data, f, use_bin_type=True)
+        except (OverflowError, TypeError) as e:
+            print(f"Not caching {section}: {e}")
+            os.remove(path + ".tmp")
+            return
+        os.replace(path + ".tmp", path)
+
+        manifest = self._read_manifest()
+        manifest[name] = {
+            "snapshot_time": data.get("snapshot_time"),
+            "bytes": os.path.getsize(path),
+            "last_used": time.time(),
+        }
+        self._evict(manifest, keep=name)
+        self._write_manifest(manifest)
+
+    def _evict(self, manifest: Dict[str, Dict], keep: str) -> None:
+        total = sum(entry["bytes"] for entry in manifest.values())
+        for name in sorted(manifest, key=lambda name: manifest[name]["last_used"]):
+            if total <= self.budget:
+                break
+            if name == keep:
+                continue
+            total -= manifest.pop(name)["bytes"]
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def load_consumer(self, filename: Any, consumer_class):
+        """
+        Return a consumer restored from the cache, or None on a miss.
+        """
+        data = self.load(filename, consumer_class.CACHE_SECTION)
+        if data is None:
+            return None
+        print(
+            f"Loaded {consumer_class.CACHE_SECTION} for snapshot "
+            f"{data['snapshot_time']} from {self.directory}"
+        )
+        return consumer_class.from_cache(data)
+
+    def store_consumer(self, filename: Any, consumer) -> None:
+        """
+        Cache the state of a filled consumer.
+        """
+        self.store(filename, consumer.CACHE_SECTION, consumer.to_cache())
@@ -0,0 +1,94 @@
+"""
+Snapshot sources that can only be read once.
+
+Besides a regular file, a snapshot can come from stdin ("-"), a named pipe
+or any open file object, so parsing can start while translate-abci-state is
+still writing. These sources are read in a single forward pass: the path
+index and the process-pool split, which both seek, don't apply to them.
+"""
+
+import io
+import os
+import stat
+import sys
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+STDIN = "-"
+# Read size for streams that aren't buffered already
+STREAM_BUFFER_SIZE = 1024 * 1024
+
+
+def is_stream(source: Any) -> bool:
+    """
+    Whether `source` is stdin, a named pipe, a character device or a file
+    object rather than a regular file path.
+    """
+    if hasattr(source, "read") or source == STDIN:
+        return True
+    try:
+        mode = os.stat(source).st_mode
+    except OSError:
+        return False
+    return stat.S_ISFIFO(mode) or stat.S_ISCHR(mode)
+
+
+def source_size(source: Any) -> Optional[int]:
+    """
+    Size in bytes of a regular file, or None for streams.
+    """
+    if is_stream(source):
+        return None
+    try:
+        return os.path.getsize(source)
+    except OSError:
+        return None
+
+
+def describe(source: Any) -> str:
+    """
+    Name of `source` for log messages.
+    """
+    if source == STDIN:
+        return "stdin"
+    return str(getattr(source, "name", source))
+
+
+class _ReadAdapter(io.RawIOBase):
+    """
+    Raw binary view of any object with a `read` method. Text is encoded as
+    UTF-8.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.pending = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if not self.pending:
+            data = self.f.read(len(buffer))
+            self.pending = data.encode("utf-8") if isinstance(data, str) else data
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+
+@contextmanager
+def open_stream(source: Any) -> Iterator[io.BufferedIOBase]:
+    """
+    Open `source` as a buffered binary stream that supports `peek`.
+    File objects passed in are wrapped, not closed.
+    """
+    if source == STDIN:
+        yield sys.stdin.buffer
+    elif not hasattr(source, "read"):
+        with open(source, "rb", buffering=STREAM_BUFFER_SIZE) as f:
+            yield f
+    elif hasattr(source, "peek"):
+        yield source
+    else:
+        yield io.BufferedReader(_ReadAdapter(source), STREAM_BUFFER_SIZE)
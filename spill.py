@@ -0,0 +1,204 @@
+"""
+Aggregation within a memory budget, spilling sorted runs to disk.
+
+The fee tracker keeps every referrer and the staking parser every delegation
+until the pass is over, so their memory grows with the chain state rather
+than with the reports. With a budget, the consumers here watch the
+estimated size of what they have aggregated. Once it is exceeded, they
+write it to a temporary file as a sorted run and start over: referrer
+totals sorted by address, delegations grouped by validator and sorted by
+stake.
+
+When the pass is done the runs are merged as they are read. Referrer runs
+stream through the totals, the Top N rankings and the referral code counts.
+Delegation runs stream through the nivo buckets and the CSV writer one
+validator at a time. The results match an in-memory run exactly.
+
+The budget applies to each consumer's aggregates and is estimated from
+their sizes, not measured; parser buffers and the reports come on top.
+Snapshots that fit stay in memory and are not written anywhere.
+
+Settings come from the environment:
+- MEMORY_BUDGET_MB: budget per consumer in megabytes (default: no budget)
+- SPILL_DIR: directory for the runs (default: the system temp directory)
+"""
+
+import heapq
+import os
+import shutil
+import tempfile
+import weakref
+from operator import itemgetter
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from delegation_table import SpilledDelegationTable
+from delegations import DelegationsConsumer
+from main import FeeTrackerConsumer
+
+# Approximate bytes per referrer across referral_fees and
+# referrer_address_counts, measured with tracemalloc
+REFERRER_BYTES = 200
+# Entries aggregated between size checks
+CHECK_INTERVAL = 1024
+
+
+def budget_bytes(budget_mb: Optional[float] = None) -> Optional[int]:
+    """
+    The memory budget in bytes: `budget_mb`, or MEMORY_BUDGET_MB when it is
+    None. Returns None when neither is set.
+    """
+    if budget_mb is None:
+        budget_mb = float(os.getenv("MEMORY_BUDGET_MB", "0")) or None
+    if not budget_mb:
+        return None
+    return int(budget_mb * 1024 * 1024)
+
+
+def spill_directory(owner: object) -> str:
+    """
+    Create a temporary directory for runs, removed once `owner` is garbage
+    collected or the interpreter exits.
+    """
+    directory = tempfile.mkdtemp(prefix="snapshot-spill-", dir=os.getenv("SPILL_DIR"))
+    weakref.finalize(owner, shutil.rmtree, directory, True)
+    return directory
+
+
+def _within_budget(entries: Iterable, consumer) -> Iterator:
+    # Checks between entries, so a user is never split across runs
+    for i, entry in enumerate(entries):
+        if i % CHECK_INTERVAL == 0 and consumer.size > consumer.budget:
+            consumer.spill()
+        yield entry
+
+
+def _read_run(filename: str) -> Iterator[Tuple]:
+    import msgpack
+
+    with open(filename, "rb") as f:
+        yield from msgpack.Unpacker(f, use_list=False, read_size=256 * 1024)
+
+
+class SpillingFeeTrackerConsumer(FeeTrackerConsumer):
+    """
+    FeeTrackerConsumer that writes its referrer totals to sorted runs on
+    disk whenever they outgrow `budget` bytes.
+    """
+
+    def __init__(self, budget: int, paths=None):
+        super().__init__(paths)
+        self.budget = budget
+        self.runs: List[str] = []
+        # Referrers written so far, so ranks keep counting across runs
+        self.ranked = 0
+        self.directory = None
+
+    @property
+    def size(self) -> int:
+        return len(self.referrer_address_counts) * REFERRER_BYTES
+
+    def aggregate_user_states(self, user_states):
+        super().aggregate_user_states(_within_budget(user_states, self))
+
+    def spill(self) -> None:
+        """
+        Write the referrer totals as a run sorted by address and clear them.
+        """
+        import msgpack
+
+        if self.directory is None:
+            self.directory = spill_directory(self)
+        rows = sorted(super().referrer_totals(), key=itemgetter(0))
+        filename = os.path.join(self.directory, f"referrers-{len(self.runs)}.msgpack")
+        packer = msgpack.Packer()
+        with open(filename, "wb") as f:
+            for address, reward, count, rank, reward_rank in rows:
+                if reward_rank is not None:
+                    reward_rank += self.ranked
+                f.write(
+                    packer.pack(
+                        (address, reward, count, self.ranked + rank, reward_rank)
+                    )
+                )
+        print(f"Spilled {len(rows):,} referrers to {filename}")
+        self.runs.append(filename)
+        self.ranked += len(rows)
+        # Cleared in place: aggregate_user_states holds references to them
+        self.referral_fees.clear()
+        self.referrer_address_counts.clear()
+
+    def referrer_totals(
+        self,
+    ) -> Iterator[Tuple[str, Optional[int], int, int, Optional[int]]]:
+        """
+        Like FeeTrackerConsumer.referrer_totals, merged from the runs in
+        address order once anything was spilled.
+        """
+        if not self.runs:
+            yield from super().referrer_totals()
+            return
+        if self.referrer_address_counts:
+            self.spill()
+
+        # Runs are in aggregation order, so the first row of a referrer
+        # carries its first referral, and its first row with rewards their
+        # first appearance
+        current = None
+        runs = [_read_run(filename) for filename in self.runs]
+        for row in heapq.merge(*runs, key=itemgetter(0)):
+            address, reward, count, _, reward_rank = row
+            if current is not None and current[0] == address:
+                if reward is not None:
+                    if current[1] is None:
+                        current[1] = 0
+                        current[4] = reward_rank
+                    current[1] += reward
+                current[2] += count
+                continue
+            if current is not None:
+                yield tuple(current)
+            current = list(row)
+        if current is not None:
+            yield tuple(current)
+
+
+class SpillingDelegationsConsumer(DelegationsConsumer):
+    """
+    DelegationsConsumer that writes its delegation columns to sorted runs on
+    disk whenever they outgrow `budget` bytes. build_table then returns a
+    SpilledDelegationTable.
+    """
+
+    def __init__(self, budget: int, paths=None):
+        super().__init__(paths)
+        self.budget = budget
+        self.spilled: Optional[SpilledDelegationTable] = None
+
+    @property
+    def size(self) -> int:
+        return self.builder.size
+
+    def aggregate_delegations(self, user_to_delegations):
+        super().aggregate_delegations(_within_budget(user_to_delegations, self))
+
+    def spill(self) -> None:
+        """
+        Write the delegations collected so far as a sorted run.
+        """
+        if self.spilled is None:
+            table = SpilledDelegationTable(None)
+            table.directory = spill_directory(table)
+            self.spilled = table
+        rows = self.builder.row_count
+        self.spilled.spill(self.builder)
+        print(f"Spilled {rows:,} delegations to {self.spilled.runs[-1][0]}")
+
+    def build_table(self):
+        if self.spilled is None:
+            return super().build_table()
+        if self.table is None:
+            if self.builder.groups:
+                self.spill()
+            self.table = self.spilled.finish()
+            self.builder = None
+        return self.table
@@ -0,0 +1,52 @@
+#!/bin/bash
+
+# Translate the newest ABCI snapshot and parse it at the same time: hl-node
+# writes the JSON into a named pipe that pipeline.py reads from, so data.json
+# never touches disk and parsing overlaps the translation.
+
+# Set the working directory to the script's location
+cd "$(dirname "$0")"
+
+# Activate virtual environment
+source venv/bin/activate
+
+CURRENT_DATE=$(date +"%Y%m%d")
+
+SOURCE_DIR="$HOME/hl/data/periodic_abci_states"
+
+LATEST_FILE=$(ls -t "$SOURCE_DIR/$CURRENT_DATE"/*.rmp 2>/dev/null | head -n1)
+
+if [ -z "$LATEST_FILE" ]; then
+    echo "No .rmp files found in $SOURCE_DIR/$CURRENT_DATE"
+    exit 1
+fi
+
+FIFO_DIR=$(mktemp -d)
+FIFO="$FIFO_DIR/data.json"
+mkfifo "$FIFO"
+trap 'rm -rf "$FIFO_DIR"' EXIT
+
+"$HOME/hl-node" --chain Mainnet translate-abci-state "$LATEST_FILE" "$FIFO" &
+TRANSLATE_PID=$!
+
+# Fee tracker and staking consumers share the one forward pass over the pipe
+python cli.py all "$FIFO"
+PARSE_STATUS=$?
+
+# A parser that failed before opening the pipe leaves hl-node blocked in
+# open(), and one that failed mid-read leaves it to die of SIGPIPE: stop it
+# and report the parse error instead
+if [ $PARSE_STATUS -ne 0 ]; then
+    kill $TRANSLATE_PID 2>/dev/null
+    wait $TRANSLATE_PID 2>/dev/null
+    echo "Parsing failed with exit code $PARSE_STATUS"
+    exit $PARSE_STATUS
+fi
+
+wait $TRANSLATE_PID
+TRANSLATE_STATUS=$?
+
+if [ $TRANSLATE_STATUS -ne 0 ]; then
+    echo "Translation failed"
+    exit 1
+fi
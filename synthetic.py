@@ -0,0 +1,163 @@
+"""
+Deterministic generator of data.json-shaped snapshots for benchmarks.
+
+The fixture has the sections the parsers read (exchange.context.time,
+fee_tracker user_states, code_to_referrer and collected_builder_fees, and
+c_staking user_to_delegations) plus filler subtrees that they have to skip,
+with escaped strings and nested brackets. The same seed and counts always
+produce the same bytes. It is written element by element, so fixtures
+larger than memory can be generated.
+
+Usage:
+    python synthetic.py bench.json --users 500000 --delegators 200000
+"""
+
+import json
+import random
+from typing import Dict, TextIO
+
+SNAPSHOT_TIME = "2026-01-01T00:00:00.000"
+# Bumped whenever the generated bytes change, so cached fixtures are rebuilt
+FORMAT = 2
+
+# Counts at scale 1; benchmark.py multiplies them
+DEFAULT_COUNTS = {
+    "users": 50_000,
+    "max_t_entries": 4,
+    "builders": 50,
+    "referrers": 500,
+    "validators": 30,
+    "delegators": 25_000,
+    "filler": 50_000,
+}
+# Share of users with a referrer
+REFERRED_SHARE = 0.4
+
+
+def _address(rng: random.Random) -> str:
+    return "0x%040x" % rng.getrandbits(160)
+
+
+def _write_array(out: TextIO, items) -> None:
+    out.write("[")
+    for i, item in enumerate(items):
+        if i:
+            out.write(", ")
+        out.write(json.dumps(item))
+    out.write("]")
+
+
+def _user_states(rng: random.Random, counts: Dict[str, int], referrers, stats):
+    for _ in range(counts["users"]):
+        user = {"b": {"p": [rng.randrange(10**6), {"m": 'x"]}', "o": []}]}}
+        # "r" comes before "T", as in real snapshots: the json_stream
+        # backends then read T without summing it ahead of its referrer
+        if rng.random() < REFERRED_SHARE:
+            user["r"] = rng.choice(referrers)
+            user["T"] = [
+                [rng.randrange(10), {"r": rng.randrange(10**12), "v": 0}]
+                for _ in range(rng.randint(0, counts["max_t_entries"]))
+            ]
+            stats["referred_users"] += 1
+            stats["t_entries"] += len(user["T"])
+        else:
+            user["T"] = []
+        yield [_address(rng), user]
+
+
+def _delegations(rng: random.Random, counts: Dict[str, int], validators, stats):
+    for _ in range(counts["delegators"]):
+        delegations = []
+        for validator in rng.sample(validators, rng.randint(1, 3)):
+            # Mostly shrimp, some dolphins and a few whales
+            tier = rng.random()
+            if tier < 0.7:
+                wei = rng.randint(1, 10**11)
+            elif tier < 0.95:
+                wei = rng.randint(10**11, 10**12)
+            else:
+                wei = rng.randint(10**12, 10**15)
+            delegations.append([validator, {"wei": wei, "l": None}])
+        stats["delegations"] += len(delegations)
+        yield [_address(rng), delegations]
+
+
+def write_snapshot(
+    out: TextIO, seed: int = 0, counts: Dict[str, int] = None
+) -> Dict[str, int]:
+    """
+    Write a synthetic snapshot to `out`.
+
+    Args:
+        out: Text file to write to
+        seed: Random seed; equal seeds and counts give identical output
+        counts: Overrides of DEFAULT_COUNTS
+
+    Returns:
+        The counts used plus the number of referred users, T entries and
+        delegations written
+    """
+    counts = {**DEFAULT_COUNTS, **(counts or {})}
+    rng = random.Random(seed)
+    stats = dict(counts, format=FORMAT, referred_users=0, t_entries=0, delegations=0)
+
+    referrers = [_address(rng) for _ in range(counts["referrers"])]
+    builders = [_address(rng) for _ in range(counts["builders"])]
+    validators = [_address(rng) for _ in range(counts["validators"])]
+
+    out.write(
+        '{"exchange": {"context": {"time": %s, "height": 1}, '
+        % (json.dumps(SNAPSHOT_TIME))
+    )
+    out.write('"locus": {"filler": ')
+    _write_array(
+        out,
+        (
+            {"k": 'v\\"]', "n": [i, i * 2.5, True, None], "s": {"t": "[{"}}
+            for i in range(counts["filler"])
+        ),
+    )
+    out.write('}, "fee_tracker": {"user_states": ')
+    _write_array(out, _user_states(rng, counts, referrers, stats))
+    out.write(', "code_to_referrer": ')
+    _write_array(
+        out,
+        ([f"CODE{i}", referrer] for i, referrer in enumerate(referrers[::2])),
+    )
+    out.write(', "collected_builder_fees": ')
+    _write_array(
+        out,
+        ([builder, [[0, rng.randrange(10**13)]]] for builder in builders),
+    )
+    out.write('}, "c_staking": {"validators": ')
+    _write_array(out, ([validator, {"stake": 0}] for validator in validators))
+    out.write(', "delegations": {"user_to_delegations": ')
+    _write_array(out, _delegations(rng, counts, validators, stats))
+    out.write("}}}}")
+    return stats
+
+
+def generate(filename: str, seed: int = 0, counts: Dict[str, int] = None):
+    """
+    Write a synthetic snapshot to `filename`. Returns write_snapshot's stats.
+    """
+    with open(filename, "w", buffering=1024 * 1024) as f:
+        return write_snapshot(f, seed, counts)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate a synthetic snapshot")
+    parser.add_argument("filename", nargs="?", default="synthetic.json")
+    parser.add_argument("--seed", type=int, default=0)
+    for name, default in DEFAULT_COUNTS.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=default)
+    args = parser.parse_args()
+
+    stats = generate(
+        args.filename,
+        args.seed,
+        {name: getattr(args, name) for name in DEFAULT_COUNTS},
+    )
+    print(f"Wrote {args.filename}: {stats}")
@@ -0,0 +1,65 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import backends  # noqa: E402
+import synthetic  # noqa: E402
+
+# Small enough to parse in well under a second on every backend
+SMALL_COUNTS = {
+    "users": 3000,
+    "builders": 10,
+    "referrers": 60,
+    "validators": 12,
+    "delegators": 1500,
+    "filler": 200,
+}
+
+INSTALLED_BACKENDS = [
+    name for name in backends.BACKENDS if backends._load(name) is not None
+]
+
+
+@pytest.fixture(autouse=True)
+def run_directory(tmp_path, monkeypatch):
+    """
+    Run every test in its own directory, so caches, state files and CSVs
+    don't leak between tests, with the metrics file and API posts off.
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("METRICS_FILE", "")
+    monkeypatch.setenv("SNAPSHOT_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.delenv("MEMORY_BUDGET_MB", raising=False)
+    monkeypatch.delenv("REPORT_TOP_N", raising=False)
+    return tmp_path
+
+
+def make_snapshot(directory, seed=0, **counts) -> str:
+    filename = os.path.join(
+        str(directory), f"snapshot-s{seed}-{counts.get('users', 'n')}.json"
+    )
+    if not os.path.exists(filename):
+        synthetic.generate(filename, seed, {**SMALL_COUNTS, **counts})
+    return filename
+
+
+@pytest.fixture(scope="session")
+def snapshot(tmp_path_factory) -> str:
+    """
+    A small synthetic data.json.
+    """
+    return make_snapshot(tmp_path_factory.mktemp("snapshots"))
+
+
+@pytest.fixture(scope="session")
+def snapshots(tmp_path_factory):
+    """
+    Two consecutive snapshots: the second has the first's users minus the
+    last 500, and different delegations.
+    """
+    directory = tmp_path_factory.mktemp("consecutive")
+    return make_snapshot(directory), make_snapshot(directory, users=2500)
@@ -0,0 +1,118 @@
+import json
+
+import pytest
+
+import analytics
+import delegations
+import spill
+from delegation_table import DelegationTable
+
+
+def plain(table):
+    """
+    The table as the (validator, [(staker, wei), ...]) lists the per-delegation
+    loops take.
+    """
+    return [(validator, list(rows)) for validator, rows in table]
+
+
+def without_numpy(monkeypatch):
+    monkeypatch.setattr(analytics, "np", None)
+    monkeypatch.setattr(analytics, "_numpy_checked", True)
+
+
+@pytest.fixture
+def huge_snapshot(tmp_path):
+    """
+    A snapshot with stakes above 2**53 wei, where floats lose precision,
+    next to shrimp, dolphins and ordinary whales.
+    """
+    stakes = [
+        2**63 - 1,
+        2**60 + 3,
+        # Round differently as float64 / 10**8 than as int / 10**8
+        5213289892782500337,
+        8693652828285500047,
+        2**53 + 1,
+        2**53 - 1,
+        10**15 + 7,
+        123_456_789_012,
+        10**11 + 1,
+        99_999,
+    ]
+    user_to_delegations = [
+        [
+            "0x%040x" % i,
+            [["0xvalidator%d" % (i % 2), {"wei": wei, "l": None}]],
+        ]
+        for i, wei in enumerate(stakes)
+    ]
+    filename = str(tmp_path / "huge.json")
+    with open(filename, "w") as f:
+        json.dump(
+            {
+                "exchange": {
+                    "context": {"time": "2026-01-01T00:00:00.000"},
+                    "c_staking": {
+                        "delegations": {"user_to_delegations": user_to_delegations}
+                    },
+                }
+            },
+            f,
+        )
+    return filename
+
+
+def parse_table(filename, **kwargs):
+    table, _ = delegations.parse_delegations(filename, use_cache=False, **kwargs)
+    return table
+
+
+@pytest.mark.parametrize("fixture", ["snapshot", "huge_snapshot"])
+def test_vectorized_matches_loop(request, fixture):
+    table = parse_table(request.getfixturevalue(fixture))
+    assert isinstance(table, DelegationTable)
+    assert analytics._load_numpy()
+    expected = delegations.delegations_to_nivo_json(plain(table))
+    assert delegations.delegations_to_nivo_json(table) == expected
+    assert delegations.calculate_validator_stats(
+        table
+    ) == delegations.calculate_validator_stats(plain(table))
+
+
+@pytest.mark.parametrize("fixture", ["snapshot", "huge_snapshot"])
+def test_without_numpy_matches_loop(request, fixture, monkeypatch):
+    table = parse_table(request.getfixturevalue(fixture))
+    without_numpy(monkeypatch)
+    assert delegations.delegations_to_nivo_json(
+        table
+    ) == delegations.delegations_to_nivo_json(plain(table))
+
+
+@pytest.mark.parametrize("fixture", ["snapshot", "huge_snapshot"])
+def test_spilled_table_matches(request, fixture, monkeypatch):
+    # Check the budget after every staker, so the tiny fixture spills too
+    monkeypatch.setattr(spill, "CHECK_INTERVAL", 1)
+    filename = request.getfixturevalue(fixture)
+    table = parse_table(filename)
+    spilled = parse_table(filename, memory_budget=0.0001)
+    assert not isinstance(spilled, DelegationTable)
+    assert delegations.delegations_to_nivo_json(
+        spilled
+    ) == delegations.delegations_to_nivo_json(table)
+    assert delegations.calculate_validator_stats(
+        spilled
+    ) == delegations.calculate_validator_stats(table)
+
+
+def test_huge_stakes_keep_their_precision(huge_snapshot):
+    amounts = {
+        child["address"]: child["amount"]
+        for validator in delegations.delegations_to_nivo_json(
+            parse_table(huge_snapshot)
+        )["children"]
+        for child in validator["children"]
+    }
+    assert amounts["0x%040x" % 0] == round((2**63 - 1) / 10**8, 2)
+    assert amounts["0x%040x" % 2] == 52132898927.83
+    assert amounts["0x%040x" % 3] == 86936528282.85
@@ -0,0 +1,128 @@
+import gzip
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import api_client
+
+
+class StubAPI:
+    """
+    Local stand-in for the builder codes API. Answers each POST with the
+    next of `statuses` (201 once they run out), after `delay` seconds.
+    """
+
+    def __init__(self, statuses=(), delay=0.0):
+        self.statuses = list(statuses)
+        self.delay = delay
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                stub.requests.append((self.path, dict(self.headers), body))
+                time.sleep(stub.delay)
+                status = stub.statuses.pop(0) if stub.statuses else 201
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                except OSError:
+                    # The client gave up waiting
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def api_environment(monkeypatch):
+    monkeypatch.setenv("BUILDER_CODES_TOKEN", "token")
+    monkeypatch.setenv("BUILDER_CODES_RETRIES", "3")
+    monkeypatch.delenv("BUILDER_CODES_GZIP", raising=False)
+    monkeypatch.delenv("BUILDER_CODES_TIMEOUT", raising=False)
+    # Each test gets a session with its own retry settings
+    monkeypatch.setattr(api_client, "_session", None)
+    yield
+    if api_client._session is not None:
+        api_client._session.close()
+
+
+def test_retries_unavailable_server(monkeypatch):
+    with StubAPI(statuses=[503]) as stub:
+        monkeypatch.setenv("BUILDER_CODES_HOST", stub.url)
+        response = api_client.post_json("/api/v1/test", {"snapshot": {"a": 1}})
+    assert response.status_code == 201
+    assert len(stub.requests) == 2
+    path, headers, body = stub.requests[-1]
+    assert path == "/api/v1/test"
+    assert headers["X-Token"] == "token"
+    assert json.loads(body) == {"snapshot": {"a": 1}}
+
+
+def test_gives_up_after_retries(monkeypatch):
+    monkeypatch.setenv("BUILDER_CODES_RETRIES", "1")
+    with StubAPI(statuses=[502, 502, 502]) as stub:
+        monkeypatch.setenv("BUILDER_CODES_HOST", stub.url)
+        response = api_client.post_json("/api/v1/test", {"snapshot": {}})
+    assert response.status_code == 502
+    assert len(stub.requests) == 2
+
+
+def test_read_timeout_is_not_retried(monkeypatch):
+    # The server may have stored the snapshot, so posting again could
+    # duplicate it
+    monkeypatch.setenv("BUILDER_CODES_TIMEOUT", "0.2")
+    with StubAPI(delay=1.0) as stub:
+        monkeypatch.setenv("BUILDER_CODES_HOST", stub.url)
+        with pytest.raises(requests.RequestException):
+            api_client.post_json("/api/v1/test", {"snapshot": {}})
+    assert len(stub.requests) == 1
+
+
+def test_gzip_bodies_decode_to_the_payload(monkeypatch):
+    monkeypatch.setenv("BUILDER_CODES_GZIP", "1")
+    payload = {
+        "builder_codes_snapshot": {
+            "data": {f"BUILDER{i}": i * 1.5 for i in range(200)},
+            "taken_at": "2026-01-01T00:00:00.000",
+        }
+    }
+    with StubAPI() as stub:
+        monkeypatch.setenv("BUILDER_CODES_HOST", stub.url)
+        api_client.post_json("/api/v1/builder_codes_snapshots", payload)
+        # Small bodies are sent as they are
+        api_client.post_json("/api/v1/test", {"snapshot": {}})
+
+    _, headers, body = stub.requests[0]
+    assert headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(body)) == payload
+    _, headers, body = stub.requests[1]
+    assert "Content-Encoding" not in headers
+    assert json.loads(body) == {"snapshot": {}}
+
+
+def test_missing_token(monkeypatch):
+    monkeypatch.delenv("BUILDER_CODES_TOKEN")
+    with pytest.raises(RuntimeError):
+        api_client.post_json("/api/v1/test", {})
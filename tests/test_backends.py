@@ -0,0 +1,37 @@
+import pytest
+
+import backends
+
+
+@pytest.fixture(autouse=True)
+def fresh_selection(monkeypatch):
+    monkeypatch.setattr(backends, "_selected", {})
+    monkeypatch.setattr(backends, "_logged", set())
+
+
+def test_quiet_lookup_doesnt_hide_the_choice(capsys):
+    backend = backends.get_backend("auto", log=False)
+    assert capsys.readouterr().out == ""
+
+    assert backends.get_backend("auto") is backend
+    assert capsys.readouterr().out == f"Using {backend.name} parser backend\n"
+
+    # Printed once per name
+    assert backends.get_backend("auto") is backend
+    assert capsys.readouterr().out == ""
+
+
+def test_fallback_is_printed_after_a_quiet_lookup(capsys, monkeypatch):
+    load = backends._load
+    monkeypatch.setattr(
+        backends, "_load", lambda name: None if name == "rust" else load(name)
+    )
+    backend = backends.get_backend("rust", log=False)
+    assert backend.key != "rust"
+    assert capsys.readouterr().out == ""
+
+    backends.get_backend("rust")
+    assert capsys.readouterr().out == (
+        "Parser backend rust is not installed, falling back\n"
+        f"Using {backend.name} parser backend\n"
+    )
@@ -0,0 +1,56 @@
+"""
+pytest-benchmark cases for the parsers and reports benchmark.py times, on a
+small synthetic snapshot. Run only these with:
+
+    python -m pytest tests/test_benchmark.py --benchmark-only
+"""
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+import delegations  # noqa: E402
+import main  # noqa: E402
+from conftest import INSTALLED_BACKENDS  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def table(snapshot):
+    table, _ = delegations.parse_delegations(snapshot, use_cache=False)
+    return table
+
+
+@pytest.fixture(autouse=True)
+def quiet(capsys):
+    yield
+    capsys.readouterr()
+
+
+@pytest.mark.parametrize("backend", INSTALLED_BACKENDS)
+def test_parse_json_file(benchmark, snapshot, backend):
+    report = benchmark(main.parse_json_file, snapshot, backend=backend, use_cache=False)
+    # The reward totals are part of the workload
+    assert report[2] > 0
+
+
+@pytest.mark.parametrize("backend", INSTALLED_BACKENDS)
+def test_parse_delegations(benchmark, snapshot, backend):
+    table, _ = benchmark.pedantic(
+        delegations.parse_delegations,
+        (snapshot,),
+        {"backend": backend, "use_cache": False},
+        rounds=3,
+    )
+    assert table.row_count > 0
+
+
+def test_delegations_to_nivo_json(benchmark, table):
+    benchmark(delegations.delegations_to_nivo_json, table)
+
+
+def test_calculate_validator_stats(benchmark, table):
+    benchmark(delegations.calculate_validator_stats, table)
+
+
+def test_save_delegations_to_csv(benchmark, table):
+    benchmark(delegations.save_delegations_to_csv, table, "delegations.csv")
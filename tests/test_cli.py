@@ -0,0 +1,85 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import cli
+import delegations
+import main
+import pipeline
+import r2
+
+ROOT = os.path.dirname(os.path.abspath(cli.__file__))
+
+
+def loaded_modules(code):
+    """
+    The HEAVY_MODULES loaded after running `code` in a fresh interpreter.
+    """
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            f"import sys; {code}; "
+            "print(*[m for m in cli.HEAVY_MODULES if m in sys.modules])",
+        ],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return result.stdout.split("\n")[-2].split()
+
+
+def test_import_loads_no_heavy_module():
+    assert loaded_modules("import cli") == []
+
+
+def test_dry_run_loads_neither_boto3_nor_requests(snapshot, run_directory):
+    # NumPy is loaded by the reports; the R2 and API clients aren't needed
+    modules = loaded_modules(
+        "import os, cli; "
+        f"os.chdir({str(run_directory)!r}); "
+        f"cli.main(['all', {snapshot!r}, '--no-upload', '--no-post'])"
+    )
+    assert "boto3" not in modules
+    assert "requests" not in modules
+
+
+def fail(*args, **kwargs):
+    raise AssertionError("called in a dry run")
+
+
+@pytest.mark.parametrize(
+    "args, skipped",
+    [
+        (
+            ["all", "--no-upload", "--no-post"],
+            [
+                "Skipping builder codes snapshot post",
+                "Skipping R2 upload",
+                "Skipping staking snapshot post",
+            ],
+        ),
+        (["parse-fees", "--no-post"], ["Skipping builder codes snapshot post"]),
+        (
+            ["parse-delegations", "--no-upload", "--no-post"],
+            ["Skipping R2 upload", "Skipping staking snapshot post"],
+        ),
+    ],
+)
+def test_skip_flags(args, skipped, snapshot, monkeypatch, capsys):
+    for module, name in [
+        (main, "send_to_api"),
+        (pipeline, "send_to_api"),
+        (delegations, "send_validators_to_api"),
+        (delegations, "upload_to_r2"),
+        (r2, "upload"),
+    ]:
+        monkeypatch.setattr(module, name, fail)
+    assert cli.main(args[:1] + [snapshot] + args[1:]) == 0
+    out = capsys.readouterr().out
+    for message in skipped:
+        assert message in out
+    assert "Error" not in out
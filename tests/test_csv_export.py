@@ -0,0 +1,142 @@
+import csv
+import gzip
+import io
+
+import pytest
+
+import csv_export
+import delegations
+from delegation_table import DelegationTable, DelegationTableBuilder
+
+
+@pytest.fixture(scope="module")
+def table(snapshot):
+    table, _ = delegations.parse_delegations(snapshot, use_cache=False)
+    assert isinstance(table, DelegationTable)
+    return table
+
+
+def plain(table):
+    return [(validator, list(rows)) for validator, rows in table]
+
+
+def baseline_csv(validator_delegations):
+    """
+    save_delegations_to_csv as it was before the streaming export.
+    """
+    buffer = io.StringIO(newline="")
+    writer = csv.writer(buffer)
+    writer.writerow(["Validator address", "Staker address", "Amount"])
+    for validator_address, rows in validator_delegations:
+        for staker_address, wei_amount in rows:
+            token_amount = wei_amount / (10**8)
+            writer.writerow([validator_address, staker_address, f"{token_amount:.8f}"])
+    return buffer.getvalue().encode("utf-8")
+
+
+def exported(validator_delegations, **kwargs):
+    return b"".join(csv_export.iter_csv_chunks(validator_delegations, **kwargs))
+
+
+def test_matches_the_baseline_csv(table):
+    # Synthetic stakes stay below 2**53 wei, where the float amounts were exact
+    expected = baseline_csv(plain(table))
+    assert csv_export._plain_text(table) is not None
+    assert exported(table) == expected
+    assert exported(plain(table)) == expected
+
+    delegations.save_delegations_to_csv(table, "delegations.csv")
+    with open("delegations.csv", "rb") as f:
+        assert f.read() == expected
+
+
+@pytest.mark.parametrize("batch_rows", [1, 7, csv_export.BATCH_ROWS])
+def test_fast_path_matches_csv_writer(table, batch_rows):
+    chunks = list(csv_export.iter_csv_chunks(table, batch_rows=batch_rows))
+    fallback = list(csv_export.iter_csv_chunks(plain(table), batch_rows=batch_rows))
+    assert b"".join(chunks) == b"".join(fallback)
+    if batch_rows == 7:
+        assert len(chunks) > len(table.validators)
+
+
+@pytest.mark.parametrize(
+    "validator, staker",
+    [
+        ('0xvalidator,"quoted"', "0xstaker"),
+        ("0xvalidator", "0xstaker\n"),
+        ("0xv", "0xé"),
+    ],
+)
+def test_tables_that_need_csv_writer(validator, staker):
+    builder = DelegationTableBuilder()
+    builder.add(validator, builder.add_staker(staker), 5)
+    builder.add("0xother", builder.add_staker("0xplain"), 10**12 + 1)
+    table = builder.build()
+    assert csv_export._plain_text(table) is None
+    assert exported(table) == baseline_csv(plain(table))
+
+
+def test_amounts_are_exact_above_2_53():
+    rows = [("0xvalidator", [("0xa", 2**63 - 1), ("0xb", 1), ("0xc", 10**8)])]
+    lines = exported(rows).decode().splitlines()
+    assert lines[1:] == [
+        "0xvalidator,0xa,92233720368.54775807",
+        "0xvalidator,0xb,0.00000001",
+        "0xvalidator,0xc,1.00000000",
+    ]
+
+
+def test_gzip(table):
+    size = csv_export.write_csv(table, "delegations.csv.gz", "gzip")
+    with open("delegations.csv.gz", "rb") as f:
+        data = f.read()
+    assert len(data) == size
+    assert gzip.decompress(data) == exported(table)
+
+
+def test_zstd(table):
+    zstandard = pytest.importorskip("zstandard")
+    csv_export.write_csv(table, "delegations.csv.zst", "zstd")
+    with open("delegations.csv.zst", "rb") as f:
+        reader = zstandard.ZstdDecompressor().stream_reader(f)
+        assert reader.read() == exported(table)
+
+
+def test_unknown_compression(table):
+    with pytest.raises(ValueError, match="brotli"):
+        csv_export.write_csv(table, "delegations.csv.br", "brotli")
+
+
+@pytest.mark.parametrize("compression", [None, "gzip"])
+def test_stream_tees_the_uploaded_bytes(table, compression):
+    suffix = csv_export.SUFFIXES[compression]
+    csv_export.write_csv(table, "written.csv" + suffix, compression)
+    with open("written.csv" + suffix, "rb") as f:
+        written = f.read()
+
+    stream = csv_export.CsvStream(table, compression, "teed.csv" + suffix)
+    uploaded = b""
+    # Odd sizes split chunks across reads
+    while True:
+        part = stream.read(4099)
+        uploaded += part
+        if len(part) < 4099:
+            break
+    assert stream.read(10) == b""
+    stream.close()
+
+    with open("teed.csv" + suffix, "rb") as f:
+        teed = f.read()
+    assert uploaded == teed == written
+    assert stream.bytes_written == len(written)
+
+
+def test_drain_finishes_the_local_copy(table):
+    stream = csv_export.CsvStream(table, tee_filename="teed.csv")
+    head = stream.read(100)
+    assert stream.drain() == len(exported(table))
+    stream.close()
+    with open("teed.csv", "rb") as f:
+        teed = f.read()
+    assert teed == exported(table)
+    assert teed.startswith(head)
@@ -0,0 +1,125 @@
+import msgpack
+
+from delegation_table import (
+    DelegationTable,
+    DelegationTableBuilder,
+    StringTable,
+    merge_tables,
+)
+
+
+def plain(table):
+    return [(validator, list(rows)) for validator, rows in table]
+
+
+def add(builder, delegations):
+    """
+    Add (staker, [(validator, wei), ...]) entries to `builder`, each staker's
+    address once as DelegationsConsumer does.
+    """
+    for staker, rows in delegations:
+        staker_id = builder.add_staker(staker)
+        for validator, wei in rows:
+            builder.add(validator, staker_id, wei)
+    return builder
+
+
+def build(delegations):
+    return add(DelegationTableBuilder(), delegations).build()
+
+
+def test_string_table():
+    strings = StringTable()
+    assert [strings.add(value) for value in ["0xa", "", "0xé", "0xa"]] == [0, 1, 2, 3]
+    assert [strings[i] for i in range(4)] == ["0xa", "", "0xé", "0xa"]
+
+    other = StringTable()
+    other.add("0xb")
+    other.add("0xc")
+    assert strings.extend(other) == 4
+    assert list(strings) == ["0xa", "", "0xé", "0xa", "0xb", "0xc"]
+    assert len(strings) == 6
+
+
+def test_staker_address_is_stored_once():
+    # The rows of a staker under every validator share its address id
+    table = build([("0xs", [("v1", 5), ("v2", 7), ("v3", 1)]), ("0xt", [("v1", 3)])])
+    assert list(table.addresses) == ["0xs", "0xt"]
+    assert list(table.stakers) == [0, 1, 0, 0]
+    assert plain(table) == [
+        ("v1", [("0xs", 5), ("0xt", 3)]),
+        ("v2", [("0xs", 7)]),
+        ("v3", [("0xs", 1)]),
+    ]
+
+
+def test_stakes_sorted_within_a_validator():
+    table = build(
+        [
+            ("0xa", [("v", 5)]),
+            ("0xb", [("v", 9)]),
+            ("0xc", [("v", 5)]),
+            ("0xd", [("v", 1)]),
+            ("0xe", [("v", 9)]),
+        ]
+    )
+    # Largest first, ties in the order they were added
+    assert plain(table) == [
+        ("v", [("0xb", 9), ("0xe", 9), ("0xa", 5), ("0xc", 5), ("0xd", 1)])
+    ]
+    _, rows = table[0]
+    assert list(rows.stakes) == [9, 9, 5, 5, 1]
+    assert rows[1] == ("0xe", 9)
+    assert rows.staker(4) == "0xd"
+
+
+def test_presorted_rows_are_kept_in_order():
+    builder = add(DelegationTableBuilder(), [("0xa", [("v", 1)]), ("0xb", [("v", 9)])])
+    assert plain(builder.build(presorted=True)) == [("v", [("0xa", 1), ("0xb", 9)])]
+
+
+def test_validators_sorted_by_total():
+    table = build(
+        [
+            ("0xa", [("v1", 4), ("v2", 3), ("v3", 10)]),
+            ("0xb", [("v2", 3), ("v4", 6)]),
+        ]
+    )
+    # Ties keep the order the validators first appeared in
+    assert table.validators == ["v3", "v2", "v4", "v1"]
+    assert table.totals == [10, 6, 6, 4]
+    assert table.first_seen == ["v1", "v2", "v3", "v4"]
+    assert list(table.offsets) == [0, 1, 3, 4, 5]
+    assert table.row_count == 5
+
+
+def test_merge_matches_a_single_build():
+    # Consecutive runs of the snapshot, sharing validators and tied stakes
+    runs = [
+        [("0xa", [("v1", 5), ("v2", 2)]), ("0xb", [("v1", 7)])],
+        [("0xc", [("v2", 2), ("v1", 5)]), ("0xd", [("v3", 9)])],
+        [("0xe", [("v1", 7), ("v3", 1)]), ("0xf", [("v2", 2)])],
+    ]
+    single = build([entry for run in runs for entry in run])
+    merged = merge_tables([build(run) for run in runs])
+    assert plain(merged) == plain(single)
+    assert merged.totals == single.totals
+    assert merged.first_seen == single.first_seen
+
+
+def test_cache_round_trip():
+    # Stakes past float and signed 64-bit precision
+    table = build(
+        [
+            ("0xa", [("v1", 2**63 + 1), ("v2", 2**53 + 1)]),
+            ("0xb", [("v2", 2**53 + 3), ("v1", 3)]),
+            ("0xc", [("v2", 0)]),
+        ]
+    )
+    data = msgpack.unpackb(msgpack.packb(table.to_cache(), use_bin_type=True))
+    restored = DelegationTable.from_cache(data)
+    assert plain(restored) == plain(table)
+    assert plain(restored)[0] == ("v1", [("0xa", 2**63 + 1), ("0xb", 3)])
+    assert restored.totals == [2**63 + 4, 2**54 + 4]
+    assert restored.first_seen == table.first_seen
+    assert restored.row_count == 5
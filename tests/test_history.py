@@ -0,0 +1,129 @@
+from collections import defaultdict
+from contextlib import closing
+
+import pytest
+
+import delegations
+import history
+from extract import extract_file
+from main import FeeTrackerConsumer, builder_fee_entries
+
+TIMES = ("2026-01-01T00:00:00.000", "2026-01-02T00:00:00.000")
+
+
+def parse(filename):
+    fee_consumer = FeeTrackerConsumer()
+    extract_file(filename, [fee_consumer])
+    table, _ = delegations.parse_delegations(filename, use_cache=False)
+    return fee_consumer, table
+
+
+@pytest.fixture
+def recorded(snapshots):
+    results = [parse(filename) for filename in snapshots]
+    # A referrer none of whose users has a T in the second snapshot
+    unreadable = next(iter(results[1][0].referral_fees))
+    del results[1][0].referral_fees[unreadable]
+    with closing(history.connect("history.db")) as conn:
+        for (fee_consumer, table), snapshot_time in zip(results, TIMES):
+            history.record_snapshot(conn, fee_consumer, table, snapshot_time, True)
+        yield conn, results, unreadable
+
+
+def test_builder_history(recorded):
+    conn, results, _ = recorded
+    codes_maps = [
+        {referrer: code for code, referrer in fee_consumer.code_to_referrer}
+        for fee_consumer, _ in results
+    ]
+    builder, fees = next(
+        iter(builder_fee_entries(results[0][0], codes_maps[0]).items())
+    )
+    assert history.builder_fee_history(conn, builder) == [
+        (snapshot_time, builder_fee_entries(fee_consumer, codes_map)[builder])
+        for (fee_consumer, _), codes_map, snapshot_time in zip(
+            results, codes_maps, TIMES
+        )
+    ]
+    assert history.builder_fee_history(conn, "NOBODY") == []
+
+
+def test_referrer_history(recorded):
+    conn, results, unreadable = recorded
+    for referrer_address in list(results[0][0].referrer_address_counts)[:5] + [
+        unreadable
+    ]:
+        expected = []
+        for (fee_consumer, _), snapshot_time in zip(results, TIMES):
+            count = fee_consumer.referrer_address_counts.get(referrer_address)
+            if not count:
+                continue
+            reward = fee_consumer.referral_fees.get(referrer_address)
+            expected.append(
+                (snapshot_time, None if reward is None else reward / 10**8, count)
+            )
+        assert history.referrer_reward_history(conn, referrer_address) == expected
+    assert history.referrer_reward_history(conn, unreadable)[-1][1] is None
+
+
+def test_every_counted_referrer_is_recorded(recorded):
+    conn, results, _ = recorded
+    for snapshot_time, (fee_consumer, _) in zip(TIMES, results):
+        (recorded_referrers,) = conn.execute(
+            "SELECT COUNT(*) FROM referrer_rewards r "
+            "JOIN snapshots s ON s.id = r.snapshot_id WHERE s.taken_at = ?",
+            (snapshot_time,),
+        ).fetchone()
+        assert recorded_referrers == len(fee_consumer.referrer_address_counts)
+
+
+def test_delegator_history(recorded):
+    conn, results, _ = recorded
+    first_table = results[0][1]
+    staker = first_table.addresses[0]
+    expected = []
+    for (_, table), snapshot_time in zip(results, TIMES):
+        stakes = defaultdict(int)
+        for validator, validator_delegations in table:
+            for delegator, wei_amount in validator_delegations:
+                if delegator == staker:
+                    stakes[validator] += wei_amount
+        expected += [
+            (snapshot_time, validator, stakes[validator] / 10**8)
+            for validator in sorted(stakes)
+        ]
+    assert expected
+    assert history.delegator_stake_history(conn, staker) == expected
+
+
+def test_recording_again_replaces_the_snapshot(recorded):
+    conn, results, _ = recorded
+    fee_consumer, table = results[0]
+    history.record_snapshot(conn, fee_consumer, table, TIMES[0])
+    assert [row[0] for row in conn.execute("SELECT taken_at FROM snapshots")] == [
+        TIMES[1],
+        TIMES[0],
+    ]
+
+
+def test_address_ids_only_looks_up_the_given_addresses(recorded):
+    conn = recorded[0]
+    (known,) = conn.execute("SELECT address FROM addresses LIMIT 1").fetchone()
+    ids = history._address_ids(conn, [known, "0xnew", known])
+    assert set(ids) == {known, "0xnew"}
+    (known_id,) = conn.execute(
+        "SELECT id FROM addresses WHERE address = ?", (known,)
+    ).fetchone()
+    assert ids[known] == known_id
+
+
+def test_delegators_are_opt_in(snapshot):
+    fee_consumer, table = parse(snapshot)
+    with closing(history.connect("history.db")) as conn:
+        history.record_snapshot(conn, fee_consumer, table, TIMES[0])
+        assert conn.execute("SELECT COUNT(*) FROM delegator_stakes").fetchone() == (0,)
+        assert history.delegator_stake_history(conn, table.addresses[0]) == []
+        (addresses,) = conn.execute("SELECT COUNT(*) FROM addresses").fetchone()
+        assert addresses == len(fee_consumer.referrer_address_counts) + len(table)
+        (validators,) = conn.execute("SELECT COUNT(*) FROM validator_stakes").fetchone()
+        assert validators == len(table)
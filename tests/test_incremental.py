@@ -0,0 +1,129 @@
+import json
+
+import pytest
+
+import cli
+from conftest import INSTALLED_BACKENDS
+from delegation_table import DelegationTable, DelegationTableBuilder
+from extract import extract_file
+from incremental import delegations_delta, fee_tracker_delta, load_state
+from main import FeeTrackerConsumer
+
+
+def fee_consumer(filename, backend="ijson"):
+    consumer = FeeTrackerConsumer()
+    extract_file(filename, [consumer], backend=backend)
+    return consumer
+
+
+def table(delegations):
+    builder = DelegationTableBuilder()
+    for staker, rows in delegations:
+        staker_id = builder.add_staker(staker)
+        for validator, wei in rows:
+            builder.add(validator, staker_id, wei)
+    return builder.build()
+
+
+@pytest.mark.parametrize("backend", INSTALLED_BACKENDS)
+def test_incremental_runs(backend, snapshots):
+    for filename in snapshots:
+        exit_code = cli.main(
+            [
+                "all",
+                filename,
+                "--incremental",
+                "--backend",
+                backend,
+                "--no-upload",
+                "--no-post",
+            ]
+        )
+        assert exit_code == 0
+
+    # The state holds the last run's totals
+    state = load_state()["fee_tracker"]
+    consumer = fee_consumer(snapshots[1], backend)
+    assert state["referral_fees"] == consumer.referral_fees
+    assert state["referrer_address_counts"] == consumer.referrer_address_counts
+    assert "users" not in state
+
+    with open("snapshot_delta.json") as f:
+        delta = json.load(f)
+    # The second snapshot drops users and reshuffles every delegation
+    assert delta["from"] is not None
+    assert delta["fee_tracker"]["referral_fees"]
+    assert delta["delegations"]["new"]
+    assert delta["delegations"]["removed"]
+
+
+def write_user_states(filename, user_states):
+    snapshot = {
+        "exchange": {
+            "context": {"time": "2026-01-01T00:00:00.000"},
+            "fee_tracker": {
+                "user_states": user_states,
+                "code_to_referrer": [["REF", "0xref"]],
+                "collected_builder_fees": [],
+            },
+        }
+    }
+    with open(filename, "w") as f:
+        json.dump(snapshot, f)
+    return filename
+
+
+def test_referrer_delta(run_directory):
+    rewarded = ["0xa", {"r": "0xref", "T": [[0, {"r": 5}]]}]
+    unrewarded = ["0xb", {"r": "0xref"}]
+    other = ["0xc", {"r": "0xother", "T": [[0, {"r": 1}]]}]
+    runs = [
+        ([rewarded, unrewarded, other], {"0xref": 5, "0xother": 1}, []),
+        # 0xref keeps a referral, but none of its users has a T any more
+        ([unrewarded, other], {"0xref": None}, []),
+        ([unrewarded], {}, ["0xother"]),
+        ([unrewarded], {}, []),
+    ]
+    state = None
+    for i, (user_states, changed, removed) in enumerate(runs):
+        filename = write_user_states(
+            str(run_directory / f"snapshot{i}.json"), user_states
+        )
+        consumer = fee_consumer(filename)
+        assert fee_tracker_delta(state, consumer) == {
+            "referral_fees": changed,
+            "removed_referrers": removed,
+        }
+        state = {
+            "referral_fees": consumer.referral_fees,
+            "referrer_address_counts": dict(consumer.referrer_address_counts),
+        }
+
+
+def test_delegations_delta():
+    previous = table(
+        [
+            ("0xa", [("v1", 5), ("v2", 3)]),
+            ("0xb", [("v1", 7)]),
+            ("0xc", [("v3", 1)]),
+        ]
+    )
+    current = table(
+        [
+            ("0xa", [("v1", 5), ("v2", 4)]),
+            ("0xd", [("v1", 2), ("v4", 9)]),
+        ]
+    )
+    # As stored in the state file
+    previous = DelegationTable.from_cache(previous.to_cache())
+    assert delegations_delta(previous, current) == {
+        "new": [["0xd", "v1", 2], ["0xd", "v4", 9]],
+        "removed": [["0xb", "v1", 7], ["0xc", "v3", 1]],
+        "changed": [["0xa", "v2", 3, 4]],
+    }
+    assert delegations_delta(current, current) == {
+        "new": [],
+        "removed": [],
+        "changed": [],
+    }
+    assert len(delegations_delta(None, current)["new"]) == current.row_count
@@ -0,0 +1,69 @@
+from collections import defaultdict
+
+import pytest
+
+import main
+from extract import extract_file
+from main import FeeTrackerConsumer, count_referral_codes, rank_referrers
+
+
+def sorted_ranking(consumer, codes_map, top_n):
+    """
+    The rankings as summarize_fee_tracker built them before rank_referrers.
+    """
+    referrers = sorted(
+        consumer.referral_fees.items(), key=lambda x: x[1], reverse=True
+    )[:top_n]
+    codes = sorted(
+        count_referral_codes(consumer, codes_map).items(),
+        key=lambda x: x[1],
+        reverse=True,
+    )[:top_n]
+    return sum(consumer.referral_fees.values()), referrers, codes
+
+
+@pytest.fixture
+def tied_consumer():
+    consumer = FeeTrackerConsumer()
+    # Ties on rewards and on referrals, in and across remapped codes, and
+    # referrers without readable rewards
+    consumer.referrer_address_counts = defaultdict(
+        int,
+        {"0xa": 3, "0xb": 5, "0xc": 3, "0xd": 1, "0xe": 2, "0xf": 3, "0xg": 4},
+    )
+    consumer.referral_fees = {"0xa": 7, "0xc": 9, "0xb": 7, "0xe": 9, "0xf": 7}
+    return consumer
+
+
+CODES_MAP = {
+    "0xa": "A",
+    "0xb": "B",
+    "0xc": "PURPS",
+    "0xd": "D",
+    "0xe": "PHANTOM",
+    "0xf": "F",
+}
+
+
+@pytest.mark.parametrize("top_n", [1, 2, 3, 4, 10])
+def test_ties_rank_as_a_full_sort(tied_consumer, top_n):
+    assert rank_referrers(tied_consumer, CODES_MAP, top_n) == sorted_ranking(
+        tied_consumer, CODES_MAP, top_n
+    )
+
+
+def test_remapped_codes_are_merged(tied_consumer):
+    _, _, codes = rank_referrers(tied_consumer, CODES_MAP, 10)
+    assert dict(codes)["PHANTOM"] == 5
+    assert "PURPS" not in dict(codes)
+    assert main.CODE_REMAPPINGS["PURPS"] == "PHANTOM"
+
+
+@pytest.mark.parametrize("top_n", [5, 30])
+def test_snapshot_ranks_as_a_full_sort(snapshot, top_n):
+    consumer = FeeTrackerConsumer()
+    extract_file(snapshot, [consumer])
+    codes_map = {referrer: code for code, referrer in consumer.code_to_referrer}
+    assert rank_referrers(consumer, codes_map, top_n) == sorted_ranking(
+        consumer, codes_map, top_n
+    )
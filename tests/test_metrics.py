@@ -0,0 +1,197 @@
+import json
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+
+import pytest
+
+import metrics
+
+ALLOCATION_MB = 64
+
+
+@pytest.fixture(autouse=True)
+def fresh_run():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def allocate_and_free():
+    """
+    Raise the RSS peak by ALLOCATION_MB and give the memory back.
+    """
+    block = bytearray(b"\x01") * (ALLOCATION_MB * metrics.MB)
+    del block
+
+
+def by_name():
+    return {span["name"]: span for span in metrics.spans()}
+
+
+def test_nested_spans():
+    with metrics.span("run", entries=3) as run:
+        with metrics.span("parse", bytes=metrics.MB) as parse:
+            parse.entries = 10
+        assert metrics.current() is run
+    assert metrics.current() is None
+
+    assert [span["name"] for span in metrics.spans()] == ["run/parse", "run"]
+    spans = by_name()
+    assert spans["run"]["entries"] == 3
+    assert spans["run/parse"]["entries"] == 10
+    assert spans["run/parse"]["bytes"] == metrics.MB
+    assert spans["run"]["peak_rss_mb"] >= spans["run/parse"]["peak_rss_mb"]
+    assert "peak_rss_shared" not in spans["run"]
+
+
+def test_span_in_another_thread():
+    with metrics.span("run") as run:
+
+        def stage():
+            with metrics.span("stage", parent=run):
+                pass
+
+        thread = threading.Thread(target=stage)
+        thread.start()
+        thread.join()
+    assert [span["name"] for span in metrics.spans()] == ["run/stage", "run"]
+
+
+def test_errors_are_recorded():
+    with pytest.raises(KeyError):
+        with metrics.span("parse"):
+            raise KeyError("exchange")
+    assert metrics.spans()[0]["error"] == "KeyError: 'exchange'"
+
+
+@pytest.mark.skipif(
+    not os.access("/proc/self/clear_refs", os.W_OK), reason="needs clear_refs"
+)
+def test_nested_span_keeps_the_parent_peak():
+    with metrics.span("run"):
+        allocate_and_free()
+        with metrics.span("report"):
+            pass
+    spans = by_name()
+    assert spans["run"]["peak_rss_mb"] - spans["run/report"]["peak_rss_mb"] >= (
+        ALLOCATION_MB * 0.9
+    )
+
+
+@pytest.mark.skipif(
+    not os.access("/proc/self/clear_refs", os.W_OK), reason="needs clear_refs"
+)
+def test_overlapping_spans_share_their_peak():
+    opened = threading.Event()
+    allocated = threading.Event()
+
+    def post():
+        with metrics.span("post"):
+            opened.set()
+            allocated.wait(5)
+
+    with metrics.span("parse"):
+        baseline = metrics._rss_peak()
+        allocate_and_free()
+        thread = threading.Thread(target=post)
+        thread.start()
+        # Opening "post" must not reset the peak "parse" reached
+        opened.wait(5)
+        allocated.set()
+        thread.join()
+
+    spans = by_name()
+    assert spans["parse"]["peak_rss_mb"] >= baseline + ALLOCATION_MB * 0.9
+    assert spans["parse"]["peak_rss_shared"] is True
+    assert spans["post"]["peak_rss_shared"] is True
+
+
+def test_metrics_file(tmp_path):
+    with metrics.span("parse", entries=5, bytes=2 * metrics.MB):
+        pass
+    metrics.record("critical_path", {"stages": ["parse"]})
+    filename = metrics.write_metrics(str(tmp_path / "metrics.json"), command="test")
+
+    with open(filename) as f:
+        written = json.load(f)
+    assert written["command"] == "test"
+    assert written["argv"] == sys.argv
+    assert written["critical_path"] == {"stages": ["parse"]}
+    assert written["peak_rss_mb"] > 0
+    assert [span["name"] for span in written["spans"]] == ["parse"]
+    assert set(written["spans"][0]) >= {"seconds", "entries", "bytes", "peak_rss_mb"}
+    assert not os.path.exists(filename + ".tmp")
+
+
+def test_metrics_file_disabled(monkeypatch, tmp_path):
+    monkeypatch.setenv("METRICS_FILE", "")
+    assert metrics.write_metrics() is None
+    monkeypatch.setenv("METRICS_FILE", str(tmp_path / "run.json"))
+    assert metrics.write_metrics() == str(tmp_path / "run.json")
+
+
+def test_tracemalloc_peaks(monkeypatch):
+    monkeypatch.setenv("METRICS_TRACEMALLOC", "1")
+    try:
+        with metrics.span("parse"):
+            block = [0] * (4 * metrics.MB)
+            del block
+    finally:
+        tracemalloc.stop()
+    assert metrics.spans()[0]["peak_traced_mb"] >= 30
+
+
+def test_cprofile_hook(monkeypatch, tmp_path):
+    filename = str(tmp_path / "run.prof")
+    monkeypatch.setenv("PROFILE", "cprofile")
+    monkeypatch.setenv("PROFILE_FILE", filename)
+    with metrics.profiled():
+        sorted(range(1000), reverse=True)
+    stats = pstats.Stats(filename)
+    assert any(
+        function[2] == "<built-in method builtins.sorted>" for function in stats.stats
+    )
+
+
+def test_pyinstrument_hook(monkeypatch, tmp_path):
+    pytest.importorskip("pyinstrument")
+    filename = str(tmp_path / "run.html")
+    monkeypatch.setenv("PROFILE", "pyinstrument")
+    monkeypatch.setenv("PROFILE_FILE", filename)
+    with metrics.profiled():
+        sorted(range(1000))
+    assert os.path.getsize(filename) > 0
+
+
+def test_profile_hook_off_and_unknown(monkeypatch):
+    monkeypatch.delenv("PROFILE", raising=False)
+    with metrics.profiled():
+        pass
+    assert not os.path.exists("profile.prof")
+    monkeypatch.setenv("PROFILE", "perf")
+    with pytest.raises(ValueError, match="perf"):
+        with metrics.profiled():
+            pass
+
+
+@pytest.mark.parametrize("use_index, workers", [(False, 0), (True, 0), (False, 2)])
+def test_extract_records_the_bytes_read(snapshot, use_index, workers):
+    import main
+    from path_index import get_index
+
+    main.parse_json_file(snapshot, use_index, workers=workers, use_cache=False)
+    read = by_name()["extract"]["bytes"]
+    if not (use_index or workers):
+        assert read == os.path.getsize(snapshot)
+        return
+
+    # The indexed spans the fee tracker paths are read from, and with
+    # workers, the user_states span again for the pool
+    spans = get_index(snapshot)
+    paths = [("exchange", "context"), ("exchange", "fee_tracker")]
+    if workers:
+        paths.append(main.USER_STATES)
+    assert read == sum(spans[path][1] - spans[path][0] for path in paths)
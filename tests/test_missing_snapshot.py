@@ -0,0 +1,44 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import delegations
+import main
+import pipeline
+
+
+@pytest.mark.parametrize("use_cache", [True, False])
+def test_parse_json_file(capsys, use_cache):
+    with pytest.raises(FileNotFoundError):
+        main.parse_json_file("missing.json", use_cache=use_cache)
+    assert "Error: File not found." in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("use_cache", [True, False])
+def test_parse_delegations(capsys, use_cache):
+    with pytest.raises(FileNotFoundError):
+        delegations.parse_delegations("missing.json", use_cache=use_cache)
+    assert "Error: data.json file not found." in capsys.readouterr().out
+
+
+def test_run_pipeline(capsys):
+    with pytest.raises(FileNotFoundError):
+        pipeline.run_pipeline("missing.json", upload=False, post=False)
+    assert "Error: File not found." in capsys.readouterr().out
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ["main.py", "missing.json", "--no-post"],
+        ["delegations.py", "missing.json", "--no-upload", "--no-post"],
+        ["pipeline.py", "missing.json", "--no-upload", "--no-post"],
+        ["r2.py", "missing.json"],
+    ],
+)
+def test_script_exit_code(args):
+    script = os.path.join(os.path.dirname(os.path.dirname(__file__)), args[0])
+    result = subprocess.run([sys.executable, script] + args[1:], capture_output=True)
+    assert result.returncode == 1
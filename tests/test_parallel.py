@@ -0,0 +1,69 @@
+import pytest
+
+import delegations
+import extract
+import main
+from conftest import INSTALLED_BACKENDS
+
+JSON_BACKENDS = [backend for backend in INSTALLED_BACKENDS if backend != "msgpack"]
+
+
+def spy(monkeypatch, module, name):
+    """
+    Count the calls of `module.name`.
+    """
+    calls = []
+    func = getattr(module, name)
+
+    def wrapper(*args, **kwargs):
+        calls.append(args)
+        return func(*args, **kwargs)
+
+    monkeypatch.setattr(module, name, wrapper)
+    return calls
+
+
+def fee_report(filename, workers, backend):
+    fee_entries, *report = main.parse_json_file(
+        filename, backend=backend, workers=workers, use_cache=False
+    )
+    return list(fee_entries.items()), report
+
+
+@pytest.mark.parametrize("backend", JSON_BACKENDS)
+def test_parallel_fee_report_matches_serial(snapshot, backend, monkeypatch):
+    serial = fee_report(snapshot, 0, backend)
+    calls = spy(monkeypatch, main, "aggregate_user_states_parallel")
+    assert fee_report(snapshot, 3, backend) == serial
+    assert len(calls) == 1
+
+
+def delegations_report(filename, workers, backend):
+    table, snapshot_time = delegations.parse_delegations(
+        filename, backend=backend, workers=workers, use_cache=False
+    )
+    delegations.save_delegations_to_csv(table, "delegations.csv")
+    with open("delegations.csv", "rb") as f:
+        csv = f.read()
+    return (
+        snapshot_time,
+        [(validator, list(rows)) for validator, rows in table],
+        delegations.calculate_validator_stats(table),
+        delegations.delegations_to_nivo_json(table),
+        csv,
+    )
+
+
+@pytest.mark.parametrize("backend", JSON_BACKENDS)
+def test_parallel_delegations_match_serial(snapshot, backend, monkeypatch):
+    serial = delegations_report(snapshot, 0, backend)
+    calls = spy(monkeypatch, delegations, "aggregate_delegations_parallel")
+    assert delegations_report(snapshot, 3, backend) == serial
+    assert len(calls) == 1
+
+
+def test_workers_are_not_forked(snapshot, monkeypatch):
+    # The pipeline starts the pools next to threads that may hold locks
+    calls = spy(monkeypatch, extract.multiprocessing, "get_context")
+    fee_report(snapshot, 2, "auto")
+    assert calls == [("spawn",)]
@@ -0,0 +1,157 @@
+import io
+import json
+import mmap
+
+import pytest
+
+from conftest import INSTALLED_BACKENDS
+from delegations import DelegationsConsumer
+from extract import extract_file
+from main import FeeTrackerConsumer
+from path_index import (
+    MappedSpanReader,
+    build_index,
+    get_index,
+    index_filename,
+    load_index,
+    open_span,
+    scan_spans,
+    split_array,
+)
+
+
+def parse(filename, backend, use_index):
+    fee_consumer = FeeTrackerConsumer()
+    delegations_consumer = DelegationsConsumer()
+    extract_file(filename, [fee_consumer, delegations_consumer], use_index, backend)
+    return (
+        fee_consumer.to_cache(),
+        [(v, list(rows)) for v, rows in delegations_consumer.build_table()],
+    )
+
+
+@pytest.mark.parametrize("mmap_enabled", ["1", "0"])
+@pytest.mark.parametrize("backend", INSTALLED_BACKENDS)
+def test_indexed_parse_matches_stream(backend, mmap_enabled, snapshot, monkeypatch):
+    monkeypatch.setenv("SNAPSHOT_MMAP", mmap_enabled)
+    assert parse(snapshot, backend, True) == parse(snapshot, backend, False)
+
+
+def test_index_spans_cover_subtrees(snapshot):
+    index = build_index(snapshot)
+    with open(snapshot, "rb") as f:
+        data = f.read()
+    for start, end in index["spans"].values():
+        assert data[start : start + 1] in (b"{", b"[")
+        assert data[end - 1 : end] in (b"}", b"]")
+
+
+DOCUMENT = json.dumps(
+    {
+        "exchange": {
+            "context": {"time": "2026-01-01T00:00:00.000"},
+            # Brackets, quotes and backslashes inside strings
+            "skipped": [{"a": '[{\\"}'}, ["]]"], 1, "x"],
+            "fee_tracker": {"user_states": [["0xa", {"r": "0xref"}]]},
+        },
+        "c_staking": {"exchange": {"context": {}}},
+    },
+    indent=1,
+).encode()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, len(DOCUMENT)])
+def test_scan_spans_finds_each_path(chunk_size):
+    paths = [
+        ("exchange", "context"),
+        ("exchange", "fee_tracker"),
+        ("exchange", "c_staking"),
+    ]
+    spans = scan_spans(io.BytesIO(DOCUMENT), paths, chunk_size)
+    # Only the top-level key path matches, not the nested one of the same name
+    assert set(spans) == set(paths[:2])
+    for path, (start, end) in spans.items():
+        expected = json.loads(DOCUMENT)["exchange"][path[1]]
+        assert json.loads(DOCUMENT[start:end]) == expected
+
+
+def test_split_array_cuts_between_elements():
+    elements = [[f"0x{i}", {"r": '"]}[{\\' * i, "n": i}] for i in range(50)]
+    document = json.dumps({"rows": elements}).encode()
+    start = document.index(b"[")
+    span = (start, len(document) - 1)
+    for parts in (1, 3, 8, 100):
+        for chunk_size in (5, 64, 4096):
+            runs = split_array(io.BytesIO(document), span, parts, chunk_size)
+            assert runs == sorted(runs)
+            rows = []
+            for run_start, run_end in runs:
+                rows += json.loads(b"[" + document[run_start:run_end] + b"]")
+            assert rows == elements
+            assert len(runs) <= max(parts, 1) + 1
+
+
+def test_stale_index_is_rebuilt(run_directory):
+    path = str(run_directory / "data.json")
+    with open(path, "wb") as f:
+        f.write(DOCUMENT)
+    assert load_index(path) is None
+
+    context = ("exchange", "context")
+    spans = get_index(path, [context])
+    assert set(spans) == {context}
+    assert load_index(path) == spans
+
+    # A path outside the cached index rebuilds it with both
+    fee_tracker = ("exchange", "fee_tracker")
+    assert set(get_index(path, [fee_tracker])) == {context, fee_tracker}
+
+    # A changed snapshot invalidates the index
+    with open(path, "wb") as f:
+        f.write(b" " + DOCUMENT)
+    assert load_index(path) is None
+    with open(index_filename(path), "w") as f:
+        f.write("not json")
+    assert load_index(path) is None
+    start, end = get_index(path, [context])[context]
+    with open(path, "rb") as f:
+        data = f.read()
+    assert json.loads(data[start:end]) == json.loads(DOCUMENT)["exchange"]["context"]
+
+
+@pytest.fixture
+def mapped(run_directory):
+    path = run_directory / "span.bin"
+    path.write_bytes(b"0123456789abcdefghij")
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+
+def test_mapped_reader_frames_the_span(mapped):
+    reader = MappedSpanReader(mapped, 5, 12, b"[", b"]")
+    chunks = []
+    while True:
+        chunk = reader.read(3)
+        if not chunk:
+            break
+        assert isinstance(chunk, bytes)
+        chunks.append(chunk)
+    reader.close()
+    assert b"".join(chunks) == b"[56789ab]"
+
+
+def test_mapped_reader_readinto_fills_across_frames(mapped):
+    reader = MappedSpanReader(mapped, 5, 12, b"[", b"]")
+    buffer = bytearray(6)
+    assert reader.readinto(buffer) == 6
+    assert buffer == b"[56789"
+    assert reader.readinto(buffer) == 3
+    assert buffer[:3] == b"ab]"
+    assert reader.readinto(buffer) == 0
+    reader.close()
+
+
+def test_open_span_decodes_text(mapped):
+    with open_span(mapped, (10, 14), prefix=b'"', suffix=b'"') as span_file:
+        assert span_file.read() == '"abcd"'
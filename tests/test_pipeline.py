@@ -0,0 +1,98 @@
+import json
+import os
+import threading
+
+import pytest
+
+import delegations
+import pipeline
+import r2
+
+
+def test_post_overlaps_the_delegations_pool(snapshot, monkeypatch):
+    # The fee report is posted, holding a lock, while the pool starts
+    pool_started = threading.Event()
+    lock = threading.Lock()
+    posts = []
+    aggregate = pipeline.aggregate_delegations_parallel
+
+    def aggregate_delegations_parallel(*args):
+        pool_started.set()
+        return aggregate(*args)
+
+    def send_to_api(*report):
+        with lock:
+            posts.append(pool_started.wait(10))
+
+    monkeypatch.setattr(
+        pipeline, "aggregate_delegations_parallel", aggregate_delegations_parallel
+    )
+    monkeypatch.setattr(pipeline, "send_to_api", send_to_api)
+    monkeypatch.setattr(delegations, "send_validators_to_api", lambda *args: None)
+    pipeline.run_pipeline(snapshot, workers=2, use_cache=False, upload=False)
+    assert posts == [True]
+
+
+def test_aborted_csv_upload_leaves_no_multipart_upload(snapshot, monkeypatch):
+    moto = pytest.importorskip("moto")
+    from botocore.exceptions import ClientError
+
+    # The CSV streams to a new timestamped key each run, so an upload cut
+    # short can't be resumed and must not stay open in the bucket
+    monkeypatch.setenv("MOTO_S3_CUSTOM_ENDPOINTS", "http://r2.test")
+    monkeypatch.setenv("R2_ENDPOINT_URL", "http://r2.test")
+    monkeypatch.setenv("R2_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("R2_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("R2_BUCKET", "test-bucket")
+    monkeypatch.setattr(r2, "_clients", {})
+    monkeypatch.setattr(r2.time, "sleep", lambda seconds: None)
+    # Small parts, so the synthetic CSV goes up as a multipart upload
+    monkeypatch.setattr(
+        r2,
+        "transfer_settings",
+        lambda: r2.TransferSettings(
+            multipart_threshold=4096, part_size=4096, max_concurrency=2
+        ),
+    )
+    monkeypatch.setattr(delegations, "send_validators_to_api", lambda *args: None)
+
+    with moto.mock_aws():
+        client = r2.get_client(2)
+        client.create_bucket(
+            Bucket="test-bucket",
+            CreateBucketConfiguration={"LocationConstraint": "auto"},
+        )
+        real_upload_part = client.upload_part
+
+        def dropped_connection(**kwargs):
+            if kwargs["PartNumber"] == 3:
+                raise ClientError(
+                    {"Error": {"Code": "RequestTimeout", "Message": "dropped"}},
+                    "UploadPart",
+                )
+            return real_upload_part(**kwargs)
+
+        monkeypatch.setattr(client, "upload_part", dropped_connection)
+        pipeline.run_pipeline(snapshot, use_cache=False, post=False)
+
+        assert client.list_multipart_uploads(Bucket="test-bucket").get("Uploads") is None
+        assert "Contents" not in client.list_objects_v2(Bucket="test-bucket")
+    # The local copy is still written in full
+    assert os.path.getsize("delegations.csv") > 3 * 4096
+
+
+def test_missing_staking_section_still_posts_fees(snapshot, run_directory, monkeypatch):
+    with open(snapshot) as f:
+        document = json.load(f)
+    del document["exchange"]["c_staking"]
+    filename = str(run_directory / "no_staking.json")
+    with open(filename, "w") as f:
+        json.dump(document, f)
+
+    posts = []
+    monkeypatch.setattr(pipeline, "send_to_api", lambda *report: posts.append(report))
+    monkeypatch.setattr(delegations, "send_validators_to_api", lambda *args: None)
+    with pytest.raises(KeyError, match="c_staking"):
+        pipeline.run_pipeline(filename, use_cache=False, upload=False)
+    assert len(posts) == 1
+    assert not os.path.exists("delegations.csv")
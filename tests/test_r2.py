@@ -0,0 +1,172 @@
+import os
+
+import pytest
+
+moto = pytest.importorskip("moto")
+
+import r2  # noqa: E402
+
+BUCKET = "test-bucket"
+# S3 rejects parts below 5 MB other than the last one
+PART_SIZE = 5 * r2.MB
+
+
+@pytest.fixture
+def client(monkeypatch):
+    for name in ("CLOUDFLARE_ACCOUNT_ID", "R2_ENDPOINT_URL"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("R2_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("R2_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("R2_BUCKET", BUCKET)
+    monkeypatch.setattr(r2, "_clients", {})
+    # No backoff between part attempts
+    monkeypatch.setattr(r2.time, "sleep", lambda seconds: None)
+    with moto.mock_aws():
+        client = r2.get_client()
+        client.create_bucket(
+            Bucket=BUCKET, CreateBucketConfiguration={"LocationConstraint": "auto"}
+        )
+        yield client
+
+
+@pytest.fixture
+def settings():
+    return r2.TransferSettings(
+        multipart_threshold=PART_SIZE,
+        part_size=PART_SIZE,
+        # The client fixture is the one upload() picks for this concurrency
+        max_concurrency=8,
+    )
+
+
+@pytest.fixture
+def local_file(run_directory):
+    # Three parts, the last one short
+    path = run_directory / "delegations.csv"
+    path.write_bytes(os.urandom(2 * PART_SIZE + 12345))
+    return str(path)
+
+
+def stored(client, key):
+    return client.get_object(Bucket=BUCKET, Key=key)["Body"].read()
+
+
+def test_multipart_round_trip(client, settings, local_file):
+    stats = r2.upload(local_file, "delegations.csv", settings=settings)
+    with open(local_file, "rb") as f:
+        data = f.read()
+    assert stored(client, "delegations.csv") == data
+    assert stats.parts == 3
+    assert stats.bytes == len(data)
+    assert stats.resumed_bytes == 0
+    assert not os.path.exists(local_file + r2.STATE_SUFFIX)
+
+
+def test_file_object_round_trip(client, settings, local_file):
+    with open(local_file, "rb") as f:
+        stats = r2.upload(f, "stream.csv", settings=settings)
+    with open(local_file, "rb") as f:
+        assert stored(client, "stream.csv") == f.read()
+    assert stats.parts == 3
+
+
+def test_small_upload_is_a_single_request(client, settings, run_directory):
+    path = run_directory / "small.csv"
+    path.write_bytes(b"validator,delegator,amount\n")
+    stats = r2.upload(str(path), "small.csv", settings=settings)
+    assert stored(client, "small.csv") == path.read_bytes()
+    assert stats.parts == 1
+
+
+def test_resumes_after_crash(client, settings, local_file, monkeypatch):
+    upload_part = r2._upload_part
+
+    def crash_on_last_part(client, bucket, key, upload_id, number, data, stats):
+        if number == 3:
+            raise KeyboardInterrupt
+        return upload_part(client, bucket, key, upload_id, number, data, stats)
+
+    monkeypatch.setattr(r2, "_upload_part", crash_on_last_part)
+    with pytest.raises(KeyboardInterrupt):
+        r2.upload(local_file, "delegations.csv", settings=settings)
+    assert os.path.exists(local_file + r2.STATE_SUFFIX)
+
+    monkeypatch.setattr(r2, "_upload_part", upload_part)
+    stats = r2.upload(local_file, "delegations.csv", settings=settings)
+    assert stats.resumed_parts == 2
+    # Only the last part is sent again
+    assert stats.bytes == 12345
+    assert stats.resumed_bytes == 2 * PART_SIZE
+    assert "2 resumed with 10.0 MB already uploaded" in str(stats)
+    with open(local_file, "rb") as f:
+        assert stored(client, "delegations.csv") == f.read()
+    assert not os.path.exists(local_file + r2.STATE_SUFFIX)
+
+
+def test_changed_file_starts_over(client, settings, local_file, monkeypatch):
+    upload_part = r2._upload_part
+
+    def crash_on_last_part(client, bucket, key, upload_id, number, data, stats):
+        if number == 3:
+            raise KeyboardInterrupt
+        return upload_part(client, bucket, key, upload_id, number, data, stats)
+
+    monkeypatch.setattr(r2, "_upload_part", crash_on_last_part)
+    with pytest.raises(KeyboardInterrupt):
+        r2.upload(local_file, "delegations.csv", settings=settings)
+    monkeypatch.setattr(r2, "_upload_part", upload_part)
+
+    with open(local_file, "wb") as f:
+        f.write(os.urandom(2 * PART_SIZE + 1))
+    stats = r2.upload(local_file, "delegations.csv", settings=settings)
+    assert stats.resumed_parts == 0
+    with open(local_file, "rb") as f:
+        assert stored(client, "delegations.csv") == f.read()
+
+
+def test_failed_part_is_retried(client, settings, local_file, monkeypatch):
+    from botocore.exceptions import ClientError
+
+    real_upload_part = client.upload_part
+    failures = {2: 2}
+
+    def flaky_upload_part(**kwargs):
+        number = kwargs["PartNumber"]
+        if failures.get(number):
+            failures[number] -= 1
+            raise ClientError(
+                {"Error": {"Code": "InternalError", "Message": "flaky"}}, "UploadPart"
+            )
+        return real_upload_part(**kwargs)
+
+    monkeypatch.setattr(client, "upload_part", flaky_upload_part)
+    stats = r2.upload(local_file, "delegations.csv", settings=settings)
+    assert stats.retries == 2
+    with open(local_file, "rb") as f:
+        assert stored(client, "delegations.csv") == f.read()
+
+
+def test_local_file_is_read_once(client, settings, local_file, monkeypatch):
+    # The size decides on a multipart upload, without reading a head first
+    reads = []
+
+    def counting_open(path, *args):
+        f = open(path, *args)
+        if path != local_file:
+            return f
+        read = f.read
+
+        class Counting:
+            def __getattr__(self, name):
+                return getattr(f, name)
+
+            def read(self, size=-1):
+                data = read(size)
+                reads.append(len(data))
+                return data
+
+        return Counting()
+
+    monkeypatch.setattr(r2, "open", counting_open, raising=False)
+    r2.upload(local_file, "delegations.csv", settings=settings)
+    assert sum(reads) == os.path.getsize(local_file)
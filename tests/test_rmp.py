@@ -0,0 +1,135 @@
+import json
+import shutil
+import struct
+
+import msgpack
+import pytest
+
+import delegations
+import main
+import rmp
+from conftest import INSTALLED_BACKENDS
+
+
+class Float32(float):
+    pass
+
+
+def pack_wide(value) -> bytes:
+    """
+    MessagePack with every header and integer at its widest marker, as a
+    fixed-width encoder may write them. msgpack.pack picks the smallest.
+    """
+    if value is None:
+        return b"\xc0"
+    if value is True or value is False:
+        return b"\xc3" if value else b"\xc2"
+    if isinstance(value, int):
+        if value < 0:
+            return b"\xd3" + struct.pack(">q", value)
+        return b"\xcf" + struct.pack(">Q", value)
+    if isinstance(value, Float32):
+        return b"\xca" + struct.pack(">f", value)
+    if isinstance(value, float):
+        return b"\xcb" + struct.pack(">d", value)
+    if isinstance(value, str):
+        data = value.encode("utf-8")
+        return b"\xdb" + struct.pack(">I", len(data)) + data
+    if isinstance(value, bytes):
+        return b"\xc6" + struct.pack(">I", len(value)) + value
+    if isinstance(value, msgpack.ExtType):
+        header = struct.pack(">Ib", len(value.data), value.code)
+        return b"\xc9" + header + value.data
+    if isinstance(value, dict):
+        return (
+            b"\xdf"
+            + struct.pack(">I", len(value))
+            + b"".join(pack_wide(k) + pack_wide(v) for k, v in value.items())
+        )
+    return b"\xdd" + struct.pack(">I", len(value)) + b"".join(map(pack_wide, value))
+
+
+# Values the JSON translation can't show as they are, which hl-node may keep
+# in the sections the parsers skip
+NON_JSON = {
+    7: b"\x00\x01" * 10,
+    "ext": msgpack.ExtType(5, b"\x01\x02\x03"),
+    "f32": Float32(0.5),
+    "nested": {1: [b"\xff", -(2**63), 2**64 - 1, None, {2: Float32(1.5)}]},
+}
+
+
+@pytest.fixture(scope="module")
+def wide_rmp_snapshot(snapshot, tmp_path_factory):
+    """
+    The synthetic snapshot re-encoded with the widest headers, and with bin,
+    ext, float32 and integer-keyed maps next to and below every section the
+    parsers read.
+    """
+    with open(snapshot) as f:
+        document = json.load(f)
+    exchange = document["exchange"] = {"node": NON_JSON, **document["exchange"]}
+    exchange["context"]["extra"] = NON_JSON
+    fee_tracker = exchange["fee_tracker"]
+    fee_tracker["pending"] = NON_JSON
+    for _, user in fee_tracker["user_states"][::7]:
+        user["x"] = NON_JSON
+    exchange["c_staking"]["delegations"]["extra"] = NON_JSON
+    filename = str(tmp_path_factory.mktemp("wide_rmp") / "snapshot.rmp")
+    with open(filename, "wb") as f:
+        f.write(pack_wide(document))
+    return filename
+
+
+@pytest.fixture(scope="module")
+def rmp_snapshot(snapshot, tmp_path_factory):
+    filename = str(tmp_path_factory.mktemp("rmp") / "snapshot.rmp")
+    rmp.convert(snapshot, filename)
+    return filename
+
+
+def results(filename, backend="auto"):
+    fee_report = main.parse_json_file(filename, backend=backend, use_cache=False)
+    table, snapshot_time = delegations.parse_delegations(
+        filename, backend=backend, use_cache=False
+    )
+    delegations.save_delegations_to_csv(table, "delegations.csv")
+    with open("delegations.csv", "rb") as f:
+        csv = f.read()
+    return (
+        fee_report,
+        snapshot_time,
+        [(validator, list(rows)) for validator, rows in table],
+        delegations.delegations_to_nivo_json(table),
+        delegations.calculate_validator_stats(table),
+        csv,
+    )
+
+
+@pytest.mark.parametrize("backend", INSTALLED_BACKENDS)
+def test_rmp_matches_json(backend, snapshot, rmp_snapshot):
+    assert results(rmp_snapshot) == results(snapshot, backend)
+
+
+def test_wide_encoding_matches_json(snapshot, wide_rmp_snapshot):
+    assert results(wide_rmp_snapshot) == results(snapshot)
+
+
+def test_positional_structs_fail_loudly(run_directory):
+    # Structs as arrays have none of the keys the parsers look for
+    filename = str(run_directory / "positional.rmp")
+    with open(filename, "wb") as f:
+        msgpack.pack([[["2026-01-01T00:00:00.000", 1], [[], [], []]]], f)
+    with pytest.raises(KeyError, match="exchange"):
+        main.parse_json_file(filename, use_cache=False)
+
+
+def test_detected_without_extension(rmp_snapshot, run_directory):
+    filename = str(run_directory / "snapshot")
+    shutil.copy(rmp_snapshot, filename)
+    assert rmp.is_msgpack(filename)
+    assert results(filename) == results(rmp_snapshot)
+
+
+def test_json_is_not_msgpack(snapshot):
+    assert not rmp.is_msgpack(snapshot)
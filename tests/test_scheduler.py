@@ -0,0 +1,103 @@
+import sys
+import threading
+import time
+
+import pytest
+
+from scheduler import Scheduler, StageSkipped
+
+
+def fail(message):
+    raise ValueError(message)
+
+
+def test_failure_only_skips_dependents(capsys):
+    scheduler = Scheduler(max_workers=2)
+    scheduler.add("parse", lambda: fail("bad snapshot"))
+    scheduler.add("report", lambda parsed: parsed, inputs=["parse"])
+    scheduler.add("post", lambda: "posted", after=["report"])
+    scheduler.add("independent", lambda: "ran")
+    scheduler.add("cleanup", lambda: "cleaned", not_before=["parse"])
+    scheduler.run()
+
+    statuses = {name: stage.status for name, stage in scheduler.stages.items()}
+    assert statuses == {
+        "parse": "failed",
+        "report": "skipped",
+        "post": "skipped",
+        "independent": "ok",
+        "cleanup": "ok",
+    }
+    assert scheduler.result("independent") == "ran"
+    assert scheduler.result("cleanup") == "cleaned"
+    with pytest.raises(StageSkipped):
+        scheduler.result("post")
+    assert scheduler.result("report", None) is None
+    out = capsys.readouterr().out
+    assert "Error in parse: bad snapshot" in out
+    assert "Skipping report: parse didn't finish" in out
+
+
+def test_independent_stages_overlap():
+    both_started = threading.Barrier(2, timeout=5)
+    scheduler = Scheduler(max_workers=2)
+    scheduler.add("first", both_started.wait)
+    scheduler.add("second", both_started.wait)
+    scheduler.run()
+    assert scheduler.stages["first"].status == "ok"
+    assert scheduler.stages["second"].status == "ok"
+
+
+def test_raise_first():
+    scheduler = Scheduler()
+    scheduler.add("ok", lambda: 1)
+    scheduler.add("first", lambda: fail("first"))
+    scheduler.add("second", lambda: fail("second"))
+    scheduler.run()
+
+    scheduler.raise_first(["ok", "missing"])
+    with pytest.raises(ValueError, match="second"):
+        scheduler.raise_first(["ok", "second", "first"])
+    with pytest.raises(ValueError, match="first"):
+        scheduler.result("first")
+
+
+def test_system_exit_in_a_stage():
+    scheduler = Scheduler()
+    scheduler.add("exit", lambda: sys.exit(3))
+    scheduler.add("after", lambda: None, after=["exit"])
+    with pytest.raises(SystemExit):
+        scheduler.run()
+
+    assert scheduler.stages["exit"].status == "failed"
+    with pytest.raises(SystemExit):
+        scheduler.raise_first(["exit"])
+    with pytest.raises(SystemExit):
+        scheduler.result("exit")
+
+
+def test_failed_stage_without_an_error():
+    scheduler = Scheduler()
+    scheduler.add("stage", lambda: None)
+    scheduler.stages["stage"].status = "failed"
+    with pytest.raises(RuntimeError, match="stage failed"):
+        scheduler.raise_first(["stage"])
+
+
+def test_critical_path(capsys):
+    scheduler = Scheduler(max_workers=4)
+    scheduler.provide("snapshot", "data.json")
+    scheduler.add("parse", lambda _: time.sleep(0.1), inputs=["snapshot"])
+    scheduler.add("quick_report", lambda: time.sleep(0.01), after=["parse"])
+    scheduler.add("slow_report", lambda: time.sleep(0.2), after=["parse"])
+    scheduler.add("side", lambda: time.sleep(0.05))
+    scheduler.add(
+        "publish", lambda: None, after=["quick_report", "slow_report", "side"]
+    )
+    scheduler.run()
+
+    path = [stage.name for stage in scheduler.critical_path()]
+    assert path == ["parse", "slow_report", "publish"]
+    out = capsys.readouterr().out
+    assert "Critical path: parse (0.1" in out
+    assert "-> slow_report (0.2" in out
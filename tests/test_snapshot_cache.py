@@ -0,0 +1,132 @@
+import io
+import os
+
+import pytest
+
+import delegations
+import main
+import rmp
+import snapshot_cache
+from extract import read_snapshot_time
+from path_index import build_index
+from snapshot_cache import SnapshotCache
+from synthetic import SNAPSHOT_TIME
+
+OTHER_TIME = "2026-01-01T00:00:01.000"
+
+
+def write_tiny_snapshot(filename, snapshot_time=SNAPSHOT_TIME):
+    with open(filename, "w") as f:
+        f.write('{"exchange": {"context": {"time": "%s"}}}' % snapshot_time)
+    return filename
+
+
+def results(filename):
+    fee_report = main.parse_json_file(filename)
+    table, snapshot_time = delegations.parse_delegations(filename)
+    return (
+        fee_report,
+        snapshot_time,
+        [(validator, list(rows)) for validator, rows in table],
+    )
+
+
+def test_warm_run_matches_cold_run(snapshot, capsys):
+    cold = results(snapshot)
+    assert "Loaded" not in capsys.readouterr().out
+    warm = results(snapshot)
+    out = capsys.readouterr().out
+    assert "Loaded fee_tracker" in out and "Loaded delegations" in out
+    assert warm == cold
+
+
+@pytest.mark.parametrize("indexed", [False, True])
+def test_snapshot_time_is_part_of_the_key(
+    snapshot, tmp_path, monkeypatch, capsys, indexed
+):
+    # Same size, mtime and hashed prefix, different exchange.context.time
+    monkeypatch.setattr(snapshot_cache, "HASH_PREFIX_BYTES", 16)
+    with open(snapshot, "rb") as f:
+        data = f.read()
+    original = str(tmp_path / "original.json")
+    changed = str(tmp_path / "changed.json")
+    with open(original, "wb") as f:
+        f.write(data)
+    with open(changed, "wb") as f:
+        f.write(data.replace(SNAPSHOT_TIME.encode(), OTHER_TIME.encode(), 1))
+    stat = os.stat(original)
+    os.utime(changed, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    if indexed:
+        build_index(original)
+        build_index(changed)
+    assert snapshot_cache.fingerprint(original) == snapshot_cache.fingerprint(changed)
+
+    main.parse_json_file(original)
+    assert SnapshotCache().load(original, "fee_tracker") is not None
+    assert SnapshotCache().load(changed, "fee_tracker") is None
+    capsys.readouterr()
+    assert main.parse_json_file(changed)[1] == OTHER_TIME
+    assert "Loaded" not in capsys.readouterr().out
+
+
+def test_read_snapshot_time(snapshot, tmp_path):
+    assert read_snapshot_time(snapshot) == SNAPSHOT_TIME
+    rmp_filename = str(tmp_path / "snapshot.rmp")
+    rmp.convert(snapshot, rmp_filename)
+    assert read_snapshot_time(rmp_filename) == SNAPSHOT_TIME
+    with open("empty.json", "w") as f:
+        f.write('{"exchange": {}}')
+    assert read_snapshot_time("empty.json") is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch):
+    monkeypatch.setenv("SNAPSHOT_CACHE_MB", "0.25")
+    cache = SnapshotCache()
+    blob = b"x" * 100_000
+    first, second, third = (
+        write_tiny_snapshot(str(tmp_path / f"{name}.json"), snapshot_time)
+        for name, snapshot_time in (
+            ("first", SNAPSHOT_TIME),
+            ("second", OTHER_TIME),
+            ("third", "2026-01-01T00:00:02.000"),
+        )
+    )
+    for filename in (first, second):
+        cache.store(filename, "section", {"snapshot_time": None, "blob": blob})
+    # Stored under the time read on load, so these are all misses
+    assert cache.load(first, "section") is None
+
+    for filename in (first, second):
+        cache.store(
+            filename,
+            "section",
+            {"snapshot_time": read_snapshot_time(filename), "blob": blob},
+        )
+    # Makes the second snapshot the least recently used
+    assert cache.load(first, "section")["blob"] == blob
+    cache.store(
+        third, "section", {"snapshot_time": read_snapshot_time(third), "blob": blob}
+    )
+
+    assert cache.load(first, "section") is not None
+    assert cache.load(second, "section") is None
+    assert cache.load(third, "section") is not None
+    assert len([name for name in os.listdir(cache.directory) if "section" in name]) == 2
+
+
+@pytest.mark.parametrize("source", ["-", io.BytesIO(b"{}")], ids=["stdin", "file"])
+def test_streams_are_not_cached(source):
+    cache = SnapshotCache()
+    cache.store(source, "section", {"snapshot_time": SNAPSHOT_TIME})
+    assert cache.load(source, "section") is None
+    assert not os.path.exists(cache.directory)
+
+
+@pytest.mark.parametrize("value", [2**70, object()], ids=["overflow", "type"])
+def test_unpackable_sections_are_skipped(tmp_path, capsys, value):
+    filename = write_tiny_snapshot(str(tmp_path / "tiny.json"))
+    cache = SnapshotCache()
+    cache.store(filename, "section", {"snapshot_time": SNAPSHOT_TIME, "value": value})
+    assert "Not caching section" in capsys.readouterr().out
+    assert os.listdir(cache.directory) == []
+    assert cache.load(filename, "section") is None
@@ -0,0 +1,158 @@
+import io
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import rmp
+import sources
+from conftest import INSTALLED_BACKENDS, ROOT
+from delegations import DelegationsConsumer
+from extract import extract_file, parallel_workers
+from main import FeeTrackerConsumer
+
+fifo_only = pytest.mark.skipif(not hasattr(os, "mkfifo"), reason="needs os.mkfifo")
+
+
+@pytest.fixture(scope="module")
+def rmp_snapshot(snapshot, tmp_path_factory):
+    filename = str(tmp_path_factory.mktemp("sources_rmp") / "snapshot.rmp")
+    rmp.convert(snapshot, filename)
+    return filename
+
+
+def parsed(source, backend="auto", **kwargs):
+    fee_consumer = FeeTrackerConsumer()
+    delegations_consumer = DelegationsConsumer()
+    extract_file(
+        source, [fee_consumer, delegations_consumer], backend=backend, **kwargs
+    )
+    table = delegations_consumer.build_table()
+    return (
+        fee_consumer.snapshot_time,
+        fee_consumer.referral_fees,
+        dict(fee_consumer.referrer_address_counts),
+        fee_consumer.code_to_referrer,
+        fee_consumer.builder_fees,
+        fee_consumer.user_count,
+        [(validator, list(rows)) for validator, rows in table],
+    )
+
+
+def read_bytes(filename):
+    with open(filename, "rb") as f:
+        return f.read()
+
+
+def fifo_from(filename, run_directory):
+    """
+    A named pipe fed `filename` in small writes by a background thread.
+    """
+    fifo = str(run_directory / "snapshot.fifo")
+    os.mkfifo(fifo)
+    data = read_bytes(filename)
+
+    def feed():
+        with open(fifo, "wb") as f:
+            for start in range(0, len(data), 4096):
+                f.write(data[start : start + 4096])
+
+    thread = threading.Thread(target=feed, daemon=True)
+    thread.start()
+    return fifo, thread
+
+
+class Unbuffered:
+    """
+    A file object with only `read`, as sockets and decompressors give.
+    """
+
+    def __init__(self, data):
+        self.f = io.BytesIO(data) if isinstance(data, bytes) else io.StringIO(data)
+        self.name = "unbuffered"
+
+    def read(self, size=-1):
+        # Short reads, like a pipe
+        return self.f.read(min(size, 1000) if size and size > 0 else size)
+
+
+@pytest.mark.parametrize("backend", INSTALLED_BACKENDS)
+def test_stdin(backend, snapshot, monkeypatch):
+    expected = parsed(snapshot, backend)
+    with open(snapshot, "rb") as f:
+        monkeypatch.setattr(sys, "stdin", io.TextIOWrapper(f))
+        assert parsed(sources.STDIN, backend) == expected
+
+
+@fifo_only
+@pytest.mark.parametrize("backend", INSTALLED_BACKENDS)
+def test_named_pipe(backend, snapshot, run_directory):
+    expected = parsed(snapshot, backend)
+    fifo, thread = fifo_from(snapshot, run_directory)
+    assert sources.is_stream(fifo)
+    assert sources.source_size(fifo) is None
+    assert parsed(fifo, backend) == expected
+    thread.join(5)
+
+
+@fifo_only
+def test_rmp_through_a_named_pipe(snapshot, rmp_snapshot, run_directory):
+    fifo, thread = fifo_from(rmp_snapshot, run_directory)
+    assert parsed(fifo) == parsed(snapshot)
+    thread.join(5)
+
+
+@pytest.mark.parametrize("backend", INSTALLED_BACKENDS)
+@pytest.mark.parametrize(
+    "wrap",
+    [
+        io.BytesIO,
+        lambda data: io.BufferedReader(io.BytesIO(data)),
+        Unbuffered,
+        lambda data: Unbuffered(data.decode("utf-8")),
+    ],
+    ids=["bytesio", "buffered", "read-only", "text"],
+)
+def test_file_objects(backend, wrap, snapshot):
+    source = wrap(read_bytes(snapshot))
+    assert sources.is_stream(source)
+    assert parsed(source, backend) == parsed(snapshot, backend)
+
+
+def test_rmp_file_object(snapshot, rmp_snapshot):
+    assert parsed(io.BytesIO(read_bytes(rmp_snapshot))) == parsed(snapshot)
+
+
+def test_streams_skip_the_index_and_workers(snapshot, capsys):
+    assert parsed(io.BytesIO(read_bytes(snapshot)), use_index=True) == parsed(snapshot)
+    assert parallel_workers(sources.STDIN, 4) == 0
+    out = capsys.readouterr().out
+    assert "The path index needs a regular file, streaming" in out
+    assert "Parallel aggregation needs a regular file, streaming stdin" in out
+
+
+def test_regular_files(snapshot):
+    assert not sources.is_stream(snapshot)
+    assert not sources.is_stream("missing.json")
+    assert sources.source_size(snapshot) == os.path.getsize(snapshot)
+    assert sources.source_size("missing.json") is None
+    assert sources.describe(snapshot) == snapshot
+    assert sources.describe(sources.STDIN) == "stdin"
+
+
+def test_piped_into_the_cli(snapshot):
+    def export(source, output, stdin=None):
+        subprocess.run(
+            [sys.executable, os.path.join(ROOT, "cli.py"), "export", source]
+            + ["--output", output, "--no-cache"],
+            stdin=stdin,
+            check=True,
+            capture_output=True,
+        )
+        return read_bytes(output)
+
+    with open(snapshot, "rb") as f:
+        piped = export(sources.STDIN, "piped.csv", stdin=f)
+    assert piped == export(snapshot, "file.csv")
@@ -0,0 +1,201 @@
+"""
+Budgeted runs against an in-memory run and against the parsers as they were
+before the extraction engine, reimplemented here on json_stream.
+"""
+
+import json
+from collections import defaultdict
+
+import json_stream
+import pytest
+
+import delegations
+import main
+from conftest import INSTALLED_BACKENDS
+from delegation_table import SpilledDelegationTable
+
+# Small enough that every consumer spills several runs
+BUDGET_MB = 0.01
+
+
+@pytest.fixture(scope="module")
+def mixed_snapshot(snapshot, tmp_path_factory):
+    """
+    The synthetic snapshot with the keys of every third referred user in
+    reverse order, so "T" comes ahead of "r".
+    """
+    with open(snapshot) as f:
+        data = json.load(f)
+    user_states = data["exchange"]["fee_tracker"]["user_states"]
+    for i, user_entry in enumerate(user_states):
+        user = user_entry[1]
+        if "r" in user and "T" in user and i % 3 == 0:
+            user_entry[1] = dict(reversed(list(user.items())))
+            assert list(user_entry[1]).index("T") < list(user_entry[1]).index("r")
+    filename = str(tmp_path_factory.mktemp("mixed") / "snapshot.json")
+    with open(filename, "w") as f:
+        json.dump(data, f)
+    return filename
+
+
+def reference_fee_report(filename, top_n=30):
+    """
+    parse_json_file as it was before the extraction engine, minus printing.
+    """
+    with open(filename) as f:
+        fee_tracker = json_stream.load(f)["exchange"]["fee_tracker"]
+        referral_fees = {}
+        referrer_address_counts = defaultdict(int)
+        for user_entry in fee_tracker["user_states"]:
+            user_data = user_entry[1]
+            referrer_address = user_data.get("r")
+            if referrer_address:
+                referrer_address_counts[referrer_address] += 1
+                try:
+                    t_array = user_data.get("T")
+                except Exception:
+                    continue
+                if referrer_address not in referral_fees:
+                    referral_fees[referrer_address] = 0
+                for t_entry in t_array:
+                    referral_fees[referrer_address] += t_entry[1].get("r", 0) / 10**8
+
+        total_referral_fees = sum(referral_fees.values())
+        sorted_referral_fees = sorted(
+            referral_fees.items(), key=lambda x: x[1], reverse=True
+        )
+        codes_map = {
+            referrer: code for code, referrer in fee_tracker["code_to_referrer"]
+        }
+        referral_code_counts = {}
+        for referrer_address, count in referrer_address_counts.items():
+            referral_code = codes_map.get(referrer_address)
+            if referral_code:
+                referral_code = main.CODE_REMAPPINGS.get(referral_code, referral_code)
+                referral_code_counts[referral_code] = (
+                    referral_code_counts.get(referral_code, 0) + count
+                )
+        sorted_referral_codes = sorted(
+            referral_code_counts.items(), key=lambda x: x[1], reverse=True
+        )
+        top_referral_fees = [
+            [
+                main.CODE_REMAPPINGS.get(codes_map.get(address), codes_map.get(address))
+                or address,
+                fees,
+            ]
+            for address, fees in sorted_referral_fees[:top_n]
+        ]
+        fee_entries = {
+            main.format_address(builder_entry[0], codes_map): builder_entry[1][0][1]
+            / 10**8
+            for builder_entry in fee_tracker["collected_builder_fees"]
+        }
+    return (
+        fee_entries,
+        total_referral_fees,
+        [[code, count] for code, count in sorted_referral_codes[:top_n]],
+        top_referral_fees,
+    )
+
+
+def reference_delegations(filename):
+    """
+    parse_delegations as it was before the extraction engine.
+    """
+    with open(filename) as f:
+        data = json_stream.load(f)
+        user_to_delegations = data["exchange"]["c_staking"]["delegations"][
+            "user_to_delegations"
+        ]
+        validator_delegations = defaultdict(list)
+        for user_entry in user_to_delegations:
+            user_address = user_entry[0]
+            for delegation in user_entry[1]:
+                validator_address = delegation[0]
+                validator_delegations[validator_address].append(
+                    (user_address, delegation[1]["wei"])
+                )
+    for validator_address in validator_delegations:
+        validator_delegations[validator_address].sort(
+            key=lambda delegation: delegation[1], reverse=True
+        )
+    return sorted(
+        validator_delegations.items(),
+        key=lambda item: sum(wei for _, wei in item[1]),
+        reverse=True,
+    )
+
+
+def fee_report(filename, backend, memory_budget=None):
+    fee_entries, _, total, codes, fees = main.parse_json_file(
+        filename, backend=backend, use_cache=False, memory_budget=memory_budget
+    )
+    return fee_entries, total, codes, fees
+
+
+def assert_same_fee_report(report, expected):
+    fee_entries, total, codes, fees = report
+    assert fee_entries == expected[0]
+    assert total == pytest.approx(expected[1], rel=1e-12)
+    assert codes == expected[2]
+    assert [name for name, _ in fees] == [name for name, _ in expected[3]]
+    assert [value for _, value in fees] == pytest.approx(
+        [value for _, value in expected[3]], rel=1e-12
+    )
+
+
+@pytest.mark.parametrize("backend", INSTALLED_BACKENDS)
+def test_fee_reports_match_pre_series_parser(backend, snapshot):
+    expected = reference_fee_report(snapshot)
+    assert len(expected[2]) == 30
+
+    assert_same_fee_report(fee_report(snapshot, backend), expected)
+    assert_same_fee_report(fee_report(snapshot, backend, BUDGET_MB), expected)
+
+
+@pytest.mark.parametrize("backend", INSTALLED_BACKENDS)
+def test_fee_reports_ignore_key_order(backend, snapshot, mixed_snapshot):
+    # The pre-series parser dropped the rewards of users with "T" ahead of "r"
+    assert reference_fee_report(mixed_snapshot)[1] < reference_fee_report(snapshot)[1]
+
+    expected = fee_report(snapshot, "ijson")
+    assert fee_report(mixed_snapshot, backend) == expected
+    assert fee_report(mixed_snapshot, backend, BUDGET_MB) == expected
+
+
+@pytest.mark.parametrize("backend", INSTALLED_BACKENDS)
+def test_budgeted_fee_report_matches_in_memory(backend, mixed_snapshot, capsys):
+    in_memory = fee_report(mixed_snapshot, backend)
+    budgeted = fee_report(mixed_snapshot, backend, BUDGET_MB)
+    assert "Spilled" in capsys.readouterr().out
+    assert budgeted == in_memory
+
+
+def test_budgeted_delegations_match_pre_series_parser(snapshot, capsys):
+    expected = reference_delegations(snapshot)
+    table, _ = delegations.parse_delegations(
+        snapshot, use_cache=False, memory_budget=BUDGET_MB
+    )
+    assert "Spilled" in capsys.readouterr().out
+    assert isinstance(table, SpilledDelegationTable)
+    assert [
+        (validator, list(delegation_list)) for validator, delegation_list in table
+    ] == expected
+    assert delegations.delegations_to_nivo_json(
+        table
+    ) == delegations.delegations_to_nivo_json(expected)
+    assert delegations.calculate_validator_stats(
+        table
+    ) == delegations.calculate_validator_stats(expected)
+
+
+def test_budgeted_csv_matches_in_memory(snapshot):
+    in_memory, _ = delegations.parse_delegations(snapshot, use_cache=False)
+    budgeted, _ = delegations.parse_delegations(
+        snapshot, use_cache=False, memory_budget=BUDGET_MB
+    )
+    delegations.save_delegations_to_csv(in_memory, "in_memory.csv")
+    delegations.save_delegations_to_csv(budgeted, "budgeted.csv")
+    with open("in_memory.csv", "rb") as a, open("budgeted.csv", "rb") as b:
+        assert a.read() == b.read()
@@ -0,0 +1,42 @@
+import io
+
+import pytest
+
+import synthetic
+from conftest import INSTALLED_BACKENDS, SMALL_COUNTS
+from delegations import DelegationsConsumer
+from extract import extract_file
+from main import FeeTrackerConsumer
+
+
+def parse(filename, backend):
+    fee_consumer = FeeTrackerConsumer()
+    delegations_consumer = DelegationsConsumer()
+    extract_file(filename, [fee_consumer, delegations_consumer], backend=backend)
+    table = delegations_consumer.build_table()
+    return (
+        fee_consumer.referral_fees,
+        dict(fee_consumer.referrer_address_counts),
+        fee_consumer.builder_fees,
+        [(validator, list(rows)) for validator, rows in table],
+    )
+
+
+def test_same_seed_same_bytes():
+    first, second = io.StringIO(), io.StringIO()
+    synthetic.write_snapshot(first, 3, SMALL_COUNTS)
+    synthetic.write_snapshot(second, 3, SMALL_COUNTS)
+    assert first.getvalue() == second.getvalue()
+
+
+@pytest.mark.parametrize("backend", INSTALLED_BACKENDS)
+def test_backends_read_every_reward(backend, snapshot):
+    referral_fees, referrer_address_counts, builder_fees, table = parse(
+        snapshot, backend
+    )
+    # Every referred user's rewards are readable, whatever the backend
+    assert set(referral_fees) == set(referrer_address_counts)
+    assert sum(referral_fees.values()) > 0
+    assert (referral_fees, referrer_address_counts, builder_fees, table) == parse(
+        snapshot, "python"
+    )
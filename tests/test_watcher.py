@@ -0,0 +1,140 @@
+import json
+import os
+import time
+
+import pytest
+
+import rmp
+import watcher
+from watcher import Ledger, Watcher
+
+PIPELINE_OPTIONS = {"upload": False, "post": False}
+
+
+@pytest.fixture(scope="module")
+def rmp_data(snapshot, tmp_path_factory):
+    filename = str(tmp_path_factory.mktemp("watch_rmp") / "snapshot.rmp")
+    rmp.convert(snapshot, filename)
+    with open(filename, "rb") as f:
+        return f.read()
+
+
+@pytest.fixture
+def watch_dir(tmp_path):
+    directory = tmp_path / "periodic_abci_states"
+    (directory / "20260101").mkdir(parents=True)
+    return str(directory)
+
+
+def add_snapshot(watch_dir, name, data, age=60.0):
+    """
+    Write a snapshot last modified `age` seconds ago.
+    """
+    path = os.path.join(watch_dir, "20260101", name)
+    with open(path, "wb") as f:
+        f.write(data)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def make_watcher(watch_dir, ledger_file="ledger.json", **kwargs):
+    return Watcher(
+        watch_dir,
+        PIPELINE_OPTIONS,
+        Ledger(ledger_file),
+        poll_interval=0.1,
+        settle=kwargs.pop("settle", 1.0),
+        **kwargs,
+    )
+
+
+def statuses(ledger_file="ledger.json"):
+    with open(ledger_file) as f:
+        return {
+            os.path.basename(path): entry["status"]
+            for path, entry in json.load(f).items()
+        }
+
+
+def test_processes_a_snapshot(watch_dir, rmp_data, capsys):
+    add_snapshot(watch_dir, "100.rmp", rmp_data)
+    assert make_watcher(watch_dir).run_once() == 0
+    assert statuses() == {"100.rmp": "processed"}
+    assert "Processed" in capsys.readouterr().out
+    assert os.path.exists("delegations.csv")
+
+
+def test_ledger_survives_restarts(watch_dir, rmp_data):
+    path = add_snapshot(watch_dir, "100.rmp", rmp_data)
+    make_watcher(watch_dir).run_once()
+
+    restarted = make_watcher(watch_dir)
+    assert restarted.pending() == []
+    assert restarted.run_once() is None
+
+    # Written again under the same name: handled again
+    add_snapshot(watch_dir, "100.rmp", rmp_data, age=30.0)
+    assert [snapshot.path for snapshot in restarted.pending()] == [path]
+
+
+def test_skips_to_the_latest_snapshot(watch_dir, rmp_data, capsys):
+    add_snapshot(watch_dir, "100.rmp", rmp_data, age=90.0)
+    add_snapshot(watch_dir, "200.rmp", rmp_data, age=80.0)
+    latest = add_snapshot(watch_dir, "300.rmp", rmp_data, age=70.0)
+    make_watcher(watch_dir).run_once()
+
+    assert statuses() == {
+        "100.rmp": "skipped",
+        "200.rmp": "skipped",
+        "300.rmp": "processed",
+    }
+    with open("ledger.json") as f:
+        entries = json.load(f)
+    assert entries[latest]["skipped"] == [
+        os.path.join(watch_dir, "20260101", name) for name in ("100.rmp", "200.rmp")
+    ]
+    assert "Skipping 2 older snapshot(s)" in capsys.readouterr().out
+
+
+def test_waits_for_snapshots_to_settle(watch_dir, rmp_data):
+    path = add_snapshot(watch_dir, "100.rmp", rmp_data[: len(rmp_data) // 2], age=0)
+    watch = make_watcher(watch_dir, settle=10.0)
+    wait = watch.run_once()
+    assert 9.0 < wait <= 10.0
+    assert not os.path.exists("ledger.json")
+
+    # The rest of the file arrives, then it settles
+    with open(path, "ab") as f:
+        f.write(rmp_data[len(rmp_data) // 2 :])
+    mtime = time.time() - 11.0
+    os.utime(path, (mtime, mtime))
+    assert watch.run_once() == 0
+    assert statuses() == {"100.rmp": "processed"}
+
+
+def test_failed_snapshots_are_not_retried(watch_dir, capsys):
+    add_snapshot(watch_dir, "100.rmp", b"\x81\xa8exchange\x80")
+    watch = make_watcher(watch_dir)
+    assert watch.run_once() == 0
+    assert statuses() == {"100.rmp": "failed"}
+    assert "Error processing" in capsys.readouterr().out
+    assert watch.run_once() is None
+
+
+def test_ledger_in_the_watched_directory(watch_dir, rmp_data):
+    ledger_file = os.path.join(watch_dir, "20260101", ".watch_ledger.json")
+    add_snapshot(watch_dir, "100.rmp", rmp_data)
+    watch = make_watcher(watch_dir, ledger_file)
+    watch.run_once()
+
+    assert os.path.exists(ledger_file)
+    assert [os.path.basename(s.path) for s in watcher.scan(watch_dir)] == ["100.rmp"]
+    assert watch.run_once() is None
+    assert statuses(ledger_file) == {"100.rmp": "processed"}
+
+
+def test_run_once_flag(watch_dir, rmp_data):
+    add_snapshot(watch_dir, "100.rmp", rmp_data)
+    make_watcher(watch_dir).run(once=True)
+    assert statuses() == {"100.rmp": "processed"}
@@ -0,0 +1,373 @@
+"""
+Long-running service that runs the pipeline on every new ABCI snapshot.
+
+Instead of cron starting translate_abci_state.sh and run.sh in a cold
+interpreter for each snapshot, `python cli.py watch` stays resident and
+parses the periodic .rmp snapshots directly. Imports, the API session, the
+R2 client and the address maps are loaded once and reused by every run.
+
+The snapshot directory and its newest date directories are watched with
+inotify, and polled instead where inotify isn't available. Snapshots are
+handled one at a time and only the newest one is picked: snapshots that
+arrived while a run was busy are recorded as skipped instead of queueing
+behind it. Every snapshot handled (processed, failed or skipped) is recorded
+in a ledger, so a restarted watcher doesn't repeat them. Failed snapshots
+aren't retried; remove their ledger entry to run them again.
+
+Settings come from the environment:
+- WATCH_DIR: snapshot directory (default ~/hl/data/periodic_abci_states)
+- WATCH_LEDGER: ledger file (default .watch_ledger.json)
+- WATCH_POLL_INTERVAL: seconds between directory scans when nothing wakes
+  the watcher up (default 30)
+- WATCH_SETTLE_SECONDS: seconds a snapshot must go unmodified before it is
+  read (default 10)
+"""
+
+import ctypes
+import ctypes.util
+import gc
+import json
+import os
+import select
+import signal
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import metrics
+from rmp import RMP_SUFFIX
+
+# Date directories scanned for snapshots, newest first; two cover the
+# snapshots written around midnight
+DATE_DIRECTORIES = 2
+# Ledger entries kept, oldest dropped first
+LEDGER_ENTRIES = 10000
+
+# inotify(7) events that can mean a new snapshot or date directory
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+
+def default_directory() -> str:
+    return os.getenv("WATCH_DIR", os.path.expanduser("~/hl/data/periodic_abci_states"))
+
+
+def default_ledger() -> str:
+    return os.getenv("WATCH_LEDGER", ".watch_ledger.json")
+
+
+class Snapshot(NamedTuple):
+    path: str
+    size: int
+    mtime: float
+
+
+def watched_directories(directory: str) -> List[str]:
+    """
+    `directory` and its newest date directories (named like 20250101).
+    """
+    try:
+        entries = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    dates = sorted((name for name in entries if name.isdigit()), reverse=True)
+    return [directory] + [
+        os.path.join(directory, date) for date in dates[:DATE_DIRECTORIES]
+    ]
+
+
+def scan(directory: str) -> List[Snapshot]:
+    """
+    List the .rmp snapshots in `watched_directories(directory)`, oldest
+    first by modification time.
+    """
+    snapshots = []
+    for folder in watched_directories(directory):
+        try:
+            names = os.listdir(folder)
+        except OSError:
+            continue
+        for name in names:
+            if not name.endswith(RMP_SUFFIX):
+                continue
+            path = os.path.join(folder, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            snapshots.append(Snapshot(path, stat.st_size, stat.st_mtime))
+    snapshots.sort(key=lambda snapshot: (snapshot.mtime, snapshot.path))
+    return snapshots
+
+
+class Ledger:
+    """
+    Snapshots the watcher has handled, stored as JSON keyed by path.
+
+    An entry only matches a snapshot of the same size and mtime, so a file
+    written again under the same name is handled again.
+    """
+
+    def __init__(self, filename: str = None):
+        self.filename = filename or default_ledger()
+        try:
+            with open(self.filename) as f:
+                self.entries: Dict[str, Dict[str, Any]] = json.load(f)
+        except FileNotFoundError:
+            self.entries = {}
+
+    def seen(self, snapshot: Snapshot) -> bool:
+        entry = self.entries.get(snapshot.path)
+        return (
+            entry is not None
+            and entry["size"] == snapshot.size
+            and entry["mtime"] == snapshot.mtime
+        )
+
+    def record(self, snapshot: Snapshot, status: str, **fields) -> None:
+        """
+        Record `snapshot` as processed, failed or skipped, with any extra
+        `fields`, and save the ledger.
+        """
+        self.entries.pop(snapshot.path, None)
+        self.entries[snapshot.path] = {
+            "size": snapshot.size,
+            "mtime": snapshot.mtime,
+            "status": status,
+            "recorded_at": datetime.now(timezone.utc).isoformat(),
+            **fields,
+        }
+        for path in list(self.entries)[: max(0, len(self.entries) - LEDGER_ENTRIES)]:
+            del self.entries[path]
+        self.save()
+
+    def save(self) -> None:
+        with open(self.filename + ".tmp", "w") as f:
+            json.dump(self.entries, f, indent=1)
+        os.replace(self.filename + ".tmp", self.filename)
+
+
+class Inotify:
+    """
+    Minimal inotify(7) binding through libc. Only used to wake the watcher
+    up; which snapshots are new is always decided by a directory scan.
+    """
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.watched = set()
+
+    def watch(self, directory: str) -> None:
+        if directory in self.watched:
+            return
+        if self._add_watch(self.fd, os.fsencode(directory), WATCH_MASK) < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), directory)
+        self.watched.add(directory)
+
+    def drain(self) -> None:
+        """
+        Discard the pending events.
+        """
+        try:
+            while os.read(self.fd, 64 * 1024):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def open_inotify() -> Optional[Inotify]:
+    """
+    Return an Inotify instance, or None where inotify isn't available.
+    """
+    try:
+        return Inotify()
+    except (AttributeError, OSError, TypeError) as e:
+        print(f"inotify unavailable ({e}), polling for new snapshots")
+        return None
+
+
+def warm_up(upload: bool, post: bool) -> None:
+    """
+    Import the pipeline and open the API session and R2 client the runs
+    will share.
+    """
+    with metrics.span("import"):
+        import pipeline  # noqa: F401
+
+    if post:
+        import api_client
+
+        api_client.get_session()
+    if upload:
+        import r2
+
+        r2.get_client(r2.transfer_settings().max_concurrency)
+
+
+class Watcher:
+    """
+    Runs the pipeline on the newest unhandled snapshot in `directory`
+    whenever one appears.
+
+    Args:
+        directory: Snapshot directory (default: WATCH_DIR)
+        pipeline_options: Keyword arguments for pipeline.run_pipeline
+        ledger: Ledger of handled snapshots
+        poll_interval: Seconds between scans when nothing wakes the watcher
+        settle: Seconds a snapshot must go unmodified before it is read
+    """
+
+    def __init__(
+        self,
+        directory: str = None,
+        pipeline_options: Dict[str, Any] = None,
+        ledger: Ledger = None,
+        poll_interval: float = None,
+        settle: float = None,
+    ):
+        self.directory = directory or default_directory()
+        self.pipeline_options = pipeline_options or {}
+        self.ledger = ledger or Ledger()
+        if poll_interval is None:
+            poll_interval = float(os.getenv("WATCH_POLL_INTERVAL", "30"))
+        if settle is None:
+            settle = float(os.getenv("WATCH_SETTLE_SECONDS", "10"))
+        self.poll_interval = poll_interval
+        self.settle = settle
+        self.stopping = False
+        self._wake_read, self._wake_write = os.pipe()
+        os.set_blocking(self._wake_write, False)
+
+    def stop(self, *_) -> None:
+        """
+        Stop once the current run, if any, is done. Safe to call from a
+        signal handler.
+        """
+        self.stopping = True
+        try:
+            os.write(self._wake_write, b"\0")
+        except BlockingIOError:
+            pass
+
+    def pending(self) -> List[Snapshot]:
+        """
+        Snapshots not in the ledger, oldest first.
+        """
+        return [
+            snapshot
+            for snapshot in scan(self.directory)
+            if not self.ledger.seen(snapshot)
+        ]
+
+    def run_once(self) -> Optional[float]:
+        """
+        Process the newest settled snapshot not in the ledger, recording
+        the older ones as skipped.
+
+        Returns:
+            float: seconds until a snapshot still being written settles, 0
+            after a run, or None when there is nothing to wait for
+        """
+        now = time.time()
+        pending = self.pending()
+        ready = [s for s in pending if now - s.mtime >= self.settle]
+        if not ready:
+            if not pending:
+                return None
+            return self.settle - (now - max(s.mtime for s in pending))
+
+        latest = ready[-1]
+        skipped = ready[:-1]
+        for snapshot in skipped:
+            self.ledger.record(snapshot, "skipped", superseded_by=latest.path)
+        if skipped:
+            print(
+                f"Skipping {len(skipped)} older snapshot(s) in favor of "
+                f"{latest.path}"
+            )
+        self.process(latest, [snapshot.path for snapshot in skipped])
+        return 0
+
+    def process(self, snapshot: Snapshot, skipped: List[str]) -> None:
+        from pipeline import run_pipeline
+
+        print(f"Processing {snapshot.path} ({snapshot.size / 1024 / 1024:,.0f} MB)")
+        metrics.reset()
+        start_time = time.time()
+        error = None
+        try:
+            run_pipeline(snapshot.path, **self.pipeline_options)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            print(f"Error processing {snapshot.path}: {error}")
+        seconds = round(time.time() - start_time, 3)
+        metrics.write_metrics(command="watch", snapshot=snapshot.path)
+
+        fields = {"seconds": seconds, "skipped": skipped}
+        if error:
+            self.ledger.record(snapshot, "failed", error=error, **fields)
+        else:
+            self.ledger.record(snapshot, "processed", **fields)
+            print(f"Processed {snapshot.path} in {seconds:.2f} seconds")
+        # Return the run's tables to the allocator before waiting
+        gc.collect()
+
+    def _wait(self, notifier: Optional[Inotify], timeout: float) -> None:
+        descriptors = [self._wake_read]
+        if notifier is not None:
+            for directory in watched_directories(self.directory):
+                try:
+                    notifier.watch(directory)
+                except OSError as e:
+                    print(f"Can't watch {directory}: {e}")
+            descriptors.append(notifier.fd)
+        ready, _, _ = select.select(descriptors, [], [], max(0.0, timeout))
+        if notifier is not None and notifier.fd in ready:
+            notifier.drain()
+
+    def run(self, once: bool = False) -> None:
+        """
+        Watch for snapshots until SIGTERM or SIGINT, or with `once`, process
+        the newest unhandled snapshot (if any) and return.
+        """
+        if once:
+            self.run_once()
+            return
+
+        notifier = open_inotify()
+        handlers = {
+            sig: signal.signal(sig, self.stop)
+            for sig in (signal.SIGTERM, signal.SIGINT)
+        }
+        mode = "inotify" if notifier else f"polling every {self.poll_interval:g}s"
+        print(f"Watching {self.directory} for new snapshots ({mode})")
+        try:
+            while not self.stopping:
+                wait = self.run_once()
+                if self.stopping:
+                    break
+                if wait == 0:
+                    # Check right away for snapshots that arrived during the run
+                    continue
+                timeout = self.poll_interval
+                if wait is not None:
+                    timeout = min(timeout, wait)
+                self._wait(notifier, timeout)
+        finally:
+            for sig, handler in handlers.items():
+                signal.signal(sig, handler)
+            if notifier is not None:
+                notifier.close()
+        print("Watcher stopped")